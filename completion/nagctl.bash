@@ -0,0 +1,85 @@
+# bash completion for nagctl
+#
+# Source this file or copy it to /etc/bash_completion.d. Names of
+# hosts, services, servicegroups and contacts are read from the name
+# index nagctl keeps in --cache-dir, so the directory has to be given
+# on command line or in NAGCTL_COMPLETE_OPTS, for example:
+#
+#   export NAGCTL_COMPLETE_OPTS="--cache-dir /var/cache/nagctl"
+
+_nagctl()
+{
+	local cur prev words cword
+	_init_completion || return
+
+	# Options that select where the name index is.
+	local opts=($NAGCTL_COMPLETE_OPTS) i
+	for ((i = 1; i < cword; i++)); do
+		case ${words[i]} in
+			-c|--cache-dir)
+				opts+=("${words[i]}" "${words[i+1]}")
+				;;
+		esac
+	done
+
+	local kind
+	case $prev in
+		-h) kind=host ;;
+		-s) kind=service ;;
+		-g) kind=servicegroup ;;
+		--contact) kind=contact ;;
+		--contactgroup) kind=contactgroup ;;
+		-c|--archive|--cache-dir|--db|--instances|--metrics-file|--profile-out|--socket)
+			_filedir
+			return
+			;;
+		--author|--rate|--save-selection|--selection|--spread|--state)
+			return
+			;;
+	esac
+	if [[ -n $kind ]]; then
+		local IFS=$'\n'
+		COMPREPLY=($(nagctl "${opts[@]}" complete $kind "$cur" 2>/dev/null))
+		return
+	fi
+
+	if [[ $cur == -* ]]; then
+		COMPREPLY=($(compgen -W '--archive --author --cache-dir -c --db
+			--contact --contactgroup -D -g -h -s -v --impact --instances
+			--metrics-file --profile --profile-out --propagate --prune
+			--rate --save-selection --selection --socket --spread
+			--spread-hash --spread-interval --state --unacked' -- "$cur"))
+		return
+	fi
+
+	# Count words that are not options or their values.
+	local args=0
+	for ((i = 1; i < cword; i++)); do
+		case ${words[i]} in
+			-c|-g|-h|-s|--archive|--author|--cache-dir|--contact|--contactgroup|--db|--instances|--metrics-file|--profile-out|--rate|--save-selection|--selection|--socket|--spread|--state)
+				((i++))
+				;;
+			-*)
+				;;
+			*)
+				((args++))
+				;;
+		esac
+	done
+
+	case $args in
+		0)
+			COMPREPLY=($(compgen -W 'search enable disable schedule
+				reschedule acknowledge delete stats batch submit
+				export-sqlite serve' -- "$cur"))
+			;;
+		1)
+			COMPREPLY=($(compgen -W 'all host service' -- "$cur"))
+			;;
+		2)
+			COMPREPLY=($(compgen -W 'notifications checks downtime
+				problems' -- "$cur"))
+			;;
+	esac
+} &&
+complete -F _nagctl nagctl
@@ -22,12 +22,60 @@
 Usage: nagctl [OPTION...] COMMAND SELECTOR [PARAMETER]...
 
 Options:
--c		path to main Nagios config file
+--archive FILE	read main config file and object files from tar, tar.gz
+		or zip archive FILE instead of the filesystem; paths are
+		looked up in the archive with leading / removed
+--author NAME	delete only downtimes scheduled by NAME (default nagctl,
+		any author when NAME is empty)
+--cache-dir DIR	keep resolved host and service assignments and object
+		directory listings in DIR and reuse them while
+		configuration doesn't change; an index of object names
+		used by shell completion is kept there as well
+-c		path to main Nagios config file; repeat to run the command
+		against many Nagios instances in parallel
+--db FILE	read hosts, services and their assignments from a database
+		written by export-sqlite instead of Nagios configuration
+		and query it only for hosts and services a single command
+		selects by name
+--contact NAME	match objects that notify contact NAME
+--contactgroup NAME	match objects that notify any member of contactgroup
+		NAME
 -D		dry-run mode - do not write any commands
+-g REGEXP	match services in servicegroups with names matching REGEXP;
+		whole servicegroups selected get servicegroup commands
 -h REGEXP 	match host name by REGEXP regular expression
 -s REGEXP	match service name by REGEXP regular expression
 -?		print help message
 -v		increase verbosity
+--impact	also match every object that depends on matching ones,
+		directly or not, through hostdependency and
+		servicedependency definitions
+--instances FILE	read paths to main config files of Nagios instances
+		from FILE, one per line
+--metrics-file PATH	atomically write phase durations, object counts,
+		commands and failures of the run to PATH in Prometheus
+		textfile collector format
+--profile	print wall and CPU time of every processing phase, object
+		counts and peak memory use to standard error
+--profile-out FILE	write cProfile statistics of the whole run to FILE
+--propagate	schedule downtime for matching hosts and every host behind
+		them in parent topology, using propagated host downtimes
+--prune		skip commands that would not change current object state
+--rate N	schedule at most N checks in one second
+--save-selection NAME	save objects the command selects as NAME
+--selection NAME	act on objects saved as NAME without reading
+		configuration or matching objects again
+--socket PATH	path to UNIX socket of nagctl daemon (default
+		/var/run/nagctl.sock); commands are sent to the daemon
+		when it is running
+--spread SECONDS	spread scheduled checks over SECONDS instead of
+		scheduling them all at the same time
+--spread-hash	place spread checks by hash of host and service names
+		so that they get the same time on every run
+--spread-interval	spread every check over its check_interval
+--state STATES	match objects in one of comma separated STATES
+		(up, down, unreachable, ok, warning, critical, unknown)
+--unacked	match objects with unacknowledged problems only
 
 COMMANDS:
 search SELECTOR
@@ -41,13 +89,60 @@ enable|disable SELECTOR checks
 
 schedule SELECTOR downtime DURATION COMMENT
   schedule downtime lasting DURATION seconds with COMMENT comment
+  (with --propagate hosts behind matching ones in parent topology
+  are included)
+
+delete SELECTOR downtime [COMMENT]
+  delete downtimes of matching objects scheduled by --author (and
+  with COMMENT comment if given) found in status_file; hosts and
+  hostgroups whose every downtime is deleted are cleared with one
+  command
 
 schedule SELECTOR checks TIME
 reschedule SELECTOR checks TIME
-  schedule next active check in TIME seconds
+  schedule next active check in TIME seconds (checks can be spread
+  over time with --spread or --spread-interval and --rate)
 
 acknowledge SELECTOR problems COMMENT
   acknowledge problem with object setting COMMENT comment
+  (only objects with unacknowledged problems are targeted when
+  status_file is available)
+
+stats SELECTOR
+  print expected active checks per second overall, per check_command,
+  hostgroup and template, and templates and hostgroups that generate
+  the most service instances
+
+batch FILE
+  run every command listed in FILE (or standard input when FILE is -),
+  one per line in [OPTION...] COMMAND SELECTOR [PARAMETER]... form,
+  loading configuration only once; commands of lines with -D are only
+  printed, options choosing configuration or output files are not
+  accepted on a line, and --prune takes commands of earlier lines
+  into account as if they were run already
+
+submit [FILE]
+  submit passive check results read from FILE (or standard input)
+  as host;service;code;output records, one per line, with empty
+  service for host results; records for objects that don't exist or
+  don't match -h and -s are rejected, and large batches are passed to
+  Nagios as files with PROCESS_FILE
+
+export-sqlite FILE
+  write resolved hosts, services, hostgroups, servicegroups, contacts,
+  contactgroups, dependencies, templates, object parameters and
+  service assignments to SQLite database FILE
+
+complete KIND [PREFIX]
+  print names of KIND (host, service, servicegroup, contact or
+  contactgroup) starting with PREFIX from the name index kept in
+  --cache-dir, without reading configuration
+
+serve
+  keep configuration loaded in memory and handle commands sent
+  to --socket, reloading it when configuration files change;
+  commands with options naming files or asking for profiles are
+  run by the client
 
 SELECTORS:
 all
@@ -63,19 +158,52 @@ service
 import getopt
 import sys
 import os
-
-conf = {
+import threading
+import collections
+
+# Default options. Every session gets its own copy of them.
+defaults = {
+	"archive" : "",
+	"author" : "nagctl",
+	"cache_dir" : "",
 	"cfg_dir" : [],
 	"cfg_file" : [],
 	"command_file" : "",
 	"config" : "/etc/nagios3/nagios.cfg",
+	"contact" : None,
+	"contactgroup" : None,
+	"db" : "",
 	"dry-run" : False,
 	"help" : 0,
 	"host" : None,
+	"impact" : False,
+	"instances" : [],
+	"interval_length" : "60",
+	"metrics_file" : "",
+	"profile" : False,
+	"profile_out" : "",
+	"propagate" : False,
+	"prune" : False,
+	"rate" : None,
+	"save_selection" : "",
+	"selection" : "",
+	# Directory where saved selections are kept.
+	"selection_dir" : "~/.nagctl/selections",
 	"service" : None,
+	"servicegroup" : None,
+	"socket" : "/var/run/nagctl.sock",
+	"spread" : None,
+	"spread_hash" : False,
+	"spread_interval" : False,
+	"state" : None,
+	"status_file" : "",
+	"unacked" : False,
 	"verbose" : 1
 }
 
+# Options of the session used by module level functions.
+conf = dict(defaults, cfg_dir = [], cfg_file = [])
+
 # A global list of host objects.
 hosts = []
 # A global list of service objects.
@@ -88,6 +216,142 @@ host_tmpl = {}
 # A global dictionary of service templates.
 service_tmpl = {}
 
+# A global index of object runtime states read from status file.
+# It is loaded on first use so that it stays None until needed.
+status = None
+
+# Format version of cache files. Caches written in other formats
+# are resolved again.
+cache_version = 3
+
+# A session that module level functions run in. It shares
+# the global objects and options above.
+session = None
+
+# Runtime state fields that are kept from status file.
+status_fields = (
+	"current_state",
+	"problem_has_been_acknowledged",
+	"notifications_enabled",
+	"active_checks_enabled",
+	"scheduled_downtime_depth"
+)
+
+# Downtime fields that are kept from status file.
+downtime_fields = (
+	"downtime_id",
+	"start_time",
+	"end_time",
+	"author",
+	"comment"
+)
+
+# A mapping of external commands to a status field and a value
+# that makes the command a no-op.
+prune_rules = {
+	"ENABLE_HOST_NOTIFICATIONS" : ("notifications_enabled", 1),
+	"DISABLE_HOST_NOTIFICATIONS" : ("notifications_enabled", 0),
+	"ENABLE_SVC_NOTIFICATIONS" : ("notifications_enabled", 1),
+	"DISABLE_SVC_NOTIFICATIONS" : ("notifications_enabled", 0),
+	"ENABLE_HOST_CHECK" : ("active_checks_enabled", 1),
+	"DISABLE_HOST_CHECK" : ("active_checks_enabled", 0),
+	"ENABLE_SVC_CHECK" : ("active_checks_enabled", 1),
+	"DISABLE_SVC_CHECK" : ("active_checks_enabled", 0),
+	"ACKNOWLEDGE_HOST_PROBLEM" : ("problem_has_been_acknowledged", 1),
+	"ACKNOWLEDGE_SVC_PROBLEM" : ("problem_has_been_acknowledged", 1)
+}
+
+# Commands that can be given for a whole servicegroup mapped to
+# servicegroup command names and kinds of objects they affect.
+servicegroup_commands = {
+	"ENABLE_HOST_NOTIFICATIONS" : ("ENABLE_SERVICEGROUP_HOST_NOTIFICATIONS", "host"),
+	"DISABLE_HOST_NOTIFICATIONS" : ("DISABLE_SERVICEGROUP_HOST_NOTIFICATIONS", "host"),
+	"ENABLE_SVC_NOTIFICATIONS" : ("ENABLE_SERVICEGROUP_SVC_NOTIFICATIONS", "service"),
+	"DISABLE_SVC_NOTIFICATIONS" : ("DISABLE_SERVICEGROUP_SVC_NOTIFICATIONS", "service"),
+	"ENABLE_HOST_CHECK" : ("ENABLE_SERVICEGROUP_HOST_CHECKS", "host"),
+	"DISABLE_HOST_CHECK" : ("DISABLE_SERVICEGROUP_HOST_CHECKS", "host"),
+	"ENABLE_SVC_CHECK" : ("ENABLE_SERVICEGROUP_SVC_CHECKS", "service"),
+	"DISABLE_SVC_CHECK" : ("DISABLE_SERVICEGROUP_SVC_CHECKS", "service"),
+	"SCHEDULE_HOST_DOWNTIME" : ("SCHEDULE_SERVICEGROUP_HOST_DOWNTIME", "host"),
+	"SCHEDULE_SVC_DOWNTIME" : ("SCHEDULE_SERVICEGROUP_SVC_DOWNTIME", "service")
+}
+
+# Tables of databases written by export-sqlite. Objects are numbered
+# in the order they were read and params hold resolved parameters of
+# hosts, services, groups, contacts, dependencies and templates.
+sqlite_schema = """
+CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE hosts (id INTEGER PRIMARY KEY, name TEXT NOT NULL, file TEXT, position INTEGER);
+CREATE TABLE services (id INTEGER PRIMARY KEY, name TEXT, file TEXT, position INTEGER);
+CREATE TABLE hostgroups (id INTEGER PRIMARY KEY, name TEXT, alias TEXT);
+CREATE TABLE servicegroups (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE contacts (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE contactgroups (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE dependencies (id INTEGER PRIMARY KEY, kind TEXT NOT NULL);
+CREATE TABLE host_hostgroups (host_id INTEGER NOT NULL REFERENCES hosts, hostgroup TEXT NOT NULL);
+CREATE TABLE templates (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, name TEXT NOT NULL);
+CREATE TABLE uses (kind TEXT NOT NULL, object_id INTEGER NOT NULL, position INTEGER, template TEXT NOT NULL);
+CREATE TABLE params (kind TEXT NOT NULL, object_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT);
+CREATE TABLE assignment (host_id INTEGER NOT NULL REFERENCES hosts, service_id INTEGER NOT NULL REFERENCES services, position INTEGER);
+"""
+
+# Indexes are created after tables are filled as that's faster
+# than updating them on every insert.
+sqlite_indexes = """
+CREATE INDEX hosts_name ON hosts (name);
+CREATE INDEX services_name ON services (name);
+CREATE INDEX hostgroups_name ON hostgroups (name);
+CREATE INDEX host_hostgroups_host ON host_hostgroups (host_id);
+CREATE INDEX host_hostgroups_hostgroup ON host_hostgroups (hostgroup);
+CREATE INDEX templates_name ON templates (kind, name);
+CREATE INDEX uses_object ON uses (kind, object_id);
+CREATE INDEX uses_template ON uses (template);
+CREATE INDEX params_object ON params (kind, object_id);
+CREATE INDEX params_key ON params (key, value);
+CREATE INDEX assignment_host ON assignment (host_id, position);
+CREATE INDEX assignment_service ON assignment (service_id);
+"""
+
+# Number of passive check results written to command file one by one.
+# Larger batches are written to files processed with PROCESS_FILE.
+submit_threshold = 1000
+# Number of passive check results in one file processed with PROCESS_FILE.
+submit_file_size = 50000
+
+# Kinds of names that can be completed from the name index.
+completion_kinds = ("host", "service", "servicegroup", "contact", "contactgroup")
+
+# Number of seconds between checks for configuration changes
+# when running as a daemon.
+reload_interval = 5
+
+# Command line options understood by nagctl.
+short_options = "c:Dg:h:s:v?"
+long_options = ["archive=", "author=", "cache-dir=", "contact=", "contactgroup=", "db=", "impact", "instances=", "metrics-file=", "profile", "profile-out=", "propagate", "prune", "rate=", "save-selection=", "selection=", "socket=", "spread=", "spread-hash", "spread-interval", "state=", "unacked"]
+
+# Options naming files that are read or written. The daemon runs
+# commands of other users with its own privileges so requests
+# setting any of these are refused. Profiles and metrics are
+# refused too as they would describe the daemon instead.
+daemon_refused_options = ("archive", "cache_dir", "config", "db", "instances", "metrics_file", "profile", "profile_out", "save_selection", "selection")
+
+# Options that can't be set on a batch line since configuration is
+# loaded and metrics are written once for the whole batch.
+batch_refused_options = ("archive", "cache_dir", "config", "db", "instances", "metrics_file", "profile", "profile_out", "selection")
+
+# Mappings of state names to Nagios state codes.
+host_states = {
+	"up" : 0,
+	"down" : 1,
+	"unreachable" : 2
+}
+service_states = {
+	"ok" : 0,
+	"warning" : 1,
+	"critical" : 2,
+	"unknown" : 3
+}
+
 
 #########################################################################
 # Classes								#
@@ -96,7 +360,7 @@ service_tmpl = {}
 class Object():
 	"""A basic class that all Nagios objects are based on"""
 
-	def __init__(self, param):
+	def __init__(self, param, templates = None):
 		"""Setup basic properties of a Nagios object"""
 
 		# Upon creation no dependencies are resolved.
@@ -105,6 +369,9 @@ class Object():
 		# the object is not ready for interaction.
 		self._ready = False
 		self._param = param
+		# A dictionary of templates the object may use. Global
+		# templates are used when it's not set.
+		self._templates = templates
 
 	def splitSelector(self, list):
 		"""Split a list into two include and exclude object lists"""
@@ -143,6 +410,17 @@ class Object():
 		else:
 			return False
 
+	def getList(self, key):
+		"""Return a list of names a parameter lists, resolved through
+		templates"""
+
+		self.inheritTemplates()
+		value = self.getParam(key)
+		if value is None:
+			return []
+		# Values appended to inherited ones may keep their markers.
+		return [v.lstrip("+") for v in self.splitSelector(value)[0] if v.lstrip("+") != ""]
+
 	def isRegistered(self):
 		"""Return true if object is not template"""
 		if self.getName() is None:
@@ -218,9 +496,10 @@ class Object():
 			# so its arguments can be returned now.
 			return self._param
 
-		if self.__class__.__name__ == "Host":
+		tmpl = self._templates
+		if (tmpl is None) and (self.__class__.__name__ == "Host"):
 			tmpl = host_tmpl
-		if self.__class__.__name__ == "Service":
+		if (tmpl is None) and (self.__class__.__name__ == "Service"):
 			tmpl = service_tmpl
 
 		# Walk through all parent objects starting from last one
@@ -254,6 +533,18 @@ class Host(Object):
 		else:
 			self._hostgroup = []
 
+		if "parents" in self._param:
+			# Convert parent host names to a list.
+			(self._parents, _) = self.splitSelector(self._param["parents"])
+		else:
+			self._parents = []
+
+	def getParents(self):
+		"""Return a list of parent host names"""
+
+		self.setupParams()
+		return self._parents
+
 	def getName(self):
 		"""Return host name"""
 
@@ -321,6 +612,14 @@ class Service(Object):
 			self._include_hostgroup = None
 			self._exclude_hostgroup = None
 
+	def getServicegroups(self):
+		"""Return a list of servicegroups the service is a member of"""
+
+		self.setupParams()
+		if self.getParam("servicegroups") is None:
+			return []
+		return self.splitSelector(self.getParam("servicegroups"))[0]
+
 	def getName(self):
 		"""Return service name"""
 
@@ -335,6 +634,7 @@ class Hostgroup(Object):
 	def __init__(self, param):
 		"""Setup basic properties of Nagios hostgroup object"""
 
+		self._param = param
 		if param.has_key("hostgroup_name"):
 			# Set object name.
 			self._name = param["hostgroup_name"]
@@ -358,6 +658,116 @@ class Hostgroup(Object):
 		return self._members
 
 
+class Contact(Object):
+	"""Class for Nagios contact objects"""
+
+	def getName(self):
+		"""Return contact name"""
+
+		try:
+			return self._param["contact_name"]
+		except KeyError:
+			return None
+
+
+class Contactgroup(Object):
+	"""Class for Nagios contactgroup objects"""
+
+	def __init__(self, param):
+		"""Setup basic properties of Nagios contactgroup object"""
+
+		Object.__init__(self, param, {})
+
+	def getName(self):
+		"""Return contactgroup name"""
+
+		return self.getParam("contactgroup_name")
+
+	def getMembers(self):
+		"""Return a list of contact names listed as members"""
+
+		return self.getList("members")
+
+	def getGroups(self):
+		"""Return a list of contactgroups whose members are members too"""
+
+		return self.getList("contactgroup_members")
+
+
+class Servicegroup(Object):
+	"""Class for Nagios servicegroup objects"""
+
+	def __init__(self, param):
+		"""Setup basic properties of Nagios servicegroup object"""
+
+		self._param = param
+		if param.has_key("servicegroup_name"):
+			# Set object name.
+			self._name = param["servicegroup_name"]
+		else:
+			self._name = None
+		self._members = []
+		if param.has_key("members"):
+			# Members are listed as host and service name pairs.
+			(names, _) = self.splitSelector(param["members"])
+			for i in range(0, len(names) - 1, 2):
+				self._members.append((names[i], names[i + 1]))
+		if param.has_key("servicegroup_members"):
+			(self._groups, _) = self.splitSelector(param["servicegroup_members"])
+		else:
+			self._groups = []
+
+	def getName(self):
+		"""Return servicegroup name"""
+
+		return self._name
+
+	def getMembers(self):
+		"""Return a list of (host, service) name pairs listed as members"""
+
+		return self._members
+
+	def getGroups(self):
+		"""Return a list of servicegroups whose members are members too"""
+
+		return self._groups
+
+
+class Dependency(Object):
+	"""Class for Nagios host and service dependency objects"""
+
+	def __init__(self, kind, param, templates = None):
+		"""Setup a hostdependency or servicedependency object"""
+
+		Object.__init__(self, param, templates)
+		self._kind = kind
+
+	def getKind(self):
+		"""Return hostdependency or servicedependency"""
+
+		return self._kind
+
+	def getName(self):
+		"""Dependencies have no names"""
+
+		return None
+
+	def isRegistered(self):
+		"""Return true if object is not template"""
+
+		return self.getParam("register") != "0"
+
+	def getSelector(self, key):
+		"""Return a tuple of included and excluded names listed
+		in a parameter"""
+
+		self.setupParams()
+		value = self.getParam(key)
+		if value is None:
+			return ([], [])
+		return self.splitSelector(value)
+
+
 class ObjectLink():
 	"""Keeps lists of object and their relationships"""
 
@@ -395,640 +805,3587 @@ class ObjectLink():
 		return self._objects[index][1:]
 
 
-#########################################################################
-# Functions								#
-#########################################################################
+class NagctlError(Exception):
+	"""Raised when a command can't be carried out"""
 
-def printMessage(message, verbosity = 1):
-	"""Print a message if verbosity is set high enough"""
 
-	# Decide if a message should be displayed based on verbosity levels.
-	if conf["verbose"] >= verbosity:
-		print message
+def synchronized(method):
+	"""Make a session method run while holding the session lock"""
 
-def parseArguments():
-	"""Parse command line arguments and return a dictionary
-	with options"""
+	def function(self, *args, **kwargs):
+		self.lock.acquire()
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			self.lock.release()
 
-	# A mapping of short argument names to configuration keys.
-	argmap = {
-		"-?" : "help",
-		"-c" : "config",
-		"-D" : "dry-run",
-		"-h" : "host",
-		"-s" : "service",
-		"-v" : "verbose"
-	}
+	function.__name__ = method.__name__
+	function.__doc__ = method.__doc__
+	return function
 
-	try:
-		# Resolve command line arguments.
-		(opt, arg) = getopt.getopt(sys.argv[1:], "c:Dh:s:v?")
 
-	except getopt.GetoptError, error:
-		# Bail out if we can't understand command line arguments.
-		sys.stderr.write("Fatal error parsing arguments: %s\n" % (str(error)))
-		sys.exit(1)
+def profiled(phase):
+	"""Make a session method count as given phase when profiling"""
 
-	for (k, v) in opt:
-		if type(conf[argmap[k]]).__name__ == 'int':
-			# Increment config options that are integers.
-			conf[argmap[k]] += 1
-		elif type(conf[argmap[k]]).__name__ == 'bool':
-			# Booleans are set to True.
-			conf[argmap[k]] = True
-		else:
-			# Other kind of options are just set.
-			conf[argmap[k]] = v
+	def decorator(method):
+		def function(self, *args, **kwargs):
+			start = self.startPhase(phase)
+			try:
+				return method(self, *args, **kwargs)
+			finally:
+				self.endPhase(start)
+
+		function.__name__ = method.__name__
+		function.__doc__ = method.__doc__
+		return function
+
+	return decorator
+
+
+class Session():
+	"""Keeps options, loaded objects and indexes of one Nagios instance"""
+
+	def __init__(self, options = None):
+		"""Setup an empty session with default options updated by given ones"""
+
+		self.conf = dict(defaults)
+		if not options is None:
+			self.conf.update(options)
+		for (k, v) in self.conf.items():
+			if type(v).__name__ == "list":
+				# Lists are appended to so they can't be shared.
+				self.conf[k] = list(v)
+
+		self.hosts = []
+		self.services = []
+		self.hostgroups = []
+		self.host_tmpl = {}
+		self.service_tmpl = {}
+		self.servicegroups = []
+		self.contacts = []
+		self.contactgroups = []
+		self.contact_tmpl = {}
+		self.dependencies = []
+		# Dependency templates of every kind.
+		self.dependency_tmpl = {"hostdependency" : {}, "servicedependency" : {}}
+		# Object states are loaded on first use.
+		self.status = None
+		# Details of every object file read, in the order of reading.
+		self.files = collections.OrderedDict()
+		# Objects read from every file.
+		self.sources = {}
+		# Modification time and size of main config when it was read.
+		self.config_stat = None
+		# Child hosts by parent host name, built on first use.
+		self.children = None
+		# Dependent objects by master object, built on first use.
+		self.dependents = None
+		# Service instances by servicegroup, built on first use.
+		self.servicegroup_index = None
+		# Hosts and service instances by contact, built on first use.
+		self.contact_index = None
+		# Host and service assignments read from a database.
+		self.assignment = None
+		# Objects and names of hosts selected by themselves read from
+		# a saved selection.
+		self.selection = None
+		# Whether only hosts and services matching names were read
+		# from a database.
+		self.partial = False
+		# Contents of files by path when configuration is read from
+		# an archive or a dictionary instead of the filesystem.
+		self.tree = None
+		# Status index and downtimes by host built from it on first use.
+		self.downtime_index = None
+		# Directory listings by path with modification times of
+		# directories, loaded on first use.
+		self.manifest = None
+		self.manifest_changed = False
+		# Time spent in every phase, object counters and commands
+		# generated and written by command name.
+		self.profile = {
+			"phases" : collections.OrderedDict(),
+			"counters" : collections.OrderedDict(),
+			"generated" : {},
+			"written" : {},
+			"stack" : []
+		}
+		# A session may be shared by threads so anything that
+		# changes its objects needs to hold the lock.
+		self.lock = threading.RLock()
+
+	def printMessage(self, message, verbosity = 1):
+		"""Print a message if verbosity is set high enough"""
+
+		# Decide if a message should be displayed based on verbosity levels.
+		if self.conf["verbose"] >= verbosity:
+			print message
+
+	def isProfiling(self):
+		"""Check if phase times and counters need to be collected"""
+
+		return self.conf["profile"] or (self.conf["metrics_file"] != "")
+
+	def startPhase(self, phase):
+		"""Start measuring time of a phase and return its record
+		or None when not profiling"""
+
+		if not self.isProfiling():
+			return None
 
-	if conf["dry-run"]:
-		# Increase verbosity by one when runnig in dry-run mode.
-		conf["verbose"] += 1
+		import time
 
-	return (conf, arg)
+		times = os.times()
+		# Record of phase name, start times and time spent in
+		# phases nested in it.
+		record = [phase, time.time(), times[0] + times[1], 0.0, 0.0]
+		self.profile["stack"].append(record)
+		return record
 
-def parseConfig():
-	"""Parse Nagios main configuration file"""
+	def endPhase(self, record):
+		"""Stop measuring time of a phase and add it to totals"""
 
-	# A list of options that need to be extracted from
-	# main Nagios config file.
-	match = ("cfg_file", "cfg_dir", "command_file")
+		if record is None:
+			return None
+
+		import time
+
+		times = os.times()
+		wall = time.time() - record[1]
+		cpu = times[0] + times[1] - record[2]
+		stack = self.profile["stack"]
+		while len(stack) > 0:
+			# Drop phases left unfinished by exceptions as well.
+			if stack.pop() is record:
+				break
+		if len(stack) > 0:
+			# Time of nested phases is not counted twice.
+			stack[-1][3] += wall
+			stack[-1][4] += cpu
+
+		totals = self.profile["phases"].setdefault(record[0], [0, 0.0, 0.0])
+		totals[0] += 1
+		totals[1] += wall - record[3]
+		totals[2] += cpu - record[4]
+
+	def countObjects(self, counter, count = 1):
+		"""Add to a profiling counter"""
+
+		if self.isProfiling():
+			counters = self.profile["counters"]
+			counters[counter] = counters.get(counter, 0) + count
+
+	def countCommands(self, kind, commands):
+		"""Count generated or written commands by command name"""
+
+		if self.isProfiling():
+			counts = self.profile[kind]
+			for c in commands:
+				name = c.split(";", 1)[0]
+				counts[name] = counts.get(name, 0) + 1
+
+	def getCounters(self):
+		"""Return profiling counters together with loaded object counts"""
+
+		counters = self.profile["counters"]
+		counters["files"] = len(self.files)
+		counters["hosts"] = len(self.hosts)
+		counters["services"] = len(self.services)
+		counters["hostgroups"] = len(self.hostgroups)
+		counters["templates"] = len(self.host_tmpl) + len(self.service_tmpl)
+		for key in ("lines", "pairs tested", "pairs matched", "commands written", "commands pruned", "commands compressed", "failures"):
+			counters.setdefault(key, 0)
+		return counters
+
+	def printProfile(self):
+		"""Print time spent in every phase, counters and peak memory use"""
+
+		import resource
+
+		counters = self.getCounters()
+
+		output = ["%-20s %8s %10s %10s" % ("phase", "calls", "wall", "cpu")]
+		for (phase, (calls, wall, cpu)) in self.profile["phases"].items():
+			output.append("%-20s %8u %9.3fs %9.3fs" % (phase, calls, wall, cpu))
+		output.append("")
+		for key in ("files", "lines", "hosts", "services", "templates", "pairs tested", "pairs matched", "commands written"):
+			output.append("%-20s %8u" % (key, counters[key]))
+		# Linux reports maximum resident set size in kilobytes.
+		output.append("%-20s %8u kB" % ("peak RSS", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+		sys.stderr.write("\n".join(output) + "\n")
+
+	def writeMetrics(self, success, duration):
+		"""Atomically write metrics of the run to a Prometheus textfile
+		collector file"""
+
+		import time
+
+		counters = self.getCounters()
+
+		# Metric name, type, help text and a list of label and value pairs.
+		metrics = [
+			("nagctl_success", "gauge", "Whether the last run succeeded.", [("", int(success))]),
+			("nagctl_run_seconds", "gauge", "Wall time of the last run.", [("", duration)]),
+			("nagctl_last_run_timestamp_seconds", "gauge", "Time the last run finished.", [("", time.time())]),
+			("nagctl_phase_seconds", "gauge", "Wall time spent in processing phases.",
+				[('phase="%s"' % (p), t[1]) for (p, t) in self.profile["phases"].items()]),
+			("nagctl_phase_cpu_seconds", "gauge", "CPU time spent in processing phases.",
+				[('phase="%s"' % (p), t[2]) for (p, t) in self.profile["phases"].items()]),
+			("nagctl_objects", "gauge", "Objects loaded from configuration.",
+				[('kind="%s"' % (k), counters[k]) for k in ("files", "hosts", "services", "hostgroups", "templates")]),
+			("nagctl_config_lines", "gauge", "Lines read from object files.", [("", counters["lines"])]),
+			("nagctl_commands_generated", "gauge", "External commands generated by command name.",
+				[('command="%s"' % (c), n) for (c, n) in sorted(self.profile["generated"].items())]),
+			("nagctl_commands_written", "gauge", "External commands written by command name.",
+				[('command="%s"' % (c), n) for (c, n) in sorted(self.profile["written"].items())]),
+			("nagctl_commands_pruned", "gauge", "External commands skipped as no-ops.", [("", counters["commands pruned"])]),
+			("nagctl_commands_compressed", "gauge", "External commands replaced by servicegroup commands.", [("", counters["commands compressed"])]),
+			("nagctl_failures", "gauge", "Failed operations.", [("", counters["failures"])])
+		]
+
+		output = []
+		for (name, kind, text, values) in metrics:
+			output.append("# HELP %s %s" % (name, text))
+			output.append("# TYPE %s %s" % (name, kind))
+			for (labels, value) in values:
+				if labels != "":
+					labels = "{%s}" % (labels)
+				output.append("%s%s %r" % (name, labels, value))
 
-	try:
-		cfg = open(conf["config"], "r")
-		printMessage("Reading "+str(conf["config"]), 3)
 		try:
-			for line in cfg.readlines():
-				# Check if line sets a config option.
-				if "=" in line:
-					(k, v) = line.split("=", 1)
-					# Remove leading and trailing whitespace.
-					k = k.strip()
-					if k in match:
-						v = v.strip()
-						if type(conf[k]).__name__ == "list":
-							# Append value if config option is a list.
-							conf[k].append(v)
-						else:
-							# Just set the value if config option is a string.
-							conf[k] = v
+			# The collector must never read a partially written file.
+			replaceFile(self.conf["metrics_file"], lambda fh, temp: fh.write("\n".join(output) + "\n"))
+		except (IOError, OSError), error:
+			sys.stderr.write("Cannot write metrics file: %s\n" % (error))
+
+	def parseArguments(self, argv = None):
+		"""Parse command line arguments and return a dictionary
+		with options"""
+
+		if argv is None:
+			argv = sys.argv[1:]
+
+		# A mapping of short argument names to configuration keys.
+		argmap = {
+			"-?" : "help",
+			"-c" : "config",
+			"--archive" : "archive",
+			"--author" : "author",
+			"--cache-dir" : "cache_dir",
+			"--contact" : "contact",
+			"--contactgroup" : "contactgroup",
+			"--db" : "db",
+			"-D" : "dry-run",
+			"-g" : "servicegroup",
+			"-h" : "host",
+			"-s" : "service",
+			"-v" : "verbose",
+			"--impact" : "impact",
+			"--instances" : "instances",
+			"--metrics-file" : "metrics_file",
+			"--profile" : "profile",
+			"--profile-out" : "profile_out",
+			"--propagate" : "propagate",
+			"--prune" : "prune",
+			"--rate" : "rate",
+			"--save-selection" : "save_selection",
+			"--selection" : "selection",
+			"--socket" : "socket",
+			"--spread" : "spread",
+			"--spread-hash" : "spread_hash",
+			"--spread-interval" : "spread_interval",
+			"--state" : "state",
+			"--unacked" : "unacked"
+		}
 
-		except IOError, error:
-			sys.stderr.write("Cannot read main config file: %s\n" % (error))
-			sys.exit(1)
+		try:
+			# Resolve command line arguments.
+			(opt, arg) = getopt.getopt(argv, short_options, long_options)
+
+		except getopt.GetoptError, error:
+			# Bail out if we can't understand command line arguments.
+			raise NagctlError("Fatal error parsing arguments: %s" % (str(error)))
+
+		for (k, v) in opt:
+			if k == "-c":
+				# Every config file given is a separate instance. The list
+				# is replaced rather than appended to as it may be shared
+				# with saved options.
+				self.conf["instances"] = self.conf["instances"] + [v]
+				self.conf["config"] = v
+			elif k == "--instances":
+				self.conf["instances"] = self.conf["instances"] + self.readInstances(v)
+			elif type(self.conf[argmap[k]]).__name__ == 'int':
+				# Increment config options that are integers.
+				self.conf[argmap[k]] += 1
+			elif type(self.conf[argmap[k]]).__name__ == 'bool':
+				# Booleans are set to True.
+				self.conf[argmap[k]] = True
+			else:
+				# Other kind of options are just set.
+				self.conf[argmap[k]] = v
 
-		finally:
-			# Make sure the file gets closed.
-			cfg.close()
+		if len(self.conf["instances"]) == 1:
+			# A single instance is run like any other main config.
+			self.conf["config"] = self.conf["instances"][0]
 
-	except IOError, error:
-		sys.stderr.write("Cannot open main config file: %s\n" % (error))
-		sys.exit(1)
+		if ("-D", "") in opt:
+			# Increase verbosity by one when runnig in dry-run mode.
+			self.conf["verbose"] += 1
 
+		return (self.conf, arg)
 
-def searchDir(dir):
-	"""Recursively search for files in a directory"""
-
-	# Make sure that we're looking at a directory.
-	if os.path.isdir(dir):
-		printMessage("Searching for files in: %s" % (dir), 3)
-		# Get directory contents.
-		for obj in os.listdir(dir):
-			path = os.path.join(dir, obj)
-			# Check if path leads to a non-hidden file with .cfg extension
-			if os.path.isfile(path) and (os.path.splitext(path)[1] == ".cfg") and (os.path.basename(path)[0] != "."):
-				parseFile(path)
-			if os.path.isdir(path):
-				searchDir(path)
-		
-	
-def parseFile(file):
-	"""Parse Nagios configuration file"""
+	def readInstances(self, file):
+		"""Return a list of main config files listed in a file"""
 
-	import re
+		try:
+			fh = open(file, "r")
+			try:
+				lines = [l.strip() for l in fh.readlines()]
+			finally:
+				fh.close()
+
+		except IOError, error:
+			raise NagctlError("Cannot read instances file: %s" % (error))
+
+		return [l for l in lines if (l != "") and (l[0] != "#")]
+
+	@profiled("parseConfig")
+	def parseConfig(self):
+		"""Parse Nagios main configuration file"""
+
+		# A list of options that need to be extracted from
+		# main Nagios config file.
+		match = ("cfg_file", "cfg_dir", "command_file", "interval_length", "status_file")
 
-	try:
-		fh = open(file, "r")
 		try:
-			printMessage("Reading file: %s" % (file), 3)
-			# This variable keeps track of the current "define" statement
-			# we're currently inside of.
-			definition = None
-			# A dictionary of all parameters for current object.
-			param = {}
-
-			for line in fh.readlines():
-				# Remove leading and trailing whitespace.
-				line = line.strip()
-				if re.search("^define host\s*{$", line):
-					definition = "host"
-					continue
-				if re.search("^define service\s*{$", line):
-					definition = "service"
-					continue
-				if re.search("^define hostgroup\s*{$", line):
-					definition = "hostgroup"
+			(cfg, _) = self.openFile(self.conf["config"])
+			self.printMessage("Reading "+str(self.conf["config"]), 3)
+			try:
+				for line in cfg.readlines():
+					# Check if line sets a config option.
+					if "=" in line:
+						(k, v) = line.split("=", 1)
+						# Remove leading and trailing whitespace.
+						k = k.strip()
+						if k in match:
+							v = v.strip()
+							if type(self.conf[k]).__name__ == "list":
+								# Append value if config option is a list.
+								self.conf[k].append(v)
+							else:
+								# Just set the value if config option is a string.
+								self.conf[k] = v
+
+			except IOError, error:
+				raise NagctlError("Cannot read main config file: %s" % (error))
+
+			finally:
+				# Make sure the file gets closed.
+				cfg.close()
+
+		except IOError, error:
+			raise NagctlError("Cannot open main config file: %s" % (error))
+
+	def openFile(self, path):
+		"""Return a file object and a tuple of modification time and
+		size of a file read from the filesystem or the loaded tree"""
+
+		import StringIO
+		import errno
+
+		if self.tree is None:
+			fh = open(path, "r")
+			st = os.fstat(fh.fileno())
+			return (fh, (st.st_mtime, st.st_size))
+
+		name = treePath(path)
+		if not name in self.tree:
+			raise IOError(errno.ENOENT, "No such file in archive", path)
+		return (StringIO.StringIO(self.tree[name]), (0, len(self.tree[name])))
+
+	def readArchive(self, path):
+		"""Return an ordered dictionary of paths to contents of files
+		in a tar or zip archive that configuration may read"""
+
+		import tarfile
+		import zipfile
+
+		def members():
+			# Tuples of member names and functions reading them.
+			if zipfile.is_zipfile(path):
+				archive = zipfile.ZipFile(path, "r")
+				try:
+					for info in archive.infolist():
+						if not info.filename.endswith("/"):
+							yield (info.filename, lambda: archive.read(info))
+				finally:
+					archive.close()
+			else:
+				# Members are streamed in the order they are stored
+				# so the archive is read sequentially.
+				archive = tarfile.open(path, "r|*")
+				try:
+					for member in archive:
+						if member.isfile():
+							yield (member.name, lambda: archive.extractfile(member).read())
+				finally:
+					archive.close()
+
+		self.printMessage("Reading archive: %s" % (path), 3)
+		config = treePath(self.conf["config"])
+		# Archivers store files in the order they found them in
+		# directories, which is the order Nagios reads them in.
+		tree = collections.OrderedDict()
+		# Files main configuration lists by name once it is read and
+		# other files stored before it that it may list.
+		listed = None
+		pending = []
+		try:
+			for (name, read) in members():
+				name = treePath(name)
+				base = os.path.basename(name)
+				if name == config:
+					tree[name] = read()
+					listed = set()
+					for line in tree[name].splitlines():
+						(k, sep, v) = line.partition("=")
+						if sep and (k.strip() == "cfg_file"):
+							listed.add(treePath(v.strip()))
+					for p in pending:
+						if not p in listed:
+							del tree[p]
+				elif (os.path.splitext(base)[1] == ".cfg") and (base[0] != "."):
+					# Any of these may be found in a cfg_dir.
+					tree[name] = read()
+				elif listed is None:
+					tree[name] = read()
+					pending.append(name)
+				elif name in listed:
+					tree[name] = read()
+		except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile), error:
+			raise NagctlError("Cannot read archive: %s" % (error))
+		return tree
+
+	@synchronized
+	def loadTree(self, tree):
+		"""Read main configuration and object files from a dictionary
+		of paths to file contents"""
+
+		items = [(treePath(k), v) for (k, v) in tree.items()]
+		if isinstance(tree, collections.OrderedDict):
+			self.tree = collections.OrderedDict(items)
+		else:
+			self.tree = dict(items)
+		self.loadConfig()
+
+	def walkTree(self, dir):
+		"""Search for object files in a directory of the loaded tree
+		and return a list of tuples of their paths and identities"""
+
+		prefix = treePath(dir)
+		if prefix != "":
+			prefix += "/"
+		result = []
+		for path in self.tree.keys():
+			if not path.startswith(prefix):
+				continue
+			name = os.path.basename(path)
+			# The same files are skipped as in directories on disk.
+			if (os.path.splitext(name)[1] == ".cfg") and (name[0] != "."):
+				result.append(path)
+		if not isinstance(self.tree, collections.OrderedDict):
+			# Entries of unordered trees are visited in name order.
+			result.sort(key = lambda p: p.split("/"))
+		return [(p, ("tree", p)) for p in result]
+
+	def findFiles(self, dir):
+		"""Recursively search for object files in a directory and
+		return a list of their paths"""
+
+		return [path for (path, _) in self.walkDir(dir)]
+
+	def walkDir(self, dir):
+		"""Search for object files in a directory tree and return
+		a list of tuples of their paths and inode identities"""
+
+		if self.manifest is None:
+			self.manifest = {}
+			if self.conf["cache_dir"] != "":
+				self.manifest = self.readCache("manifest") or {}
+
+		result = []
+		# Walk directories without recursion keeping the order
+		# in which a recursive walk would find files.
+		stack = [(dir, None)]
+		while len(stack) > 0:
+			(path, identity) = stack.pop()
+			if not identity is None:
+				result.append((path, identity))
+				continue
+
+			mtime = getStat(path)
+			if mtime is None:
+				continue
+			cached = self.manifest.get(path)
+			if (not cached is None) and (cached[0] == mtime):
+				# Directory contents didn't change since last listing.
+				entries = cached[1]
+			else:
+				self.printMessage("Searching for files in: %s" % (path), 3)
+				entries = listDir(path)
+				if entries is None:
 					continue
-				# Check if the current definition ends here.
-				if re.search("^}$", line):
-					# Check if host name was set in order to skip those
-					# that have none (templates).
-					if (definition == "host"):
-						# Create a new host object.
-						h = Host(param)
-						if h.isRegistered():
-							# Append new object to hosts list.
-							hosts.append(h)
-						if not h.getParam("name") is None:
-							# Add new host to host templates dictionary.
-							host_tmpl[h.getParam("name")] = h
-
-					# Check if service name was set in order to skip those
-					# that have none (templates).
-					if (definition == "service"):
-						# Create a new service object.
-						s = Service(param)
-						if s.isRegistered():
-							# Append new object to service list.
-							services.append(s)
-						if not s.getParam("name") is None:
-							# Add new service to service templates dictionary.
-							service_tmpl[s.getParam("name")] = s
-
-					# Check if service name was set in order to skip those
-					# that have none (templates).
-					if (definition == "hostgroup") and (param.has_key("hostgroup_name")):
-						# Create a new service object.
-						h = Hostgroup(param)
-						# Append new object to service list.
-						hostgroups.append(h)
-					# Reset parameters.
-					param = {}
-					definition = None
+				self.manifest[path] = (mtime, entries)
+				self.manifest_changed = True
+			for (name, identity) in reversed(entries):
+				stack.append((os.path.join(path, name), identity))
+
+		return result
+
+	@profiled("discovery")
+	def findObjectFiles(self):
+		"""Return a list of all object files main configuration
+		mentions in the order they should be read"""
+
+		found = []
+		# Check every directory that main configuration mentions.
+		for dir in self.conf["cfg_dir"]:
+			if self.tree is None:
+				found.extend(self.walkDir(dir))
+			else:
+				found.extend(self.walkTree(dir))
+		# Check every file that main configuration mentions.
+		for path in self.conf["cfg_file"]:
+			if not self.tree is None:
+				found.append((path, ("tree", treePath(path))))
+				continue
+			try:
+				st = os.stat(path)
+				found.append((path, (st.st_dev, st.st_ino)))
+			except OSError:
+				# Let the parser report files that can't be read.
+				found.append((path, None))
+
+		if self.manifest_changed and (self.conf["cache_dir"] != ""):
+			self.writeCache("manifest", self.manifest)
+		self.manifest_changed = False
+
+		# Skip files that can be reached through more than one path.
+		result = []
+		seen = set()
+		for (path, identity) in found:
+			if not identity is None:
+				if identity in seen:
+					self.printMessage("Skipping file read already: %s" % (path), 3)
 					continue
-				# Check if we're inside an object definition.
-				if not definition is None:
-					# Split line by whitespace. Set keyword as first chunk
-					# and value as rest.
-					v = line.split(None, 1)
-					if len(v) > 1:
-						param[v[0]] = v[1]
+				seen.add(identity)
+			result.append(path)
+		return result
 
-		finally:
-			# Make sure the file gets closed.
-			fh.close()
+	def searchDir(self, dir):
+		"""Recursively search for files in a directory"""
 
-	except IOError, error:
-		sys.stderr.write("Cannot read file: %s\n" % (error))
-		return None
+		for path in self.findFiles(dir):
+			self.parseFile(path)
 
+	@profiled("parseFile")
+	def parseFile(self, file):
+		"""Parse Nagios configuration file"""
 
-def matchObjects():
-	"""Resolve dependencies between hosts and services
-	and return a nested list of matches"""
+		import re
+		import hashlib
 
-	# Create an object that will hold all other objects.
-	result = ObjectLink()
+		try:
+			(fh, st) = self.openFile(file)
+			try:
+				self.printMessage("Reading file: %s" % (file), 3)
+				# This variable keeps track of the current "define" statement
+				# we're currently inside of.
+				definition = None
+				# A dictionary of all parameters for current object.
+				param = {}
+
+				lines = fh.readlines()
+				self.countObjects("lines", len(lines))
+				# Remember what the file contains so that results
+				# derived from it can be cached.
+				details = {
+					"digest" : hashlib.md5("".join(lines)).hexdigest(),
+					"mtime" : st[0],
+					"size" : st[1],
+					"hosts" : [],
+					"services" : 0,
+					"static" : False
+				}
+				self.files[file] = details
+				# Objects read from the file so that they can be
+				# replaced when the file changes.
+				objects = {
+					"hosts" : [],
+					"services" : [],
+					"hostgroups" : [],
+					"host_tmpl" : [],
+					"service_tmpl" : [],
+					"servicegroups" : [],
+					"contacts" : [],
+					"contactgroups" : [],
+					"contact_tmpl" : [],
+					"dependencies" : [],
+					"hostdependency_tmpl" : [],
+					"servicedependency_tmpl" : []
+				}
+				self.sources[file] = objects
+
+				for line in lines:
+					# Remove leading and trailing whitespace.
+					line = line.strip()
+					if re.search("^define host\s*{$", line):
+						definition = "host"
+						continue
+					if re.search("^define service\s*{$", line):
+						definition = "service"
+						continue
+					if re.search("^define hostgroup\s*{$", line):
+						definition = "hostgroup"
+						continue
+					if re.search("^define contact\s*{$", line):
+						definition = "contact"
+						continue
+					if re.search("^define contactgroup\s*{$", line):
+						definition = "contactgroup"
+						continue
+					if re.search("^define servicegroup\s*{$", line):
+						definition = "servicegroup"
+						continue
+					if re.search("^define (host|service)dependency\s*{$", line):
+						definition = line.split()[1].split("{")[0]
+						continue
+					# Check if the current definition ends here.
+					if re.search("^}$", line):
+						# Check if host name was set in order to skip those
+						# that have none (templates).
+						if (definition == "host"):
+							# Create a new host object.
+							h = Host(param, self.host_tmpl)
+							if h.isRegistered():
+								# Host names may be repeated so hosts are told
+								# apart by the file and place they are defined in.
+								h._origin = (file, len(details["hosts"]))
+								# Append new object to hosts list.
+								self.hosts.append(h)
+								details["hosts"].append(h._origin)
+								objects["hosts"].append(h)
+							if not h.getParam("name") is None:
+								# Add new host to host templates dictionary.
+								self.host_tmpl[h.getParam("name")] = h
+								details["static"] = True
+								objects["host_tmpl"].append(h)
+
+						# Check if service name was set in order to skip those
+						# that have none (templates).
+						if (definition == "service"):
+							# Create a new service object.
+							s = Service(param, self.service_tmpl)
+							# Services have no unique names so they are told
+							# apart by the file and place they are defined in.
+							s._origin = (file, details["services"])
+							details["services"] += 1
+							if s.isRegistered():
+								# Append new object to service list.
+								self.services.append(s)
+								objects["services"].append(s)
+							if not s.getParam("name") is None:
+								# Add new service to service templates dictionary.
+								self.service_tmpl[s.getParam("name")] = s
+								details["static"] = True
+								objects["service_tmpl"].append(s)
+
+						if definition == "contact":
+							c = Contact(param, self.contact_tmpl)
+							if c.isRegistered():
+								self.contacts.append(c)
+								objects["contacts"].append(c)
+							if not c.getParam("name") is None:
+								self.contact_tmpl[c.getParam("name")] = c
+								objects["contact_tmpl"].append(c)
+
+						if (definition == "contactgroup") and (param.has_key("contactgroup_name")):
+							g = Contactgroup(param)
+							self.contactgroups.append(g)
+							objects["contactgroups"].append(g)
+
+						if (definition == "servicegroup") and (param.has_key("servicegroup_name")):
+							g = Servicegroup(param)
+							self.servicegroups.append(g)
+							objects["servicegroups"].append(g)
+
+						if definition in self.dependency_tmpl:
+							# Create a new dependency object.
+							d = Dependency(definition, param, self.dependency_tmpl[definition])
+							if d.isRegistered():
+								self.dependencies.append(d)
+								objects["dependencies"].append(d)
+							if not d.getParam("name") is None:
+								# Add new dependency to templates of its kind.
+								self.dependency_tmpl[definition][d.getParam("name")] = d
+								objects[definition + "_tmpl"].append(d)
+
+						# Check if service name was set in order to skip those
+						# that have none (templates).
+						if (definition == "hostgroup") and (param.has_key("hostgroup_name")):
+							# Create a new service object.
+							h = Hostgroup(param)
+							# Append new object to service list.
+							self.hostgroups.append(h)
+							details["static"] = True
+							objects["hostgroups"].append(h)
+						# Reset parameters.
+						param = {}
+						definition = None
+						continue
+					# Check if we're inside an object definition.
+					if not definition is None:
+						# Split line by whitespace. Set keyword as first chunk
+						# and value as rest.
+						v = line.split(None, 1)
+						if len(v) > 1:
+							param[v[0]] = v[1]
+
+			finally:
+				# Make sure the file gets closed.
+				fh.close()
 
-	if conf["host"] is None:
-		# When no host constraint was specified match all hosts.
-		matched_hosts = hosts
-	else:
-		# Get a list of hosts filtered by name.
-		matched_hosts = [h for h in hosts if h.matchName(conf["host"])]
+		except IOError, error:
+			sys.stderr.write("Cannot read file: %s\n" % (error))
+			return None
 
-	for h in matched_hosts:
-		h.setupParams()
+	@synchronized
+	def loadConfig(self, select = False):
+		"""Read main Nagios configuration and all object files it mentions;
+		when select is set a database may be read only for hosts and
+		services matching names"""
 
-	# Add additional hostgroups to hosts by checking hostgroup members.
-	for hostgroup in hostgroups:
-		for member in hostgroup.getMembers():
-			for host in matched_hosts:
-				if (member == host.getName()) or (member == "*"):
-					host.addHostgroup(hostgroup.getName())
+		self.resetIndexes()
 
-	if conf["service"] is None:
-		# When no service constraint was specified match all services.
-		matched_services = services
-	else:
-		# Get a list of services filtered by name.
-		matched_services = [s for s in services if s.matchName(conf["service"])]
-
-	for s in matched_services:
-		s.setupParams()
-
-	for h in matched_hosts:
-		added = False
-		# Start with an empty inner list.
-		for s in matched_services:
-			# Check if a host have a particular service attached.
-			if h.matchService(s._include_host, s._exclude_host, s._include_hostgroup, s._exclude_hostgroup):
-				if not added:
-					# First element of inner list is the host object.
-					result.addHost(h)
-					added = True
-				# Append service object to inner list.
-				result.addService(s)
-	return result
+		if self.conf["selection"] != "":
+			# Objects were selected by an earlier command.
+			self.loadSelection(self.conf["selection"])
+			return None
 
+		if self.conf["db"] != "":
+			# Everything is resolved in the database already.
+			self.loadDatabase(self.conf["db"], select)
+			return None
 
-def getSimilar(args, pack):
-	"""Return a subset of objects that are similar to first argument"""
+		if (self.conf["archive"] != "") and (self.tree is None):
+			self.tree = self.readArchive(self.conf["archive"])
+
+		# Parse main Nagios configuration file.
+		self.parseConfig()
+		self.config_stat = getStat(self.conf["config"])
+
+		for file in self.findObjectFiles():
+			self.parseFile(file)
+
+		if self.conf["cache_dir"] != "":
+			self.writeNames()
+
+	@synchronized
+	def reloadConfig(self):
+		"""Forget all loaded objects and read configuration again"""
+
+		self.hosts = []
+		self.services = []
+		self.hostgroups = []
+		self.host_tmpl = {}
+		self.service_tmpl = {}
+		self.servicegroups = []
+		self.contacts = []
+		self.contactgroups = []
+		self.contact_tmpl = {}
+		self.dependencies = []
+		self.dependency_tmpl = {"hostdependency" : {}, "servicedependency" : {}}
+		self.status = None
+		self.files = collections.OrderedDict()
+		self.sources = {}
+		# Main configuration file lists are appended to when parsed.
+		self.conf["cfg_file"] = []
+		self.conf["cfg_dir"] = []
+
+		self.loadConfig()
+
+	@synchronized
+	def updateConfig(self):
+		"""Read again only object files that changed since they were
+		read and return the number of files read"""
+
+		if getStat(self.conf["config"]) != self.config_stat:
+			# Main configuration may list different files now.
+			self.reloadConfig()
+			return len(self.files)
+
+		paths = self.findObjectFiles()
+		stale = set()
+		for path in paths:
+			if (not path in self.files) or (getStat(path) != (self.files[path]["mtime"], self.files[path]["size"])):
+				stale.add(path)
+		# Files that are no longer mentioned are stale as well.
+		stale.update(set(self.files.keys()) - set(paths))
+		if len(stale) == 0:
+			return 0
+
+		# Templates defined in replaced files before and after
+		# the change may affect objects from any other file.
+		names = self.getTemplateNames(stale)
+		self.readFiles(stale, paths)
+		names.update(self.getTemplateNames(stale))
+
+		# Find every template that inherits from changed ones.
+		changed = True
+		while changed:
+			changed = False
+			for (kind, tmpl) in self.getTemplateDicts():
+				for (name, t) in tmpl.items():
+					if (not (kind, name) in names) and self.usesTemplates(t, kind, names):
+						names.add((kind, name))
+						changed = True
+
+		# Objects that inherited from changed templates must be
+		# read again to forget parameters they inherited.
+		affected = set()
+		for path in paths:
+			if path in stale:
+				continue
+			objects = self.sources.get(path, {})
+			for kind in ("host", "service", "contact"):
+				for o in objects.get(kind + "s", []):
+					if self.usesTemplates(o, kind, names):
+						affected.add(path)
+			for o in objects.get("dependencies", []):
+				if self.usesTemplates(o, o.getKind(), names):
+					affected.add(path)
+			for (kind, _) in self.getTemplateDicts():
+				for o in objects.get(kind + "_tmpl", []):
+					if self.usesTemplates(o, kind, names):
+						affected.add(path)
+		if len(affected) > 0:
+			self.readFiles(affected, paths)
+
+		self.printMessage("Read %u changed and %u affected files" % (len(stale), len(affected)), 3)
+
+		if self.conf["cache_dir"] != "":
+			self.writeNames()
+
+		return len(stale) + len(affected)
+
+	def getTemplateNames(self, paths):
+		"""Return a set of (kind, name) tuples of templates defined
+		in given files"""
+
+		names = set()
+		for path in paths:
+			objects = self.sources.get(path, {})
+			for (kind, _) in self.getTemplateDicts():
+				for t in objects.get(kind + "_tmpl", []):
+					names.add((kind, t.getParam("name")))
+		return names
+
+	def getTemplateDicts(self):
+		"""Return a list of tuples of object kinds and dictionaries
+		of their templates"""
+
+		return [
+			("host", self.host_tmpl),
+			("service", self.service_tmpl),
+			("contact", self.contact_tmpl),
+			("hostdependency", self.dependency_tmpl["hostdependency"]),
+			("servicedependency", self.dependency_tmpl["servicedependency"])
+		]
+
+	def usesTemplates(self, object, kind, names):
+		"""Check if object uses any of given templates"""
+
+		for u in object.getUses():
+			if (kind, u) in names:
+				return True
+		return False
 
-	import re
+	def readFiles(self, stale, paths):
+		"""Replace objects read from stale files and rebuild object
+		lists in the order files are listed"""
+
+		for path in stale:
+			if path in self.files:
+				del self.files[path]
+			if path in self.sources:
+				del self.sources[path]
+		for path in paths:
+			if path in stale:
+				self.parseFile(path)
+
+		# Keep files and their objects in the same order a full
+		# read would have.
+		files = collections.OrderedDict()
+		for path in paths:
+			if path in self.files:
+				files[path] = self.files[path]
+		self.files = files
+
+		self.hosts = []
+		self.services = []
+		self.hostgroups = []
+		self.servicegroups = []
+		self.contacts = []
+		self.contactgroups = []
+		self.dependencies = []
+		# Template dictionaries are shared with objects so they
+		# have to be changed in place.
+		for (_, tmpl) in self.getTemplateDicts():
+			tmpl.clear()
+		for path in self.files.keys():
+			objects = self.sources[path]
+			self.hosts.extend(objects["hosts"])
+			self.services.extend(objects["services"])
+			self.hostgroups.extend(objects["hostgroups"])
+			self.servicegroups.extend(objects["servicegroups"])
+			self.contacts.extend(objects["contacts"])
+			self.contactgroups.extend(objects["contactgroups"])
+			self.dependencies.extend(objects["dependencies"])
+			for (kind, tmpl) in self.getTemplateDicts():
+				for t in objects[kind + "_tmpl"]:
+					tmpl[t.getParam("name")] = t
+
+		# Files read or removed may change any of the indexes.
+		self.resetIndexes()
+
+	def resetIndexes(self):
+		"""Forget indexes built from loaded objects so that they
+		are built again on next use"""
+
+		self.children = None
+		self.dependents = None
+		self.servicegroup_index = None
+		self.contact_index = None
+
+	@profiled("hostgroups")
+	def expandHostgroups(self, hosts):
+		"""Setup host parameters and add hostgroups that list hosts
+		as their members"""
+
+		for h in hosts:
+			h.setupParams()
+
+		# Index hosts by name so that members don't need to be
+		# compared with every host.
+		names = {}
+		for h in hosts:
+			names.setdefault(h.getName(), []).append(h)
+
+		# Add additional hostgroups to hosts by checking hostgroup members.
+		for hostgroup in self.hostgroups:
+			for member in hostgroup.getMembers():
+				if member == "*":
+					members = hosts
+				else:
+					members = names.get(member, [])
+				for host in members:
+					host.addHostgroup(hostgroup.getName())
 
-	# Make sure that args is a list or otherwise strange things might happen.
-	if type(args).__name__ != "list":
-		raise TypeError
+	def resolveHost(self, host, services):
+		"""Return a list of origins of services assigned to a host"""
 
-	if "" in args:
-		# Return empty list when first argument contains empty string.
-		# This would cause regexp to always match.
-		return []
+		result = []
+		for s in services:
+			s.setupParams()
+			if host.matchService(s._include_host, s._exclude_host, s._include_hostgroup, s._exclude_hostgroup):
+				result.append(s._origin)
+		return result
 
-	if type(pack).__name__  == "dict":
-		# Return dictionary when given one as second argument.
-		results = {}
-		for p in pack.keys():
-			count = p.count(" ") + 1
-			# Limit number of elements in args to number of words in current object
-			# and build a regular expression to match object key.
-			if re.search("^"+"\w*\s+".join(args[:count]), p, re.IGNORECASE):
-				results[p] = pack[p]
+	def getCacheKey(self):
+		"""Return a digest of every object file read"""
 
-	elif type(pack).__name__  == "list":
-		# Return list when given one as second argument.
-		results = []
-		for p in pack:
-			count = p.count(" ") + 1
-			# Limit number of elements in args to number of words in current object
-			# and build a regular expression to match object.
-			if re.search("^"+"\w*\s+".join(args[:count]), p, re.IGNORECASE):
-				results.append(p)
-	else:
-		# Raise exception when list or dictionary not given.
-		raise TypeError
+		import hashlib
 
-	return results
+		digest = hashlib.md5()
+		digest.update("%u\n" % (cache_version))
+		for (path, details) in self.files.items():
+			digest.update("%s\0%s\n" % (path, details["digest"]))
+		return digest.hexdigest()
 
+	def getCachePath(self, kind):
+		"""Return a path to cache file of given kind for main config"""
 
-def searchObjects(command, scope):
-	"""Display a list o matching objects"""
+		import hashlib
 
-	if len(command) > 1:
-		sys.stderr.write("Unrecognized search parameters: %s\n" %(" ".join(command[1:])))
-		sys.exit(1)
+		name = hashlib.md5(os.path.abspath(self.conf["config"])).hexdigest()
+		return os.path.join(self.conf["cache_dir"], "%s-%s.cache" % (kind, name))
 
-	# Resolve host and service assignments and get a filtered list of objects.
-	objects = matchObjects()
+	def readCache(self, kind):
+		"""Return data read from cache file or None when there's none"""
 
-	if scope == "all":
-		# When no scope is defined print hosts with services.
-		for i in range(0, objects.getCount()):
-			print "%s: %s" % (objects.getHost(i).getName(), ", ".join([s.getName() for s in objects.getServiceList(i)]))
+		import cPickle
 
-	if scope == "host":
-		# When host scope is requested print only hosts.
-		for h in objects.getHostList():
-			print h.getName()
+		try:
+			fh = open(self.getCachePath(kind), "rb")
+			try:
+				return cPickle.load(fh)
+			finally:
+				fh.close()
+		except (IOError, EOFError, ValueError, cPickle.UnpicklingError), error:
+			self.printMessage("Cannot read cache: %s" % (error), 3)
+			return None
 
-	if scope == "service":
-		# When service scope is requested print only uique service names.
-		services = []
-		for i in range(0, objects.getCount()):
-			# Get service names.
-			names = [s.getName() for s in objects.getServiceList(i)]
-			for n in names:
-				# Filter out duplicates
-				if not n in services:
-					services.append(n)
-		print "\n".join(services)
+	def writeCache(self, kind, data, raw = False):
+		"""Atomically replace cache file with given data (or lines
+		of text when raw is set)"""
 
-	# Return an empty list of commands to run.
-	return []
+		import cPickle
 
+		def write(fh, temp):
+			if raw:
+				fh.writelines(data)
+			else:
+				cPickle.dump(data, fh, 2)
 
-def toggleNotifications(command, scope):
-	"""Enable or disable notifications for various objects"""
+		try:
+			if not os.path.isdir(self.conf["cache_dir"]):
+				os.makedirs(self.conf["cache_dir"])
+			replaceFile(self.getCachePath(kind), write, 0600)
+		except (IOError, OSError), error:
+			self.printMessage("Cannot write cache: %s" % (error), 2)
+
+	def getNames(self):
+		"""Return a sorted list of (kind, name) tuples of every named
+		object that can be completed"""
+
+		names = set()
+		for (kind, objects) in (
+			("host", self.hosts),
+			("service", self.services),
+			("servicegroup", self.servicegroups),
+			("contact", self.contacts),
+			("contactgroup", self.contactgroups)
+		):
+			for o in objects:
+				name = o.getName()
+				# Names are stored one per line.
+				if (not name is None) and (not "\n" in name):
+					names.add((kind, name))
+		return sorted(names)
+
+	def writeNames(self):
+		"""Write an index of object names for shell completion unless
+		the one in cache is up to date"""
+
+		key = self.getCacheKey()
+		path = self.getCachePath("names")
+		try:
+			fh = open(path, "r")
+			try:
+				if fh.readline() == "# %s\n" % (key):
+					return
+			finally:
+				fh.close()
+		except IOError:
+			pass
 
-	action = command[0]
+		# A plain text file of "kind<TAB>name" lines sorted so that
+		# lookups can bisect it without parsing anything.
+		lines = ["%s\t%s\n" % (kind, name) for (kind, name) in self.getNames()]
+		self.writeCache("names", ["# %s\n" % (key)] + lines, raw = True)
 
-	if len(command) > 2:
-		sys.stderr.write("Unrecognized %s notifications parameters: %s\n" % (action, " ".join(command[2:])))
-		sys.exit(1)
+	def completeName(self, kind, prefix = ""):
+		"""Return a list of names of given kind starting with prefix
+		read from the name index"""
 
-	if action in ["enable", "disable"]:
-		# Nagios likes its commands in uppercase.
-		action = action.upper()
-	else:
-		sys.stderr.write("Unrecognized command: %s\n" % (action))
-		sys.exit(1)
+		import bisect
 
-	commands = []
+		if not kind in completion_kinds:
+			raise NagctlError("Unknown kind of names: %s" % (kind))
+		if self.conf["cache_dir"] == "":
+			raise NagctlError("Name index requires --cache-dir")
 
-	# Resolve host and service assignments and get a filtered list of objects.
-	objects = matchObjects()
+		try:
+			fh = open(self.getCachePath("names"), "r")
+			try:
+				# Skip the cache key.
+				fh.readline()
+				lines = fh.readlines()
+			finally:
+				fh.close()
+		except IOError, error:
+			self.printMessage("Cannot read name index: %s" % (error), 2)
+			return []
+
+		start = "%s\t%s" % (kind, prefix)
+		result = []
+		for i in range(bisect.bisect_left(lines, start), len(lines)):
+			if not lines[i].startswith(start):
+				break
+			result.append(lines[i][len(kind) + 1:-1])
+		return result
+
+	@profiled("assignment")
+	def getAssignment(self):
+		"""Return a dictionary of host origins to a tuple of hostgroups
+		and origins of assigned services, reusing cached results"""
+
+		key = self.getCacheKey()
+		cached = self.readCache("assign")
+
+		if (not cached is None) and (cached["key"] == key):
+			self.printMessage("Using cached assignments", 3)
+			return cached["hosts"]
+
+		self.expandHostgroups(self.hosts)
+		assignment = None
+		if not cached is None:
+			assignment = self.updateAssignment(cached)
+		if assignment is None:
+			self.printMessage("Resolving all assignments", 3)
+			assignment = {}
+			for h in self.hosts:
+				assignment[h._origin] = (list(h._hostgroup), self.resolveHost(h, self.services))
+
+		files = dict([(p, d.copy()) for (p, d) in self.files.items()])
+		self.writeCache("assign", {"key" : key, "order" : self.files.keys(), "files" : files, "hosts" : assignment})
+
+		return assignment
+
+	def updateAssignment(self, cached):
+		"""Return assignments with only hosts and services from
+		changed files resolved again or None when that's not possible"""
+
+		old = cached["files"]
+		if cached["order"] != self.files.keys():
+			# Files were added, removed or reordered.
+			return None
 
-	if (scope == "host") or (scope == "all"):
-		for h in objects.getHostList():
-			commands.append("%s_HOST_NOTIFICATIONS;%s" % (action, h.getName()))
+		changed = set([p for p in self.files.keys() if old[p]["digest"] != self.files[p]["digest"]])
+		for p in changed:
+			if old[p]["static"] or self.files[p]["static"]:
+				# Templates and hostgroups may affect any object.
+				return None
+
+		self.printMessage("Resolving assignments of %u changed files" % (len(changed)), 3)
+
+		# Hosts defined in changed files are resolved from scratch.
+		hosts = set()
+		for p in changed:
+			hosts.update(old[p]["hosts"])
+			hosts.update(self.files[p]["hosts"])
+		services = [s for s in self.services if s._origin[0] in changed]
+		# Assigned services are kept in the order they were read.
+		position = dict([(s._origin, i) for (i, s) in enumerate(self.services)])
+
+		assignment = {}
+		for h in self.hosts:
+			name = h._origin
+			if (name in hosts) or (not name in cached["hosts"]):
+				assignment[name] = (list(h._hostgroup), self.resolveHost(h, self.services))
+				continue
+			kept = [o for o in cached["hosts"][name][1] if not o[0] in changed]
+			origins = kept + self.resolveHost(h, services)
+			origins.sort(key = position.get)
+			assignment[name] = (list(h._hostgroup), origins)
 
-	if (scope == "service") or (scope == "all"):
-		for i in range(0, objects.getCount()):
-			# Get host object.
-			h = objects.getHost(i)
-			# Get service objects.
-			for s in objects.getServiceList(i):
-				commands.append("%s_SVC_NOTIFICATIONS;%s;%s" % (action, h.getName(), s.getName()))
+		return assignment
 
-	return commands
+	def getSelectionPath(self, name):
+		"""Return a path to the file of a saved selection"""
 
+		import re
 
-def toggleChecks(command, scope):
-	"""Enable or disable active checks for various objects"""
+		if not re.search("^[A-Za-z0-9_][A-Za-z0-9_.-]*$", name):
+			raise NagctlError("Invalid selection name: %s" % (name))
+		return os.path.join(os.path.expanduser(self.conf["selection_dir"]), name)
+
+	def saveSelection(self, name, pairs):
+		"""Save (host, service) pairs so that later commands can act
+		on the same objects"""
+
+		import cPickle
+		import time
+
+		# Hosts are kept in the order they were selected with their
+		# resolved parameters and origins. Services are kept once
+		# per host.
+		hosts = collections.OrderedDict()
+		for (h, s) in pairs:
+			if not h._origin in hosts:
+				# Hostgroups resolved from hostgroup members are kept too.
+				param = dict(h._param, hostgroups = ",".join(getattr(h, "_hostgroup", [])))
+				hosts[h._origin] = [param, h._origin, False, []]
+			if s is None:
+				hosts[h._origin][2] = True
+			else:
+				hosts[h._origin][3].append((s._param, s._origin))
 
-	action = command[0]
+		data = {
+			"version" : cache_version,
+			"time" : time.time(),
+			"config" : dict([(k, self.conf[k]) for k in ("config", "command_file", "status_file", "interval_length")]),
+			"hosts" : hosts.values()
+		}
 
-	if len(command) > 2:
-		sys.stderr.write("Unrecognized %s checks parameters: %s\n" % (action, " ".join(command[2:])))
-		sys.exit(1)
+		path = self.getSelectionPath(name)
+		try:
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			replaceFile(path, lambda fh, temp: cPickle.dump(data, fh, 2), 0600)
+		except (IOError, OSError), error:
+			raise NagctlError("Cannot save selection: %s" % (error))
 
-	if action in ["enable", "disable"]:
-		# Nagios likes its commands in uppercase.
-		action = action.upper()
-	else:
-		sys.stderr.write("Unrecognized command: %s\n" % (action))
-		return False
+		self.printMessage("Saved %u objects as selection %s" % (len(pairs), name), 2)
 
-	commands = []
+	@profiled("parseFile")
+	def loadSelection(self, name):
+		"""Read objects saved by saveSelection()"""
 
-	# Resolve host and service assignments and get a filtered list of objects.
-	objects = matchObjects()
+		import cPickle
+		import time
 
-	if (scope == "host") or (scope == "all"):
-		for h in objects.getHostList():
-			commands.append("%s_HOST_CHECK;%s" % (action, h.getName()))
+		try:
+			fh = open(self.getSelectionPath(name), "rb")
+			try:
+				data = cPickle.load(fh)
+			finally:
+				fh.close()
+		except (IOError, EOFError, ValueError, cPickle.UnpicklingError), error:
+			raise NagctlError("Cannot read selection %s: %s" % (name, error))
+		if data.get("version") != cache_version:
+			raise NagctlError("Selection %s was saved by another nagctl version" % (name))
+
+		for k in ("command_file", "status_file", "interval_length"):
+			self.conf[k] = data["config"][k]
+
+		objects = ObjectLink()
+		selected = set()
+		self.hosts = []
+		self.services = []
+		for (param, origin, alone, services) in data["hosts"]:
+			h = Host(param, {})
+			h._origin = origin
+			objects.addHost(h)
+			self.hosts.append(h)
+			if alone:
+				selected.add(h.getName())
+			for (p, o) in services:
+				s = Service(p, {})
+				s._origin = o
+				objects.addService(s)
+				self.services.append(s)
+		self.selection = (objects, selected)
+
+		self.printMessage("Using selection %s of %s saved %s" % (name, data["config"]["config"], time.ctime(data["time"])), 3)
+
+	@profiled("export")
+	def exportSqlite(self, path):
+		"""Write resolved objects and service assignments to a new
+		SQLite database"""
+
+		sqlite3 = importSqlite()
+
+		for o in self.hosts + self.services + self.contacts + self.dependencies:
+			o.setupParams()
+		self.expandHostgroups(self.hosts)
+
+		hosts = []
+		services = []
+		templates = []
+		params = []
+		uses = []
+		for (i, s) in enumerate(self.services):
+			services.append((i, s.getName(), s._origin[0], s._origin[1]))
+			params.extend([("service", i, k, v) for (k, v) in sorted(s._param.items())])
+			uses.extend([("service", i, n, u) for (n, u) in enumerate(s.getUses())])
+		ids = dict([(s._origin, i) for (i, s) in enumerate(self.services)])
+		hostgroups = []
+		assignment = []
+		for (i, h) in enumerate(self.hosts):
+			hosts.append((i, h.getName(), h._origin[0], h._origin[1]))
+			params.extend([("host", i, k, v) for (k, v) in sorted(h._param.items())])
+			uses.extend([("host", i, n, u) for (n, u) in enumerate(h.getUses())])
+			hostgroups.extend([(i, g) for g in h._hostgroup])
+			assignment.extend([(i, ids[o], n) for (n, o) in enumerate(self.resolveHost(h, self.services))])
+		for (kind, tmpl) in self.getTemplateDicts():
+			for name in sorted(tmpl.keys()):
+				# Templates are not resolved here as ones no object
+				# uses may use themselves in a loop.
+				t = tmpl[name]
+				i = len(templates)
+				templates.append((i, kind, name))
+				params.extend([("template", i, k, v) for (k, v) in sorted(t._param.items())])
+				uses.extend([("template", i, n, u) for (n, u) in enumerate(t.getUses())])
+		groups = []
+		for (i, g) in enumerate(self.hostgroups):
+			groups.append((i, g.getName(), g.getParam("alias")))
+			params.extend([("hostgroup", i, k, v) for (k, v) in sorted(g._param.items())])
+		# Objects selectors and impact expansion read are kept with
+		# their resolved parameters.
+		others = {}
+		for (kind, objects) in (("servicegroup", self.servicegroups), ("contact", self.contacts), ("contactgroup", self.contactgroups)):
+			others[kind] = []
+			for (i, o) in enumerate(objects):
+				others[kind].append((i, o.getName()))
+				params.extend([(kind, i, k, v) for (k, v) in sorted(o._param.items())])
+		dependencies = []
+		for (i, d) in enumerate(self.dependencies):
+			dependencies.append((i, d.getKind()))
+			params.extend([("dependency", i, k, v) for (k, v) in sorted(d._param.items())])
+		config = [(k, self.conf[k]) for k in ("command_file", "status_file", "interval_length")]
+
+		def write(fh, temp):
+			db = sqlite3.connect(temp)
+			# Configuration files may use any encoding.
+			db.text_factory = str
+			try:
+				db.executescript(sqlite_schema)
+				# Every table is filled in one transaction.
+				db.executemany("INSERT INTO config VALUES (?, ?)", config)
+				db.executemany("INSERT INTO hosts VALUES (?, ?, ?, ?)", hosts)
+				db.executemany("INSERT INTO services VALUES (?, ?, ?, ?)", services)
+				db.executemany("INSERT INTO hostgroups VALUES (?, ?, ?)", groups)
+				db.executemany("INSERT INTO host_hostgroups VALUES (?, ?)", hostgroups)
+				db.executemany("INSERT INTO servicegroups VALUES (?, ?)", others["servicegroup"])
+				db.executemany("INSERT INTO contacts VALUES (?, ?)", others["contact"])
+				db.executemany("INSERT INTO contactgroups VALUES (?, ?)", others["contactgroup"])
+				db.executemany("INSERT INTO dependencies VALUES (?, ?)", dependencies)
+				db.executemany("INSERT INTO templates VALUES (?, ?, ?)", templates)
+				db.executemany("INSERT INTO uses VALUES (?, ?, ?, ?)", uses)
+				db.executemany("INSERT INTO params VALUES (?, ?, ?, ?)", params)
+				db.executemany("INSERT INTO assignment VALUES (?, ?, ?)", assignment)
+				db.executescript(sqlite_indexes)
+				db.commit()
+			finally:
+				db.close()
 
-	if (scope == "service") or (scope == "all"):
-		for i in range(0, objects.getCount()):
-			# Get host object.
-			h = objects.getHost(i)
-			# Get service objects.
-			for s in objects.getServiceList(i):
-				commands.append("%s_SVC_CHECK;%s;%s" % (action, h.getName(), s.getName()))
+		try:
+			# Readers never see a partially written database.
+			replaceFile(path, write)
+		except (sqlite3.Error, IOError, OSError), error:
+			raise NagctlError("Cannot write database: %s" % (error))
 
-	return commands
+		self.printMessage("Exported %u hosts, %u services and %u assignments to %s" % (len(hosts), len(services), len(assignment), path), 2)
 
+	@profiled("parseFile")
+	def loadDatabase(self, path, select = False):
+		"""Read hosts, services and service assignments from a database
+		written by exportSqlite(); when select is set only hosts and
+		services matching names are read"""
 
-def scheduleDowntime(command, scope):
-	"""Schedule downtime for various objects"""
+		import re
 
-	if len(command) > 4:
-		sys.stderr.write("Unrecognized schedule downtime parameters: %s\n" % (" ".join(command[2:])))
-		sys.exit(1)
+		sqlite3 = importSqlite()
 
-	if len(command) < 4:
-		sys.stderr.write("Missing required command parameters: comment or duration\n")
-		sys.exit(1)
+		if not os.path.isfile(path):
+			raise NagctlError("Database not found: %s" % (path))
 
-	# Get duration and comment from passed parameters.
-	(duration, comment) = command[-2:]
-	try:
-		duration = int(duration)
-	except ValueError:
-		# Seems that duration is not an integer.
-		sys.stderr.write("Invalid parameter: %s\n" % (duration))
-		sys.exit(1)
+		# Objects other than the matched ones are needed to expand
+		# impact and downtimes or to find group members.
+		if select and (not self.conf["impact"]) and (not self.conf["propagate"]) and (self.conf["servicegroup"] is None) and (self.conf["contact"] is None) and (self.conf["contactgroup"] is None):
+			patterns = [self.conf["host"], self.conf["service"]]
+		else:
+			patterns = [None, None]
+		# Conditions on names of hosts and services to read.
+		where = []
+		for pattern in patterns:
+			if pattern is None:
+				where.append(("", ()))
+			else:
+				where.append((" WHERE name REGEXP ?", ("^" + pattern + "$",)))
+		self.partial = patterns != [None, None]
 
-	import time
+		try:
+			db = sqlite3.connect(path)
+			# Names are kept as byte strings like the ones read
+			# from configuration files.
+			db.text_factory = str
+			# Unnamed objects never match like in matchName().
+			db.create_function("regexp", 2, lambda p, v: (not v is None) and (not re.search(p, v) is None))
+			try:
+				for (k, v) in db.execute("SELECT key, value FROM config"):
+					self.conf[k] = v
+
+				hosts_where = where[0][0]
+				services_where = where[1][0]
+				# Host parameters come first and service ones second
+				# in every query made of both.
+				args = where[0][1] + where[1][1]
+
+				params = {}
+				query = "SELECT kind, object_id, key, value FROM params WHERE kind NOT IN ('host', 'service') UNION ALL SELECT kind, object_id, key, value FROM params WHERE kind = 'host' AND object_id IN (SELECT id FROM hosts%s) UNION ALL SELECT kind, object_id, key, value FROM params WHERE kind = 'service' AND object_id IN (SELECT id FROM services%s)"
+				for (kind, id, k, v) in db.execute(query % (hosts_where, services_where), args):
+					params.setdefault((kind, id), {})[k] = v
+
+				self.hosts = []
+				self.services = []
+				self.hostgroups = []
+				self.host_tmpl = {}
+				self.service_tmpl = {}
+				services = {}
+				for (id, file, position) in db.execute("SELECT id, file, position FROM services%s ORDER BY id" % (services_where), where[1][1]):
+					s = Service(params.get(("service", id), {}), {})
+					s._origin = (file, position)
+					self.services.append(s)
+					services[id] = s
+				hosts = {}
+				for (id, file, position) in db.execute("SELECT id, file, position FROM hosts%s ORDER BY id" % (hosts_where), where[0][1]):
+					h = Host(params.get(("host", id), {}), {})
+					h._origin = (file, position)
+					self.hosts.append(h)
+					hosts[id] = h
+				for (id, kind, name) in db.execute("SELECT id, kind, name FROM templates WHERE kind IN ('host', 'service')"):
+					if kind == "host":
+						self.host_tmpl[name] = Host(params.get(("template", id), {}), {})
+					else:
+						self.service_tmpl[name] = Service(params.get(("template", id), {}), {})
+				for (id,) in db.execute("SELECT id FROM hostgroups ORDER BY id"):
+					self.hostgroups.append(Hostgroup(params.get(("hostgroup", id), {})))
+				# Parameters were resolved before export so these
+				# objects need no templates.
+				self.servicegroups = [Servicegroup(params.get(("servicegroup", id), {})) for (id,) in db.execute("SELECT id FROM servicegroups ORDER BY id")]
+				self.contacts = [Contact(params.get(("contact", id), {}), {}) for (id,) in db.execute("SELECT id FROM contacts ORDER BY id")]
+				self.contactgroups = [Contactgroup(params.get(("contactgroup", id), {})) for (id,) in db.execute("SELECT id FROM contactgroups ORDER BY id")]
+				self.dependencies = [Dependency(kind, params.get(("dependency", id), {}), {}) for (id, kind) in db.execute("SELECT id, kind FROM dependencies ORDER BY id")]
+
+				assignment = dict([(h._origin, ([], [])) for h in self.hosts])
+				for (id, group) in db.execute("SELECT host_id, hostgroup FROM host_hostgroups WHERE host_id IN (SELECT id FROM hosts%s) ORDER BY rowid" % (hosts_where), where[0][1]):
+					assignment[hosts[id]._origin][0].append(group)
+				for (host, service) in db.execute("SELECT host_id, service_id FROM assignment WHERE host_id IN (SELECT id FROM hosts%s) AND service_id IN (SELECT id FROM services%s) ORDER BY host_id, position" % (hosts_where, services_where), args):
+					assignment[hosts[host]._origin][1].append(services[service]._origin)
+				self.assignment = assignment
+			finally:
+				db.close()
+		except sqlite3.Error, error:
+			raise NagctlError("Cannot read database: %s" % (error))
+
+	@synchronized
+	def matchObjects(self):
+		"""Resolve dependencies between hosts and services
+		and return a nested list of matches"""
+
+		# Create an object that will hold all other objects.
+		result = ObjectLink()
+
+		if not self.selection is None:
+			# Objects of a saved selection are matched already.
+			for i in range(0, self.selection[0].getCount()):
+				h = self.selection[0].getHost(i)
+				if not h.matchName(self.conf["host"]):
+					continue
+				h.setupParams()
+				result.addHost(h)
+				for s in self.selection[0].getServiceList(i):
+					if (self.conf["service"] is None) or s.matchName(self.conf["service"]):
+						s.setupParams()
+						result.addService(s)
+			return result
+
+		if self.conf["host"] is None:
+			# When no host constraint was specified match all hosts.
+			matched_hosts = self.hosts
+		else:
+			# Get a list of hosts filtered by name.
+			matched_hosts = [h for h in self.hosts if h.matchName(self.conf["host"])]
 
-	commands = []
-	timestamp = int(time.time())
+		if self.conf["service"] is None:
+			# When no service constraint was specified match all services.
+			matched_services = self.services
+		else:
+			# Get a list of services filtered by name.
+			matched_services = [s for s in self.services if s.matchName(self.conf["service"])]
+
+		assignment = self.assignment
+		if (assignment is None) and (self.conf["cache_dir"] != ""):
+			assignment = self.getAssignment()
+		if not assignment is None:
+			# Filter resolved assignments instead of matching again.
+			origins = dict([(s._origin, s) for s in matched_services])
+			for h in matched_hosts:
+				if not h._origin in assignment:
+					continue
+				(groups, assigned) = assignment[h._origin]
+				h.setupParams()
+				h._hostgroup = list(groups)
+				added = False
+				for o in assigned:
+					if o in origins:
+						if not added:
+							result.addHost(h)
+							added = True
+						result.addService(origins[o])
+			return result
+
+		start = self.startPhase("templates")
+		# Inherit template parameters before anything else needs them.
+		for o in matched_hosts + matched_services:
+			o.setupParams()
+		self.endPhase(start)
+
+		self.expandHostgroups(matched_hosts)
+
+		start = self.startPhase("matching")
+		matched = 0
+		for h in matched_hosts:
+			added = False
+			# Start with an empty inner list.
+			for s in matched_services:
+				# Check if a host have a particular service attached.
+				if h.matchService(s._include_host, s._exclude_host, s._include_hostgroup, s._exclude_hostgroup):
+					if not added:
+						# First element of inner list is the host object.
+						result.addHost(h)
+						added = True
+					# Append service object to inner list.
+					result.addService(s)
+					matched += 1
+		self.endPhase(start)
+		self.countObjects("pairs tested", len(matched_hosts) * len(matched_services))
+		self.countObjects("pairs matched", matched)
+
+		return result
+
+	@profiled("parseStatus")
+	def parseStatus(self, file):
+		"""Parse Nagios status file and return an index of object states"""
+
+		# Index keys are host names for hosts and (host, service) tuples
+		# for services. Values are dictionaries of integer state fields.
+		index = {}
 
-	# Resolve host and service assignments and get a filtered list of objects.
-	objects = matchObjects()
+		try:
+			fh = open(file, "r")
+			try:
+				self.printMessage("Reading status file: %s" % (file), 3)
+				# The block we're currently inside of and its fields.
+				block = None
+				param = {}
+
+				# Status file can get big so read it line by line instead
+				# of loading it into memory at once.
+				for line in fh:
+					line = line.strip()
+					# Plugin output may end with a brace too so only
+					# lines outside blocks can start a new one.
+					if (block is None) and (not "=" in line) and line.endswith("{"):
+						block = line[:-1].strip()
+						param = {}
+						continue
+					if line == "}":
+						# Downtimes read before the object's own block
+						# are already in the index so merge into it.
+						if (block == "hoststatus") and ("host_name" in param):
+							index.setdefault(param.pop("host_name"), {}).update(param)
+						if (block == "servicestatus") and ("host_name" in param) and ("service_description" in param):
+							index.setdefault((param.pop("host_name"), param.pop("service_description")), {}).update(param)
+						if (block in ("hostdowntime", "servicedowntime")) and ("host_name" in param):
+							if block == "hostdowntime":
+								key = param.pop("host_name")
+							else:
+								key = (param.pop("host_name"), param.pop("service_description", None))
+							# Downtimes are kept in a list attached to the object
+							# which may not have been read yet.
+							index.setdefault(key, {}).setdefault("downtime", []).append(param)
+						block = None
+						param = {}
+						continue
+					# Skip blocks that describe anything but objects.
+					if not block in ("hoststatus", "servicestatus", "hostdowntime", "servicedowntime"):
+						continue
+					(k, _, v) = line.partition("=")
+					if k in ("host_name", "service_description", "author", "comment"):
+						param[k] = v
+					elif (k in status_fields) or (k in downtime_fields):
+						try:
+							param[k] = int(v)
+						except ValueError:
+							pass
+
+			finally:
+				# Make sure the file gets closed.
+				fh.close()
 
-	if (scope == "host") or (scope == "all"):
-		for h in objects.getHostList():
-			commands.append("SCHEDULE_HOST_DOWNTIME;%s;%u;%u;1;0;%u;nagctl;%s" % (h.getName(), timestamp, timestamp + duration, duration, comment))
+		except IOError, error:
+			raise NagctlError("Cannot read status file: %s" % (error))
 
-	if (scope == "service") or (scope == "all"):
-		for i in range(0, objects.getCount()):
-			# Get host object.
-			h = objects.getHost(i)
-			# Get service objects.
-			for s in objects.getServiceList(i):
-				commands.append("SCHEDULE_SVC_DOWNTIME;%s;%s;%u;%u;1;0;%u;nagctl;%s" % (h.getName(), s.getName(), timestamp, timestamp + duration, duration, comment))
+		return index
 
-	return commands
+	@synchronized
+	def getStatus(self):
+		"""Return an index of object states reading status file on first use"""
 
+		if self.status is None:
+			if self.conf["status_file"] == "":
+				# There's nowhere to read the states from.
+				return None
+			self.status = self.parseStatus(self.conf["status_file"])
+		return self.status
 
-def scheduleCheck(command, scope):
-	"""Schedule next active check for various objects"""
+	def getStateFilter(self, problem = False):
+		"""Return a tuple describing runtime state filters or None
+		when objects should not be filtered by state"""
 
-	if len(command) > 3:
-		sys.stderr.write("Unrecognized schedule check parameters: %s\n" % (" ".join(command[2:])))
-		sys.exit(1)
+		if (self.conf["state"] is None) and (not self.conf["unacked"]) and (not problem):
+			return None
 
-	if len(command) < 3:
-		sys.stderr.write("Missing required command parameters: time\n")
-		sys.exit(1)
+		# Split state names into host and service state codes.
+		host = None
+		service = None
+		if not self.conf["state"] is None:
+			host = set()
+			service = set()
+			for name in self.conf["state"].split(","):
+				name = name.strip().lower()
+				if name == "":
+					continue
+				if not ((name in host_states) or (name in service_states)):
+					raise NagctlError("Unrecognized state: %s" % (name))
+				if name in host_states:
+					host.add(host_states[name])
+				if name in service_states:
+					service.add(service_states[name])
+
+		index = self.getStatus()
+		if index is None:
+			if (not self.conf["state"] is None) or self.conf["unacked"]:
+				raise NagctlError("Cannot match objects by state: status_file is not set")
+			# Problems can't be told apart from anything else so fall back
+			# to targeting every matched object.
+			self.printMessage("Status file not set, targeting all matching objects", 2)
+			return None
 
-	# Get duration and comment from passed parameters.
-	timestamp = command[-1]
-	try:
-		timestamp = int(timestamp)
-	except ValueError:
-		# Seems that time is not an integer.
-		sys.stderr.write("Invalid parameter: %s\n" % (timestamp))
-		sys.exit(1)
+		return (index, host, service, self.conf["unacked"] or problem, problem)
 
-	import time
-	timestamp = int(time.time() + timestamp)
+	def pruneCommands(self, commands):
+		"""Return a list of commands without those that would be no-ops"""
 
-	commands = []
+		index = self.getStatus()
+		if index is None:
+			raise NagctlError("Cannot prune commands: status_file is not set")
 
-	# Resolve host and service assignments and get a filtered list of objects.
-	objects = matchObjects()
+		result = [c for c in commands if not isNoop(c, index)]
+		self.printMessage("Pruned %u commands that would not change object state" % (len(commands) - len(result)), 1)
 
-	if (scope == "host") or (scope == "all"):
-		for h in objects.getHostList():
-			commands.append("SCHEDULE_HOST_CHECK;%s;%u" % (h.getName(), timestamp))
+		return result
 
-	if (scope == "service") or (scope == "all"):
-		for i in range(0, objects.getCount()):
-			# Get host object.
-			h = objects.getHost(i)
-			# Get service objects.
-			for s in objects.getServiceList(i):
-				commands.append("SCHEDULE_SVC_CHECK;%s;%s;%u" % (h.getName(), s.getName(), timestamp))
+	def selectObjects(self, objects, scope, problem = False):
+		"""Return a list of (host, service) pairs matching scope and state
+		filters. Service is None for pairs that stand for hosts."""
 
-	return commands
+		state = self.getStateFilter(problem)
+		result = []
 
+		# Sets of host names and service instances that selected
+		# servicegroups and contacts allow.
+		filters = []
+		if not self.conf["servicegroup"] is None:
+			members = set()
+			index = self.getServicegroupIndex()
+			for g in self.getSelectedServicegroups():
+				members.update(index[g])
+			filters.append((set([h for (h, _) in members]), members))
+		if (not self.conf["contact"] is None) or (not self.conf["contactgroup"] is None):
+			filters.append(self.getContactFilter())
 
-def acknowledgeProblem(command, scope):
-	"""Acknowledge problems for various objects"""
+		if (scope == "host") or (scope == "all"):
+			for h in objects.getHostList():
+				if len([f for f in filters if not h.getName() in f[0]]) > 0:
+					continue
+				if (not self.selection is None) and (not h.getName() in self.selection[1]):
+					# The host was saved only for its services.
+					continue
+				if (state is None) or matchState(state, h.getName(), state[1]):
+					result.append((h, None))
 
-	if len(command) > 3:
-		sys.stderr.write("Unrecognized acknowledge problems parameters: %s\n" % (" ".join(command[2:])))
-		sys.exit(1)
+		if (scope == "service") or (scope == "all"):
+			for i in range(0, objects.getCount()):
+				# Get host object.
+				h = objects.getHost(i)
+				# Get service objects.
+				for s in objects.getServiceList(i):
+					if len([f for f in filters if not (h.getName(), s.getName()) in f[1]]) > 0:
+						continue
+					if (state is None) or matchState(state, (h.getName(), s.getName()), state[2]):
+						result.append((h, s))
 
-	if len(command) < 3:
-		sys.stderr.write("Missing required command parameters: comment")
-		sys.exit(1)
+		if self.conf["impact"]:
+			result = self.expandImpact(result, scope)
+
+		if self.conf["save_selection"] != "":
+			self.saveSelection(self.conf["save_selection"], result)
 
-	comment = command[-1]
+		return result
 
-	commands = []
+	def getServicegroupIndex(self):
+		"""Return a dictionary of servicegroup names to lists of
+		(host, service) name pairs of their members"""
 
-	# Resolve host and service assignments and get a filtered list of objects.
-	objects = matchObjects()
+		if not self.servicegroup_index is None:
+			return self.servicegroup_index
 
-	if (scope == "host") or (scope == "all"):
-		for h in objects.getHostList():
-			commands.append("ACKNOWLEDGE_HOST_PROBLEM;%s;1;0;0;nagctl;%s" % (h.getName(), comment))
+		objects = self.matchAll()
 
-	if (scope == "service") or (scope == "all"):
+		direct = collections.OrderedDict()
+		for g in self.servicegroups:
+			direct.setdefault(g.getName(), [])
+		instances = set()
 		for i in range(0, objects.getCount()):
-			# Get host object.
 			h = objects.getHost(i)
-			# Get service objects.
 			for s in objects.getServiceList(i):
-				commands.append("ACKNOWLEDGE_SVC_PROBLEM;%s;%s;1;0;0;nagctl;%s" % (h.getName(), s.getName(), comment))
-
-	return commands
+				instances.add((h.getName(), s.getName()))
+				for g in s.getServicegroups():
+					direct.setdefault(g, []).append((h.getName(), s.getName()))
+		nested = {}
+		for g in self.servicegroups:
+			# Members listed by servicegroups must exist to be selected.
+			direct[g.getName()].extend([m for m in g.getMembers() if m in instances])
+			nested.setdefault(g.getName(), []).extend(g.getGroups())
+
+		index = {}
+		for name in direct.keys():
+			# Collect members of nested servicegroups visiting every
+			# group once even when they nest in a loop.
+			members = []
+			seen = set()
+			visited = set([name])
+			queue = [name]
+			while len(queue) > 0:
+				g = queue.pop(0)
+				for m in direct.get(g, []):
+					if not m in seen:
+						seen.add(m)
+						members.append(m)
+				for n in nested.get(g, []):
+					if not n in visited:
+						visited.add(n)
+						queue.append(n)
+			index[name] = members
+
+		self.servicegroup_index = index
+		return index
+
+	def getContactIndex(self):
+		"""Return a dictionary of contact names to sets of host names
+		and service instances notifying them"""
+
+		if not self.contact_index is None:
+			return self.contact_index
+
+		members = self.getContactgroupMembers()
+
+		def getContacts(o):
+			# Return contacts an object notifies directly and
+			# through contactgroups.
+			result = set(o.getList("contacts"))
+			for g in o.getList("contact_groups"):
+				result.update(members.get(g, []))
+			return result
+
+		objects = self.matchAll()
+
+		index = {}
+		hosts = {}
+		for h in self.hosts:
+			hosts[h.getName()] = getContacts(h)
+			for c in hosts[h.getName()]:
+				index.setdefault(c, (set(), set()))[0].add(h.getName())
+		for i in range(0, objects.getCount()):
+			h = objects.getHost(i)
+			for s in objects.getServiceList(i):
+				contacts = getContacts(s)
+				if (len(s.getList("contacts")) == 0) and (len(s.getList("contact_groups")) == 0):
+					# Services without contacts notify contacts of their host.
+					contacts = hosts.get(h.getName(), set())
+				for c in contacts:
+					index.setdefault(c, (set(), set()))[1].add((h.getName(), s.getName()))
+
+		self.contact_index = index
+		return index
+
+	def getContactgroupMembers(self):
+		"""Return a dictionary of contactgroup names to lists of contact
+		names including members of nested groups"""
+
+		direct = {}
+		nested = {}
+		for g in self.contactgroups:
+			direct.setdefault(g.getName(), []).extend(g.getMembers())
+			nested.setdefault(g.getName(), []).extend(g.getGroups())
+		for c in self.contacts:
+			for g in c.getList("contactgroups"):
+				direct.setdefault(g, []).append(c.getName())
+
+		result = {}
+		for name in direct.keys():
+			members = set()
+			visited = set([name])
+			queue = [name]
+			while len(queue) > 0:
+				g = queue.pop(0)
+				members.update(direct.get(g, []))
+				for n in nested.get(g, []):
+					if not n in visited:
+						visited.add(n)
+						queue.append(n)
+			result[name] = sorted(members)
+		return result
+
+	def getContactFilter(self):
+		"""Return a tuple of sets of host names and service instances
+		notifying selected contact or contactgroup members"""
+
+		index = self.getContactIndex()
+		contacts = []
+		if not self.conf["contact"] is None:
+			contacts.append(self.conf["contact"])
+		if not self.conf["contactgroup"] is None:
+			groups = self.getContactgroupMembers()
+			if not self.conf["contactgroup"] in groups:
+				raise NagctlError("No '%s' contactgroup found" % (self.conf["contactgroup"]))
+			contacts.extend(groups[self.conf["contactgroup"]])
+
+		hosts = set()
+		services = set()
+		for c in contacts:
+			(h, s) = index.get(c, (set(), set()))
+			hosts.update(h)
+			services.update(s)
+		return (hosts, services)
+
+	def getSelectedServicegroups(self):
+		"""Return a list of servicegroup names matching -g pattern"""
 
+		import re
 
-def doCommands(commands):
-	"""Append given commands to Nagios external commands file"""
+		if self.conf["servicegroup"] is None:
+			return []
+		return [g for g in sorted(self.getServicegroupIndex().keys()) if re.search("^" + self.conf["servicegroup"] + "$", g)]
 
-	if len(commands) == 0:
-		# Do not bother when there are no commands to run.
-		return None
+	def compressCommands(self, commands):
+		"""Return a list of commands with commands for every member of
+		a selected servicegroup replaced by one servicegroup command"""
 
-	import time
-	# Get current timestamp.
-	timestamp = int(time.time())
+		groups = self.getSelectedServicegroups()
+		if len(groups) == 0:
+			return commands
 
-	try:
-		# Open Nagios external commands file for appending.
-		extcmd = open(conf["command_file"], "a")
+		# Positions and arguments of commands that have servicegroup
+		# counterparts by command name and object.
+		lines = {}
+		for (i, c) in enumerate(commands):
+			fields = c.split(";")
+			if not fields[0] in servicegroup_commands:
+				continue
+			if "_SVC_" in fields[0]:
+				lines[(fields[0], (fields[1], fields[2]))] = (i, fields[3:])
+			else:
+				lines[(fields[0], fields[1])] = (i, fields[2:])
+
+		index = self.getServicegroupIndex()
+		dropped = set()
+		added = {}
+		for g in groups:
+			members = index[g]
+			if len(members) == 0:
+				continue
+			hosts = []
+			for (h, _) in members:
+				if not h in hosts:
+					hosts.append(h)
+			for (name, (group_name, kind)) in sorted(servicegroup_commands.items()):
+				keys = members if kind == "service" else hosts
+				found = [lines.get((name, k)) for k in keys]
+				if None in found:
+					# The group is not fully selected.
+					continue
+				args = set([tuple(a) for (_, a) in found])
+				if len(args) != 1:
+					continue
+				positions = [i for (i, _) in found]
+				dropped.update(positions)
+				added.setdefault(min(positions), []).append(";".join([group_name, g] + list(args.pop())))
+
+		result = []
+		for (i, c) in enumerate(commands):
+			result.extend(added.get(i, []))
+			if not i in dropped:
+				result.append(c)
+
+		self.printMessage("Replaced %u commands with %u servicegroup commands" % (len(dropped), sum([len(a) for a in added.values()])), 2)
+		self.countObjects("commands compressed", len(dropped))
+
+		return result
+
+	def getDependents(self):
+		"""Return a dictionary of dependency graph edges from master
+		objects to objects that depend on them"""
+
+		if not self.dependents is None:
+			return self.dependents
+
+		# Hostgroup members lists add hosts to hostgroups too.
+		self.expandHostgroups(self.hosts)
+		names = []
+		groups = {}
+		for h in self.hosts:
+			names.append(h.getName())
+			for g in h._hostgroup:
+				groups.setdefault(g, []).append(h.getName())
+
+		def getHosts(d, host_key, group_key):
+			# Return host names a dependency lists directly
+			# and through hostgroups.
+			(include, exclude) = d.getSelector(host_key)
+			(include_group, exclude_group) = d.getSelector(group_key)
+			result = []
+			for n in include:
+				result.extend(names if n == "*" else [n])
+			for g in include_group:
+				result.extend(names if g == "*" else groups.get(g, []))
+			excluded = set(exclude)
+			for g in exclude_group:
+				excluded.update(groups.get(g, []))
+			seen = set()
+			hosts = []
+			for n in result:
+				if (not n in excluded) and (not n in seen):
+					seen.add(n)
+					hosts.append(n)
+			return hosts
+
+		# Graph nodes are host names, (host, service) tuples and
+		# dependency indexes. Every dependency is a node between its
+		# masters and dependents so the graph stays linear in size.
+		graph = {}
+		for (i, d) in enumerate(self.dependencies):
+			masters = getHosts(d, "host_name", "hostgroup_name")
+			dependents = getHosts(d, "dependent_host_name", "dependent_hostgroup_name")
+			if d.getKind() == "hostdependency":
+				for m in masters:
+					graph.setdefault(m, []).append(i)
+				graph[i] = dependents
+				continue
+
+			services = d.getSelector("service_description")[0]
+			dependent_services = d.getSelector("dependent_service_description")[0]
+			if len(dependents) > 0:
+				for m in masters:
+					for s in services:
+						graph.setdefault((m, s), []).append(i)
+				graph[i] = [(h, s) for h in dependents for s in dependent_services]
+			else:
+				# Services depend on services of the same host.
+				for m in masters:
+					same = [(m, s) for s in dependent_services]
+					for s in services:
+						graph.setdefault((m, s), []).extend(same)
+
+		self.dependents = graph
+		return graph
+
+	def expandImpact(self, pairs, scope):
+		"""Return (host, service) pairs of objects that depend on given
+		ones, directly or not, including them"""
+
+		graph = self.getDependents()
+
+		objects = self.matchAll()
+		services = {}
+		for i in range(0, objects.getCount()):
+			h = objects.getHost(i)
+			services.setdefault(h.getName(), []).extend([s.getName() for s in objects.getServiceList(i)])
+
+		seeds = []
+		for (h, s) in pairs:
+			if s is None:
+				seeds.append(h.getName())
+			else:
+				seeds.append((h.getName(), s.getName()))
+
+		# Visit every node once.
+		impacted = set(seeds)
+		queue = collections.deque(seeds)
+		while len(queue) > 0:
+			node = queue.popleft()
+			following = graph.get(node, [])
+			if type(node).__name__ == "str":
+				# Services are affected by their hosts.
+				following = following + [(node, s) for s in services.get(node, [])]
+			for n in following:
+				if not n in impacted:
+					impacted.add(n)
+					queue.append(n)
+
+		self.printMessage("Dependencies expand %u objects to %u" % (len(seeds), len([n for n in impacted if type(n).__name__ != "int"])), 2)
+
+		result = []
+		if (scope == "host") or (scope == "all"):
+			for h in self.hosts:
+				if h.getName() in impacted:
+					result.append((h, None))
+		if (scope == "service") or (scope == "all"):
+			for i in range(0, objects.getCount()):
+				h = objects.getHost(i)
+				for s in objects.getServiceList(i):
+					if (h.getName(), s.getName()) in impacted:
+						result.append((h, s))
+		return result
+
+	@synchronized
+	def select(self, scope = "all", host = None, service = None):
+		"""Return a list of (host, service) pairs with names matching
+		host and service regular expressions"""
+
+		saved = (self.conf["host"], self.conf["service"])
+		(self.conf["host"], self.conf["service"]) = (host, service)
 		try:
-			if (conf["dry-run"]) and (conf["verbose"] > 1):
-				printMessage("Dry-run mode: no commands will be written to Nagios command file\n", 0)
+			return self.selectObjects(self.matchObjects(), scope)
+		finally:
+			(self.conf["host"], self.conf["service"]) = saved
 
-			for c in commands:
-				printMessage("Running command: %s" % (c), 2)
+	def matchAll(self):
+		"""Return a nested list of matches of every host and service
+		whatever the name filters are"""
+
+		saved = (self.conf["host"], self.conf["service"])
+		(self.conf["host"], self.conf["service"]) = (None, None)
+		try:
+			return self.matchObjects()
+		finally:
+			(self.conf["host"], self.conf["service"]) = saved
+
+	def searchObjects(self, command, scope):
+		"""Display a list o matching objects"""
+
+		if len(command) > 1:
+			raise NagctlError("Unrecognized search parameters: %s" %(" ".join(command[1:])))
+
+		# Resolve host and service assignments and get a filtered list of objects.
+		objects = self.selectObjects(self.matchObjects(), scope)
+
+		if scope == "all":
+			# When no scope is defined print hosts with services.
+			hosts = []
+			names = {}
+			for (h, s) in objects:
+				if not h.getName() in names:
+					hosts.append(h.getName())
+					names[h.getName()] = []
+				if not s is None:
+					names[h.getName()].append(s.getName())
+			for h in hosts:
+				print "%s: %s" % (h, ", ".join(names[h]))
+
+		if scope == "host":
+			# When host scope is requested print only hosts.
+			for (h, _) in objects:
+				print h.getName()
+
+		if scope == "service":
+			# When service scope is requested print only uique service names.
+			services = []
+			seen = set()
+			for (_, s) in objects:
+				# Filter out duplicates
+				if not s.getName() in seen:
+					seen.add(s.getName())
+					services.append(s.getName())
+			print "\n".join(services)
+
+		# Return an empty list of commands to run.
+		return []
+
+	def getCheckRate(self, object):
+		"""Return a tuple of active checks per second an object generates
+		normally and when it keeps retrying"""
+
+		object.setupParams()
+		if object.getParam("active_checks_enabled") == "0":
+			return (0.0, 0.0)
+
+		try:
+			length = float(self.conf["interval_length"])
+			# Nagios checks every five and retries every one
+			# interval when intervals are not set.
+			check = float(object.getParam("check_interval") or 5) * length
+			retry = float(object.getParam("retry_interval") or 1) * length
+		except ValueError:
+			return (0.0, 0.0)
+
+		rates = []
+		for interval in (check, retry):
+			if interval > 0:
+				rates.append(1 / interval)
+			else:
+				rates.append(0.0)
+		return tuple(rates)
+
+	def getTemplates(self, object, templates):
+		"""Return names of all templates an object inherits from"""
+
+		result = []
+		queue = list(object.getUses())
+		while len(queue) > 0:
+			name = queue.pop(0)
+			if (name in result) or (not name in templates):
+				continue
+			result.append(name)
+			queue.extend(templates[name].getUses())
+		return result
+
+	def reportStats(self, command, scope):
+		"""Display expected check load of matching objects"""
+
+		if len(command) > 1:
+			raise NagctlError("Unrecognized stats parameters: %s" % (" ".join(command[1:])))
+
+		# Checks per second, retries per second and number of objects
+		# by check command, hostgroup and template.
+		groups = {
+			"check_command" : {},
+			"hostgroup" : {},
+			"template" : {}
+		}
+		total = [0.0, 0.0, 0, 0]
+
+		def add(group, name, rates, instance):
+			entry = groups[group].setdefault(name, [0.0, 0.0, 0, 0])
+			entry[0] += rates[0]
+			entry[1] += rates[1]
+			entry[2] += 1
+			entry[3] += instance
+
+		for (h, s) in self.selectObjects(self.matchObjects(), scope):
+			if s is None:
+				(o, templates) = (h, self.host_tmpl)
+			else:
+				(o, templates) = (s, self.service_tmpl)
+			rates = self.getCheckRate(o)
+			# Only service instances are counted separately.
+			instance = int(not s is None)
+			total[0] += rates[0]
+			total[1] += rates[1]
+			total[2] += 1
+			total[3] += instance
+			add("check_command", (o.getParam("check_command") or "(none)").split("!")[0], rates, instance)
+			for g in set(h._hostgroup or []):
+				add("hostgroup", g, rates, instance)
+			for t in self.getTemplates(o, templates):
+				add("template", t, rates, instance)
+
+		print "Objects: %u (%u service instances)" % (total[2], total[3])
+		print "Checks per second: %.3f (%.3f when all are retrying)" % (total[0], total[1])
+
+		# Show only the heaviest entries unless asked to be verbose.
+		limit = None
+		if self.conf["verbose"] < 2:
+			limit = 10
+
+		for (group, key, title) in (
+			("check_command", 0, "Checks per second by check_command"),
+			("hostgroup", 0, "Checks per second by hostgroup"),
+			("template", 0, "Checks per second by template"),
+			("template", 3, "Service instances by template"),
+			("hostgroup", 3, "Service instances by hostgroup")):
+			print "\n%s:" % (title)
+			print "%10s %10s %10s %10s  %s" % ("checks/s", "retries/s", "objects", "services", "name")
+			entries = sorted(groups[group].items(), key = lambda e: (-e[1][key], e[0]))
+			for (name, (rate, retry, objects, instances)) in entries[:limit]:
+				print "%10.3f %10.3f %10u %10u  %s" % (rate, retry, objects, instances, name)
+
+		# Return an empty list of commands to run.
+		return []
+
+	def toggleNotifications(self, command, scope):
+		"""Enable or disable notifications for various objects"""
+
+		action = command[0]
+
+		if len(command) > 2:
+			raise NagctlError("Unrecognized %s notifications parameters: %s" % (action, " ".join(command[2:])))
+
+		if action in ["enable", "disable"]:
+			# Nagios likes its commands in uppercase.
+			action = action.upper()
+		else:
+			raise NagctlError("Unrecognized command: %s" % (action))
+
+		commands = []
+
+		# Resolve host and service assignments and get a filtered list of objects.
+		for (h, s) in self.selectObjects(self.matchObjects(), scope):
+			if s is None:
+				commands.append("%s_HOST_NOTIFICATIONS;%s" % (action, h.getName()))
+			else:
+				commands.append("%s_SVC_NOTIFICATIONS;%s;%s" % (action, h.getName(), s.getName()))
+
+		return commands
+
+	def toggleChecks(self, command, scope):
+		"""Enable or disable active checks for various objects"""
+
+		action = command[0]
+
+		if len(command) > 2:
+			raise NagctlError("Unrecognized %s checks parameters: %s" % (action, " ".join(command[2:])))
+
+		if action in ["enable", "disable"]:
+			# Nagios likes its commands in uppercase.
+			action = action.upper()
+		else:
+			raise NagctlError("Unrecognized command: %s" % (action))
+
+		commands = []
+
+		# Resolve host and service assignments and get a filtered list of objects.
+		for (h, s) in self.selectObjects(self.matchObjects(), scope):
+			if s is None:
+				commands.append("%s_HOST_CHECK;%s" % (action, h.getName()))
+			else:
+				commands.append("%s_SVC_CHECK;%s;%s" % (action, h.getName(), s.getName()))
+
+		return commands
+
+	def scheduleDowntime(self, command, scope):
+		"""Schedule downtime for various objects"""
+
+		if len(command) > 4:
+			raise NagctlError("Unrecognized schedule downtime parameters: %s" % (" ".join(command[2:])))
+
+		if len(command) < 4:
+			raise NagctlError("Missing required command parameters: comment or duration")
+
+		# Get duration and comment from passed parameters.
+		(duration, comment) = command[-2:]
+		try:
+			duration = int(duration)
+		except ValueError:
+			# Seems that duration is not an integer.
+			raise NagctlError("Invalid parameter: %s" % (duration))
+
+		import time
+
+		commands = []
+		timestamp = int(time.time())
+
+		if self.conf["propagate"]:
+			return self.propagateDowntime(scope, timestamp, duration, comment)
+
+		# Resolve host and service assignments and get a filtered list of objects.
+		for (h, s) in self.selectObjects(self.matchObjects(), scope):
+			if s is None:
+				commands.append("SCHEDULE_HOST_DOWNTIME;%s;%u;%u;1;0;%u;nagctl;%s" % (h.getName(), timestamp, timestamp + duration, duration, comment))
+			else:
+				commands.append("SCHEDULE_SVC_DOWNTIME;%s;%s;%u;%u;1;0;%u;nagctl;%s" % (h.getName(), s.getName(), timestamp, timestamp + duration, duration, comment))
+
+		return commands
+
+	def getDowntimeIndex(self):
+		"""Return a dictionary of host names to lists of (service name,
+		downtime) tuples of every downtime in status file, with None
+		service names for host downtimes"""
+
+		status = self.getStatus()
+		if status is None:
+			raise NagctlError("Cannot delete downtimes: status_file is not set")
+
+		if (self.downtime_index is None) or (not self.downtime_index[0] is status):
+			index = {}
+			for (key, entry) in status.items():
+				for d in entry.get("downtime", []):
+					if type(key).__name__ == "tuple":
+						index.setdefault(key[0], []).append((key[1], d))
+					else:
+						index.setdefault(key, []).append((None, d))
+			# The index is built again when status file is read again.
+			self.downtime_index = (status, index)
+		return self.downtime_index[1]
+
+	def getHostgroupMembers(self):
+		"""Return a dictionary of hostgroup names to sets of names
+		of their member hosts including members of nested groups"""
+
+		names = set([h.getName() for h in self.hosts])
+		direct = {}
+		nested = {}
+		for h in self.hosts:
+			h.setupParams()
+			for g in h._hostgroup:
+				direct.setdefault(g, set()).add(h.getName())
+		for g in self.hostgroups:
+			direct.setdefault(g.getName(), set())
+			for m in g.getMembers():
+				if m == "*":
+					direct[g.getName()].update(names)
+				else:
+					# Hosts that were not loaded are kept too as
+					# nothing is known about their downtimes.
+					direct[g.getName()].add(m)
+			value = g.getParam("hostgroup_members")
+			if not value is None:
+				nested.setdefault(g.getName(), []).extend(g.splitSelector(value)[0])
+
+		members = {}
+		for name in direct.keys():
+			result = set()
+			visited = set([name])
+			queue = [name]
+			while len(queue) > 0:
+				g = queue.pop(0)
+				result.update(direct.get(g, []))
+				for n in nested.get(g, []):
+					if not n in visited:
+						visited.add(n)
+						queue.append(n)
+			members[name] = result
+		return members
+
+	def deleteDowntime(self, command, scope):
+		"""Delete downtimes of matching objects"""
+
+		if len(command) > 3:
+			raise NagctlError("Unrecognized delete downtime parameters: %s" % (" ".join(command[3:])))
+
+		comment = None
+		if len(command) == 3:
+			comment = command[2]
+		author = self.conf["author"]
+		index = self.getDowntimeIndex()
+
+		# Downtime ids to delete by host name with their service names.
+		deleted = collections.OrderedDict()
+		for (h, s) in self.selectObjects(self.matchObjects(), scope):
+			service = None
+			if not s is None:
+				service = s.getName()
+			for (name, d) in index.get(h.getName(), []):
+				if (name != service) or (not "downtime_id" in d):
+					continue
+				if (author != "") and (d.get("author") != author):
+					continue
+				if (not comment is None) and (d.get("comment") != comment):
+					continue
+				deleted.setdefault(h.getName(), {})[d["downtime_id"]] = name
+
+		# By-name commands delete every downtime of a host and its
+		# services so they are used only when nothing else would go.
+		covered = set()
+		for (host, ids) in deleted.items():
+			if len(ids) == len([d for (_, d) in index[host] if "downtime_id" in d]):
+				covered.add(host)
+
+		commands = []
+		if (len(covered) > 1) and (self.selection is None) and (not self.partial):
+			# Hostgroups can't be checked when only selected hosts are known.
+			members = self.getHostgroupMembers()
+			# Only hostgroups made of covered hosts alone can be
+			# cleared as a whole.
+			candidates = [g for (g, hosts) in members.items() if (len(hosts) > 0) and (hosts <= covered)]
+			# Prefer hostgroups that clear the most hosts.
+			candidates.sort(key = lambda g: (-len(members[g] & covered), g))
+			done = set()
+			for g in candidates:
+				left = (members[g] & covered) - done
+				if len(left) > 1:
+					commands.append("DEL_DOWNTIME_BY_HOSTGROUP_NAME;%s" % (g))
+					done.update(left)
+			covered -= done
+			for host in done:
+				del deleted[host]
+
+		for (host, ids) in deleted.items():
+			if host in covered:
+				commands.append("DEL_DOWNTIME_BY_HOST_NAME;%s" % (host))
+				continue
+			for id in sorted(ids.keys()):
+				if ids[id] is None:
+					commands.append("DEL_HOST_DOWNTIME;%u" % (id))
+				else:
+					commands.append("DEL_SVC_DOWNTIME;%u" % (id))
+
+		return commands
+
+	def getChildren(self):
+		"""Return a dictionary of parent host names to lists of their
+		child hosts"""
+
+		if self.children is None:
+			children = {}
+			for h in self.hosts:
+				for p in h.getParents():
+					children.setdefault(p, []).append(h)
+			self.children = children
+		return self.children
+
+	def getSubtree(self, roots):
+		"""Return a tuple of a list of hosts behind given ones in parent
+		topology, including them, and a list of those given hosts that
+		are not behind any other"""
+
+		children = self.getChildren()
+		result = []
+		seen = set()
+		# Hosts that have a parent in the subtree.
+		behind = set()
+		queue = collections.deque(roots)
+		for h in roots:
+			seen.add(id(h))
+		while len(queue) > 0:
+			h = queue.popleft()
+			result.append(h)
+			for c in children.get(h.getName(), []):
+				behind.add(id(c))
+				if not id(c) in seen:
+					seen.add(id(c))
+					queue.append(c)
+
+		tops = [h for h in roots if not id(h) in behind]
+		if (len(tops) == 0) and (len(roots) > 0):
+			# Hosts in a parent loop are all behind each other.
+			tops = [roots[0]]
+		return (result, tops)
+
+	def propagateDowntime(self, scope, timestamp, duration, comment):
+		"""Return commands scheduling downtime for matching hosts and
+		everything behind them in parent topology"""
+
+		if not self.selection is None:
+			# Hosts behind saved ones are not known.
+			raise NagctlError("Downtime can't be propagated to objects of a saved selection")
+
+		# Roots are the hosts selected without propagation.
+		objects = ObjectLink()
+		for h in self.hosts:
+			if h.matchName(self.conf["host"]):
+				objects.addHost(h)
+		roots = [h for (h, _) in self.selectObjects(objects, "host")]
+		(subtree, tops) = self.getSubtree(roots)
+		self.printMessage("Propagating downtime from %u to %u hosts" % (len(tops), len(subtree)), 2)
+
+		commands = []
+		if (scope == "host") or (scope == "all"):
+			# Nagios schedules downtime for child hosts itself.
+			for h in tops:
+				commands.append("SCHEDULE_AND_PROPAGATE_HOST_DOWNTIME;%s;%u;%u;1;0;%u;nagctl;%s" % (h.getName(), timestamp, timestamp + duration, duration, comment))
+
+		if (scope == "service") or (scope == "all"):
+			# Services of every host in the subtree need their own
+			# downtime. Host name and state filters picked the roots
+			# so only the other selectors apply to services.
+			hosts = set([id(h) for h in subtree])
+			saved = dict([(k, self.conf[k]) for k in ("host", "state", "unacked", "save_selection")])
+			self.conf.update(host = None, state = None, unacked = False, save_selection = "")
+			try:
+				pairs = self.selectObjects(self.matchObjects(), "service")
+			finally:
+				self.conf.update(saved)
+			for (h, s) in pairs:
+				if id(h) in hosts:
+					commands.append("SCHEDULE_SVC_DOWNTIME;%s;%s;%u;%u;1;0;%u;nagctl;%s" % (h.getName(), s.getName(), timestamp, timestamp + duration, duration, comment))
+
+		return commands
+
+	def scheduleCheck(self, command, scope):
+		"""Schedule next active check for various objects"""
+
+		if len(command) > 3:
+			raise NagctlError("Unrecognized schedule check parameters: %s" % (" ".join(command[2:])))
+
+		if len(command) < 3:
+			raise NagctlError("Missing required command parameters: time")
+
+		# Get duration and comment from passed parameters.
+		timestamp = command[-1]
+		try:
+			timestamp = int(timestamp)
+		except ValueError:
+			# Seems that time is not an integer.
+			raise NagctlError("Invalid parameter: %s" % (timestamp))
 
-				if not conf["dry-run"]:
-					# Write each command to file.
-					extcmd.write("[%lu] %s\n" % (timestamp, c))
+		import time
+		timestamp = int(time.time() + timestamp)
+
+		commands = []
+
+		# Resolve host and service assignments and get a filtered list of objects.
+		objects = self.selectObjects(self.matchObjects(), scope)
+		for ((h, s), t) in zip(objects, self.spreadChecks(objects, timestamp)):
+			if s is None:
+				commands.append("SCHEDULE_HOST_CHECK;%s;%u" % (h.getName(), t))
+			else:
+				commands.append("SCHEDULE_SVC_CHECK;%s;%s;%u" % (h.getName(), s.getName(), t))
+
+		return commands
+
+	def spreadChecks(self, objects, timestamp):
+		"""Return a list of check times for (host, service) pairs
+		spread according to options so that checks don't all start
+		at the same time"""
+
+		import hashlib
+
+		# Get the length of time window of every check.
+		windows = [0] * len(objects)
+		if self.conf["spread_interval"]:
+			try:
+				length = int(self.conf["interval_length"])
+			except ValueError:
+				raise NagctlError("Invalid interval_length: %s" % (self.conf["interval_length"]))
+			for (i, (h, s)) in enumerate(objects):
+				o = h if s is None else s
+				o.setupParams()
+				try:
+					windows[i] = int(float(o.getParam("check_interval") or 0) * length)
+				except ValueError:
+					# Checks with invalid intervals are not spread.
+					pass
+		elif not self.conf["spread"] is None:
+			try:
+				windows = [int(self.conf["spread"])] * len(objects)
+			except ValueError:
+				raise NagctlError("Invalid spread time: %s" % (self.conf["spread"]))
+
+		times = []
+		for (i, (h, s)) in enumerate(objects):
+			if windows[i] <= 0:
+				times.append(timestamp)
+			elif self.conf["spread_hash"]:
+				# The same object always gets the same offset.
+				name = h.getName() if s is None else "%s;%s" % (h.getName(), s.getName())
+				times.append(timestamp + int(hashlib.md5(name).hexdigest()[:8], 16) % windows[i])
+			else:
+				# Distribute checks evenly in their windows.
+				times.append(timestamp + i * windows[i] / len(objects))
+
+		if not self.conf["rate"] is None:
+			try:
+				rate = int(self.conf["rate"])
+			except ValueError:
+				raise NagctlError("Invalid rate: %s" % (self.conf["rate"]))
+			if rate < 1:
+				raise NagctlError("Invalid rate: %s" % (self.conf["rate"]))
+			# Move checks to later seconds when too many are
+			# scheduled in one, keeping their order in time.
+			second = None
+			count = 0
+			for i in sorted(range(0, len(times)), key = lambda i: times[i]):
+				if (second is None) or (times[i] > second):
+					(second, count) = (times[i], 0)
+				if count >= rate:
+					(second, count) = (second + 1, 0)
+				times[i] = second
+				count += 1
+
+		return times
+
+	def acknowledgeProblem(self, command, scope):
+		"""Acknowledge problems for various objects"""
+
+		if len(command) > 3:
+			raise NagctlError("Unrecognized acknowledge problems parameters: %s" % (" ".join(command[2:])))
+
+		if len(command) < 3:
+			raise NagctlError("Missing required command parameters: comment")
+
+		comment = command[-1]
+
+		commands = []
+
+		# Only objects with unacknowledged problems are targeted since
+		# Nagios rejects acknowledgements of anything else.
+		# Resolve host and service assignments and get a filtered list of objects.
+		for (h, s) in self.selectObjects(self.matchObjects(), scope, problem = True):
+			if s is None:
+				commands.append("ACKNOWLEDGE_HOST_PROBLEM;%s;1;0;0;nagctl;%s" % (h.getName(), comment))
+			else:
+				commands.append("ACKNOWLEDGE_SVC_PROBLEM;%s;%s;1;0;0;nagctl;%s" % (h.getName(), s.getName(), comment))
+
+		return commands
+
+	@synchronized
+	@profiled("doCommands")
+	def doCommands(self, commands):
+		"""Append given commands to Nagios external commands file"""
+
+		if len(commands) == 0:
+			# Do not bother when there are no commands to run.
+			return None
+
+		import time
+		# Get current timestamp.
+		timestamp = int(time.time())
+
+		try:
+			# Open Nagios external commands file for appending.
+			extcmd = open(self.conf["command_file"], "a")
+			try:
+				if (self.conf["dry-run"]) and (self.conf["verbose"] > 1):
+					self.printMessage("Dry-run mode: no commands will be written to Nagios command file\n", 0)
+
+				for c in commands:
+					self.printMessage("Running command: %s" % (c), 2)
+
+					if not self.conf["dry-run"]:
+						# Write each command to file.
+						extcmd.write("[%lu] %s\n" % (timestamp, c))
+						self.countObjects("commands written")
+						self.countCommands("written", [c])
+
+			except IOError, msg:
+				sys.stderr.write("Cannot write to external commands file: %s\n" % (msg))
+				self.countObjects("failures")
+			finally:
+				# Always try to close the file no matter what.
+				extcmd.close()
+				if self.conf["dry-run"]:
+					self.printMessage("\nDry-run mode: no commands will be written to Nagios command file", 0)
+				self.printMessage("Written %u commands to Nagios command file" % (len(commands)), 1)
 
 		except IOError, msg:
 			sys.stderr.write("Cannot write to external commands file: %s\n" % (msg))
+			self.countObjects("failures")
+
+	def resolveCommand(self, arg):
+		"""Guess the command and selector from arguments and return
+		a tuple of function to run, full command and scope"""
+
+		# Prepare command strings.
+		if len(arg) > 1:
+			selector = arg[1]
+			# Remove the second list member.
+			arg = [arg[0]] + arg[2:]
+		else:
+			selector = ""
+
+		# A mapping of available commands to functions.
+		commands = {
+			"search" : self.searchObjects,
+			"stats" : self.reportStats,
+			"enable notifications" : self.toggleNotifications,
+			"disable notifications" : self.toggleNotifications,
+			"schedule downtime" : self.scheduleDowntime,
+			"delete downtime" : self.deleteDowntime,
+			"schedule checks" : self.scheduleCheck,
+			"reschedule checks" : self.scheduleCheck,
+			"enable checks" : self.toggleChecks,
+			"disable checks" : self.toggleChecks,
+			"acknowledge problems" : self.acknowledgeProblem
+		}
+
+		# A list of available selectors.
+		selectors = [
+			"host",
+			"service",
+			"all"
+		]
+
+		# Try to guess the correct selector.
+		scope = getSimilar([selector], selectors)
+		if len(scope) == 1:
+			# Set scope name.
+			scope = scope[0]
+		elif len(scope) > 1:
+			raise NagctlError("Not sure which selector you mean:\n%s" % ("\n".join(scope)))
+		elif len(scope) == 0:
+			raise NagctlError("No '%s' selector found\nValid selectors are:\n  %s" % (selector, "\n  ".join(selectors)))
+
+		# Try to guess the correct command name.
+		function = getSimilar(arg, commands)
+		if len(function) == 1:
+			# Set the full command name and function to run later.
+			(names, function) = function.items()[0]
+			names = names.split()
+			# Replace command name with the full one.
+			arg[0:len(names)] = names
+		elif len(function) > 1:
+			message = ["Not sure which command you mean:"]
+			for f in function.keys():
+				f = f.split()
+				message.append("  %s %s %s" % (f[0], scope, " ".join(f[1:])))
+			raise NagctlError("\n".join(message))
+		elif len(function) == 0:
+			raise NagctlError("No '%s' command found\nValid commands are:\n  %s" % (" ".join(arg), "\n  ".join(commands.keys())))
+
+		return (function, arg, scope)
+
+	@synchronized
+	@profiled("commands")
+	def runCommand(self, function, arg, scope):
+		"""Run the function that will handle the command and return
+		a list of commands to write"""
+
+		commands = function(arg, scope)
+		self.countCommands("generated", commands)
+
+		if self.conf["prune"]:
+			# Drop commands for objects already in the desired state.
+			count = len(commands)
+			commands = self.pruneCommands(commands)
+			self.countObjects("commands pruned", count - len(commands))
+
+		if not self.conf["servicegroup"] is None:
+			# Whole servicegroups can be handled with one command.
+			commands = self.compressCommands(commands)
+
+		return commands
+
+	@profiled("submit")
+	def submitResults(self, file):
+		"""Submit passive check results read from a file as
+		host;service;code;output records and return the number
+		of rejected records"""
+
+		# Hash lookups of every host and service instance results
+		# may be submitted for.
+		hosts = set([h.getName() for h in self.hosts if h.matchName(self.conf["host"])])
+		services = set()
+		objects = self.matchObjects()
+		for i in range(0, objects.getCount()):
+			for s in objects.getServiceList(i):
+				services.add((objects.getHost(i).getName(), s.getName()))
+
+		try:
+			if file == "-":
+				fh = sys.stdin
+			else:
+				fh = open(file, "r")
+		except IOError, error:
+			raise NagctlError("Cannot read results: %s" % (error))
+
+		# Commands not written yet and ones collected for a file
+		# processed with PROCESS_FILE when the batch is large.
+		pending = []
+		spool = None
+		submitted = 0
+		rejected = 0
+		try:
+			try:
+				# Records are read one at a time so that memory use
+				# doesn't depend on the number of results.
+				for (number, line) in enumerate(fh, 1):
+					record = line.rstrip("\r\n").split(";", 3)
+					if (len(record) == 1) and (record[0].strip() == ""):
+						continue
+					error = None
+					if len(record) != 4:
+						error = "Malformed record"
+					elif record[1] == "":
+						if not record[0] in hosts:
+							error = "Unknown host: %s" % (record[0])
+						elif not record[2] in ("0", "1", "2"):
+							error = "Invalid host return code: %s" % (record[2])
+						else:
+							pending.append("PROCESS_HOST_CHECK_RESULT;%s;%s;%s" % (record[0], record[2], record[3]))
+					else:
+						if not (record[0], record[1]) in services:
+							error = "Unknown service: %s;%s" % (record[0], record[1])
+						elif not record[2] in ("0", "1", "2", "3"):
+							error = "Invalid service return code: %s" % (record[2])
+						else:
+							pending.append("PROCESS_SERVICE_CHECK_RESULT;%s" % (";".join(record)))
+					if not error is None:
+						sys.stderr.write("Line %u: %s\n" % (number, error))
+						rejected += 1
+						continue
+
+					submitted += 1
+					if len(pending) < submit_threshold:
+						continue
+					if self.conf["dry-run"]:
+						self.doCommands(pending)
+					else:
+						spool = self.spoolCommands(spool, pending)
+					pending = []
+
+				if spool is None:
+					self.doCommands(pending)
+				else:
+					spool = self.spoolCommands(spool, pending, True)
+			except IOError, error:
+				raise NagctlError("Cannot read results: %s" % (error))
+		finally:
+			if not fh is sys.stdin:
+				fh.close()
+
+		self.printMessage("Submitted %u results, %u rejected" % (submitted, rejected), 1)
+		self.countObjects("failures", rejected)
+
+		return rejected
+
+	def spoolCommands(self, spool, commands, last = False):
+		"""Collect commands for a file processed with PROCESS_FILE and
+		return a list of collected commands or None after the file
+		was passed to Nagios"""
+
+		import tempfile
+		import time
+
+		spool = (spool or []) + commands
+		if (len(spool) < submit_file_size) and (not last):
+			return spool
+
+		timestamp = int(time.time())
+		path = None
+		try:
+			# Nagios has to be able to read and remove the file so
+			# it's kept next to the command file. Its name is taken
+			# first and the file is replaced once fully written.
+			(fd, path) = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(self.conf["command_file"])), prefix = "nagctl", suffix = ".cmd")
+			os.close(fd)
+			replaceFile(path, lambda fh, temp: fh.writelines(["[%lu] %s\n" % (timestamp, c) for c in spool]))
+		except (IOError, OSError), error:
+			if (not path is None) and os.path.exists(path):
+				os.unlink(path)
+			raise NagctlError("Cannot write results file: %s" % (error))
+
+		self.countObjects("commands written", len(spool))
+		self.countCommands("written", spool)
+		self.printMessage("Written %u commands to %s" % (len(spool), path), 1)
+		# Nagios deletes the file when it's done with it.
+		self.doCommands(["PROCESS_FILE;%s;1" % (path)])
+		return None
+
+	def runBatch(self, file):
+		"""Run every operation listed in a file against objects loaded
+		once and return a list of commands to write"""
+
+		import re
+		import shlex
+
+		try:
+			if file == "-":
+				fh = sys.stdin
+			else:
+				fh = open(file, "r")
+			try:
+				lines = fh.readlines()
+			finally:
+				if not fh is sys.stdin:
+					fh.close()
+
+		except IOError, error:
+			raise NagctlError("Cannot read batch file: %s" % (error))
+
+		commands = []
+		failed = 0
+		# Number of commands whose effects the state index shows.
+		applied = 0
+		# Options set on a line only apply to that line so keep
+		# a copy of the ones set on command line.
+		saved = dict(self.conf)
+
+		for (number, line) in enumerate(lines, 1):
+			line = line.strip()
+			if (line == "") or (line[0] == "#"):
+				continue
+			try:
+				try:
+					(_, arg) = self.parseArguments(shlex.split(line))
+					refused = [k for k in batch_refused_options if self.conf[k] != saved[k]]
+					if len(refused) > 0:
+						raise NagctlError("Option not allowed in batch file: %s" % (", ".join([k.replace("_", "-") for k in refused])))
+					if len(arg) < 1:
+						raise NagctlError("Command not specified")
+					if self.conf["prune"] and (len(commands) > applied) and (not self.getStatus() is None):
+						# Objects are pruned as if earlier lines were run.
+						for c in commands[applied:]:
+							applyCommand(c, self.status)
+						applied = len(commands)
+					result = self.runCommand(*self.resolveCommand(arg))
+					if self.conf["dry-run"]:
+						# Commands of a dry-run line are only printed.
+						self.doCommands(result)
+						self.printMessage("Line %u: %u commands not written" % (number, len(result)), 1)
+						continue
+					if self.conf["verbose"] > saved["verbose"]:
+						# Commands are written once the batch ends so show
+						# them now when the line asks for more output.
+						for c in result:
+							self.printMessage("Queued command: %s" % (c), 2)
+					commands.extend(result)
+					self.printMessage("Line %u: %u commands" % (number, len(result)), 1)
+				except (NagctlError, ValueError, re.error), error:
+					# A failed operation must not stop the rest of the batch.
+					sys.stderr.write("%s\n" % (error))
+					sys.stderr.write("Line %u: failed: %s\n" % (number, line))
+					failed += 1
+			finally:
+				self.conf.clear()
+				self.conf.update(saved)
+
+		self.printMessage("Batch finished: %u lines failed" % (failed), 1)
+		self.countObjects("failures", failed)
+
+		return (commands, failed)
+
+	def getMtimes(self):
+		"""Return a dictionary of modification times and sizes of main
+		configuration and every object file it mentions"""
+
+		paths = [self.conf["config"]] + self.conf["cfg_file"]
+		for dir in self.conf["cfg_dir"]:
+			# Only directories whose times changed are listed again
+			# so files added or removed show up without a full walk.
+			paths.extend([path for (path, _) in self.walkDir(dir)])
+
+		mtimes = {}
+		for path in paths:
+			mtimes[path] = getStat(path)
+		return mtimes
+
+	@synchronized
+	def runCaptured(self, argv, load = False, remote = False):
+		"""Run a command line capturing its output and return
+		a response dictionary, refusing options naming files when
+		command comes from a daemon client"""
+
+		import StringIO
+
+		response = {"refused" : False, "status" : 0, "commands" : 0}
+		saved = dict(self.conf)
+		(stdout, stderr) = (sys.stdout, sys.stderr)
+		sys.stdout = StringIO.StringIO()
+		sys.stderr = StringIO.StringIO()
+
+		try:
+			try:
+				(_, arg) = self.parseArguments(argv)
+				if (len(arg) < 1) or (arg[0] in ("batch", "serve")):
+					# Let the caller handle anything but ordinary commands.
+					response["refused"] = True
+				elif remote and (len([k for k in daemon_refused_options if self.conf[k] != saved[k]]) > 0):
+					# Paths are relative to the client and must not be
+					# opened with privileges of the daemon.
+					response["refused"] = True
+				else:
+					(function, arg, scope) = self.resolveCommand(arg)
+					if load:
+						self.loadConfig()
+					commands = self.runCommand(function, arg, scope)
+					response["commands"] = len(commands)
+					self.doCommands(commands)
+			except NagctlError, error:
+				sys.stderr.write("%s\n" % (error))
+				response["status"] = 1
+			except Exception, error:
+				sys.stderr.write("Unexpected error: %s\n" % (error))
+				response["status"] = 1
+		finally:
+			response["stdout"] = sys.stdout.getvalue()
+			response["stderr"] = sys.stderr.getvalue()
+			(sys.stdout, sys.stderr) = (stdout, stderr)
+			self.conf.clear()
+			self.conf.update(saved)
+
+		return response
+
+	def handleRequest(self, request):
+		"""Run a command sent to daemon and return a response dictionary"""
+
+		if os.path.realpath(request.get("config", "")) != os.path.realpath(self.conf["config"]):
+			# Client uses different configuration than the one loaded.
+			return {"refused" : True}
+
+		# Runtime state changes all the time so read it again when needed.
+		self.status = None
+
+		# JSON strings are unicode while the rest of nagctl uses str.
+		return self.runCaptured([a.encode("utf-8") for a in request["argv"]], remote = True)
+
+	def runInstances(self, arg):
+		"""Run a command against every Nagios instance in parallel and
+		return the number of instances that failed"""
+
+		import multiprocessing
+
+		# Every instance is loaded in a process of its own since
+		# parsing is bound by CPU rather than I/O.
+		options = dict(self.conf, instances = [])
+		jobs = [(config, options, arg) for config in self.conf["instances"]]
+		pool = multiprocessing.Pool(min(len(jobs), multiprocessing.cpu_count()))
+		try:
+			results = pool.map(runInstance, jobs)
+		finally:
+			pool.close()
+			pool.join()
+
+		failed = 0
+		for (config, response) in zip(self.conf["instances"], results):
+			self.printMessage("==> %s <==" % (config), 1)
+			sys.stdout.write(response["stdout"])
+			sys.stderr.write(response["stderr"])
+			if response["refused"]:
+				sys.stderr.write("Command can't be run against many instances\n")
+				response["status"] = 1
+			if response["status"]:
+				failed += 1
+
+		self.printMessage("Instances: %u, failed: %u, commands: %u" % (len(results), failed, sum([r["commands"] for r in results])), 1)
+
+		return failed
+
+	def serve(self):
+		"""Handle commands sent to UNIX socket with configuration kept in memory"""
+
+		import SocketServer
+		import json
+		import signal
+		import time
+
+		session = self
+
+		class Handler(SocketServer.StreamRequestHandler):
+			"""Read one request per connection and write back the response"""
+
+			def handle(self):
+				try:
+					request = json.loads(self.rfile.readline())
+				except ValueError:
+					return None
+				self.wfile.write(json.dumps(session.handleRequest(request)) + "\n")
+
+		if os.path.exists(self.conf["socket"]):
+			# Remove socket left behind by a previous daemon.
+			os.unlink(self.conf["socket"])
+
+		server = SocketServer.UnixStreamServer(self.conf["socket"], Handler)
+		os.chmod(self.conf["socket"], 0660)
+		# Wake up regularly to look for configuration changes.
+		server.timeout = reload_interval
+
+		# Make sure the socket gets removed when daemon is terminated.
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+		mtimes = self.getMtimes()
+		checked = time.time()
+		self.printMessage("Listening on %s" % (self.conf["socket"]), 1)
+
+		try:
+			while True:
+				server.handle_request()
+				if time.time() - checked < reload_interval:
+					continue
+				checked = time.time()
+				current = self.getMtimes()
+				if current != mtimes:
+					self.printMessage("Configuration changed, reloading", 1)
+					self.updateConfig()
+					mtimes = current
 		finally:
-			# Always try to close the file no matter what.
-			extcmd.close()
-			if conf["dry-run"]:
-				printMessage("\nDry-run mode: no commands will be written to Nagios command file", 0)
-			printMessage("Written %u commands to Nagios command file" % (len(commands)), 1)
+			server.server_close()
+			os.unlink(self.conf["socket"])
 
-	except IOError, msg:
-		sys.stderr.write("Cannot write to external commands file: %s\n" % (msg))
+	def forwardCommand(self, argv):
+		"""Send command line to a running daemon and return its exit
+		status or None when there's no daemon to handle it"""
+
+		import json
+		import socket
+
+		if (self.conf["socket"] == "") or (not os.path.exists(self.conf["socket"])):
+			return None
+		if len([k for k in ("archive", "db", "selection", "save_selection") if self.conf[k] != ""]) > 0:
+			# The daemon serves configuration files, not archives,
+			# databases and selections of this user.
+			return None
+
+		# Configuration is identified by its real path since the daemon
+		# may run in another directory. Options naming it are dropped
+		# as the daemon refuses any paths given on command line.
+		(opt, arg) = getopt.getopt(argv, short_options, long_options)
+		forwarded = []
+		for (k, v) in opt:
+			if k in ("-c", "--instances"):
+				continue
+			forwarded.append(k)
+			if (k[1:] + ":" in short_options) or (k[2:] + "=" in long_options):
+				forwarded.append(v)
+		request = {"argv" : forwarded + arg, "config" : os.path.realpath(self.conf["config"])}
+		try:
+			client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				client.connect(self.conf["socket"])
+				client.sendall(json.dumps(request) + "\n")
+				client.shutdown(socket.SHUT_WR)
+				data = []
+				while True:
+					chunk = client.recv(65536)
+					if not chunk:
+						break
+					data.append(chunk)
+			finally:
+				client.close()
+			response = json.loads("".join(data))
+		except (socket.error, ValueError), error:
+			# Daemon isn't really there so run the command locally.
+			self.printMessage("Cannot use daemon: %s" % (error), 3)
+			return None
+
+		if response.get("refused"):
+			return None
+
+		sys.stdout.write(response["stdout"].encode("utf-8"))
+		sys.stderr.write(response["stderr"].encode("utf-8"))
+
+		return response["status"]
 
 
 #########################################################################
-# Main									#
+# Functions								#
 #########################################################################
 
-def main():
-	# Parse command line arguments.
-	(conf, arg) = parseArguments()
-
-	if conf["help"]:
-		# Display help and exit.
-		print __doc__
-		sys.exit(0)
-
-	# Check if there's at least one command was passed.
-	if len(arg) < 1:
-		sys.stderr.write("Command not specified, terminating\n")
-		print __doc__
-		sys.exit(1)
+def matchState(state, key, codes):
+	"""Check if object's runtime state matches given state filter"""
+
+	(index, _, _, unacked, problem) = state
+
+	try:
+		entry = index[key]
+	except KeyError:
+		# An object unknown to running Nagios has no state to match.
+		return False
 
-	# Prepare command strings.
-	if len(arg) > 1:
-		selector = arg[1]
-		# Remove the second list member.
-		arg = [arg[0]] + arg[2:]
+	current = entry.get("current_state", 0)
+	if (not codes is None) and (not current in codes):
+		return False
+	if problem and (current == 0):
+		return False
+	if unacked and ((current == 0) or entry.get("problem_has_been_acknowledged", 0)):
+		return False
+	return True
+
+
+def isNoop(command, index):
+	"""Check if a command would not change current object state"""
+
+	fields = command.split(";")
+	name = fields[0]
+
+	if (not name in prune_rules) and (not name in ("SCHEDULE_HOST_DOWNTIME", "SCHEDULE_SVC_DOWNTIME")):
+		# Other commands (like ones taking downtime ids) always run.
+		return False
+
+	if "_SVC_" in name:
+		key = (fields[1], fields[2])
+		args = fields[3:]
 	else:
-		selector = ""
-
-	# A mapping of available commands to functions.
-	commands = {
-		"search" : searchObjects,
-		"enable notifications" : toggleNotifications,
-		"disable notifications" : toggleNotifications,
-		"schedule downtime" : scheduleDowntime,
-		"schedule checks" : scheduleCheck,
-		"reschedule checks" : scheduleCheck,
-		"enable checks" : toggleChecks,
-		"disable checks" : toggleChecks,
-		"acknowledge problems" : acknowledgeProblem
-	}
-
-	# A list of available selectors.
-	selectors = [
-		"host",
-		"service",
-		"all"
-	]
-
-	# Try to guess the correct selector.
-	scope = getSimilar([selector], selectors)
-	if len(scope) == 1:
-		# Set scope name.
-		scope = scope[0]
-	elif len(scope) > 1:
-		sys.stderr.write("Not sure which selector you mean:\n")
-		sys.stderr.write("\n".join(scope))
-		sys.exit(1)
-	elif len(scope) == 0:
-		sys.stderr.write("No '%s' selector found\n" % (selector))
-		sys.stderr.write("Valid selectors are:\n  %s\n" % ("\n  ".join(selectors)))
-		sys.exit(1)
+		key = fields[1]
+		args = fields[2:]
 
-	# Try to guess the correct command name.
-	function = getSimilar(arg, commands)
-	if len(function) == 1:
-		# Set the full command name and function to run later.
-		(names, function) = function.items()[0]
-		names = names.split()
-		# Replace command name with the full one.
-		arg[0:len(names)] = names
-	elif len(function) > 1:
-		sys.stderr.write("Not sure which command you mean:\n")
-		for f in function.keys():
-			f = f.split()
-			sys.stderr.write("  %s %s %s\n" % (f[0], scope, " ".join(f[1:])))
-		sys.exit(1)
-	elif len(function) == 0:
-		sys.stderr.write("No '%s' command found\n" % (" ".join(arg)))
-		sys.stderr.write("Valid commands are:\n  %s\n" % ("\n  ".join(commands.keys())))
-		sys.exit(1)
+	try:
+		entry = index[key]
+	except KeyError:
+		# Nothing is known about the object so the command has to run.
+		return False
+
+	if name in prune_rules:
+		(field, value) = prune_rules[name]
+		if name.startswith("ACKNOWLEDGE_") and (entry.get("current_state", 0) == 0):
+			# There's no problem to acknowledge.
+			return True
+		return entry.get(field) == value
+
+	if name in ("SCHEDULE_HOST_DOWNTIME", "SCHEDULE_SVC_DOWNTIME"):
+		(start, end) = (int(args[0]), int(args[1]))
+		# Look for a downtime scheduled by nagctl that covers
+		# the whole requested period.
+		for d in entry.get("downtime", []):
+			if (d.get("author") == "nagctl") and (d.get("start_time", start + 1) <= start) and (d.get("end_time", 0) >= end):
+				return True
+
+	return False
+
+
+def applyCommand(command, index):
+	"""Update an index of object states with the change a command
+	will make once Nagios runs it"""
 
-	# Parse main Nagios configuration file.
-	parseConfig()
+	fields = command.split(";")
+	name = fields[0]
 
-	# Check every directory that main configuration mentions.
-	for dir in conf["cfg_dir"]:
-		searchDir(dir)
+	if "_SVC_" in name:
+		key = (fields[1], fields[2])
+		args = fields[3:]
+	else:
+		key = fields[1]
+		args = fields[2:]
+
+	if name in prune_rules:
+		(field, value) = prune_rules[name]
+		index.setdefault(key, {})[field] = value
+	elif name in ("SCHEDULE_HOST_DOWNTIME", "SCHEDULE_SVC_DOWNTIME"):
+		index.setdefault(key, {}).setdefault("downtime", []).append({"start_time" : int(args[0]), "end_time" : int(args[1]), "author" : args[5]})
+
+
+def getSimilar(args, pack):
+	"""Return a subset of objects that are similar to first argument"""
+
+	import re
+
+	# Make sure that args is a list or otherwise strange things might happen.
+	if type(args).__name__ != "list":
+		raise TypeError
+
+	if "" in args:
+		# Return empty list when first argument contains empty string.
+		# This would cause regexp to always match.
+		return []
+
+	if type(pack).__name__  == "dict":
+		# Return dictionary when given one as second argument.
+		results = {}
+		for p in pack.keys():
+			count = p.count(" ") + 1
+			# Limit number of elements in args to number of words in current object
+			# and build a regular expression to match object key.
+			if re.search("^"+"\w*\s+".join(args[:count]), p, re.IGNORECASE):
+				results[p] = pack[p]
+
+	elif type(pack).__name__  == "list":
+		# Return list when given one as second argument.
+		results = []
+		for p in pack:
+			count = p.count(" ") + 1
+			# Limit number of elements in args to number of words in current object
+			# and build a regular expression to match object.
+			if re.search("^"+"\w*\s+".join(args[:count]), p, re.IGNORECASE):
+				results.append(p)
+	else:
+		# Raise exception when list or dictionary not given.
+		raise TypeError
+
+	return results
 
-	# Check every file that main configuration mentions.
-	for file in conf["cfg_file"]:
-		parseFile(file)
 
-	# Finally run the function that will handle the command.
-	doCommands(function(arg, scope))
+def getStat(path):
+	"""Return a tuple of modification time and size of a file
+	or None when it can't be accessed"""
+
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+
+
+def replaceFile(path, write, mode = 0644):
+	"""Replace a file with one written by a function given an open
+	file object and its temporary path, so that readers never see
+	a partially written file"""
+
+	import tempfile
+
+	(fd, temp) = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), prefix = ".nagctl")
+	try:
+		fh = os.fdopen(fd, "wb")
+		try:
+			write(fh, temp)
+			fh.flush()
+			# Make sure data is on disk before the file is renamed.
+			os.fsync(fh.fileno())
+		finally:
+			fh.close()
+		os.chmod(temp, mode)
+		os.rename(temp, path)
+	except:
+		os.unlink(temp)
+		raise
+
+
+def treePath(path):
+	"""Return a path normalized for looking it up in an archive
+	or a dictionary of files"""
+
+	path = os.path.normpath(path).lstrip("/")
+	if path == ".":
+		# The top directory.
+		return ""
+	return path
+
+
+def importSqlite():
+	"""Return sqlite3 module or raise NagctlError when Python was
+	built without it"""
+
+	try:
+		import sqlite3
+	except ImportError:
+		raise NagctlError("SQLite support requires sqlite3 module")
+	return sqlite3
+
+
+def listDir(dir):
+	"""Return a list of tuples of names and inode identities of object
+	files in a directory, with None identities for subdirectories,
+	or None when directory can't be read"""
+
+	try:
+		from os import scandir
+	except ImportError:
+		try:
+			from scandir import scandir
+		except ImportError:
+			scandir = None
+
+	import stat
+
+	result = []
+	try:
+		if not scandir is None:
+			# Directory entries tell their type without stat calls.
+			for entry in scandir(dir):
+				if entry.is_dir():
+					result.append((entry.name, None))
+				elif (os.path.splitext(entry.name)[1] == ".cfg") and (entry.name[0] != ".") and entry.is_file():
+					st = entry.stat()
+					result.append((entry.name, (st.st_dev, st.st_ino)))
+		else:
+			for name in os.listdir(dir):
+				# Use only one stat call for every entry.
+				try:
+					st = os.stat(os.path.join(dir, name))
+				except OSError:
+					continue
+				if stat.S_ISDIR(st.st_mode):
+					result.append((name, None))
+				elif (os.path.splitext(name)[1] == ".cfg") and (name[0] != ".") and stat.S_ISREG(st.st_mode):
+					result.append((name, (st.st_dev, st.st_ino)))
+	except OSError:
+		return None
+	return result
+
+
+def runInstance(job):
+	"""Load one Nagios instance and run a command line against it"""
+
+	(config, options, arg) = job
+
+	session = Session(options)
+	session.conf["config"] = config
+	return session.runCaptured(arg, load = True)
+
+
+def defaultSession():
+	"""Return the session sharing global objects and options"""
+
+	global session
+
+	if session is None:
+		session = Session()
+	# Global objects may have been replaced since last call.
+	session.conf = conf
+	session.hosts = hosts
+	session.services = services
+	session.hostgroups = hostgroups
+	session.host_tmpl = host_tmpl
+	session.service_tmpl = service_tmpl
+	session.status = status
+	return session
+
+
+def sessionFunction(name):
+	"""Return a function that runs a method of the default session
+	and exits on errors"""
+
+	def function(*args, **kwargs):
+		global hosts, services, hostgroups, host_tmpl, service_tmpl, status
+
+		s = defaultSession()
+		try:
+			try:
+				return getattr(s, name)(*args, **kwargs)
+			except NagctlError, error:
+				sys.stderr.write("%s\n" % (error))
+				sys.exit(1)
+		finally:
+			# The method may have replaced some of the objects.
+			hosts = s.hosts
+			services = s.services
+			hostgroups = s.hostgroups
+			host_tmpl = s.host_tmpl
+			service_tmpl = s.service_tmpl
+			status = s.status
+
+	function.__name__ = name
+	function.__doc__ = getattr(Session, name).__doc__
+	return function
+
+
+# Module level functions kept for scripts written before sessions
+# were introduced. They work on the global objects and options.
+printMessage = sessionFunction("printMessage")
+readInstances = sessionFunction("readInstances")
+parseArguments = sessionFunction("parseArguments")
+parseConfig = sessionFunction("parseConfig")
+searchDir = sessionFunction("searchDir")
+parseFile = sessionFunction("parseFile")
+findFiles = sessionFunction("findFiles")
+findObjectFiles = sessionFunction("findObjectFiles")
+walkDir = sessionFunction("walkDir")
+loadConfig = sessionFunction("loadConfig")
+reloadConfig = sessionFunction("reloadConfig")
+updateConfig = sessionFunction("updateConfig")
+matchObjects = sessionFunction("matchObjects")
+parseStatus = sessionFunction("parseStatus")
+getStatus = sessionFunction("getStatus")
+getStateFilter = sessionFunction("getStateFilter")
+pruneCommands = sessionFunction("pruneCommands")
+selectObjects = sessionFunction("selectObjects")
+searchObjects = sessionFunction("searchObjects")
+toggleNotifications = sessionFunction("toggleNotifications")
+toggleChecks = sessionFunction("toggleChecks")
+scheduleDowntime = sessionFunction("scheduleDowntime")
+scheduleCheck = sessionFunction("scheduleCheck")
+acknowledgeProblem = sessionFunction("acknowledgeProblem")
+propagateDowntime = sessionFunction("propagateDowntime")
+expandImpact = sessionFunction("expandImpact")
+compressCommands = sessionFunction("compressCommands")
+reportStats = sessionFunction("reportStats")
+deleteDowntime = sessionFunction("deleteDowntime")
+completeName = sessionFunction("completeName")
+submitResults = sessionFunction("submitResults")
+exportSqlite = sessionFunction("exportSqlite")
+doCommands = sessionFunction("doCommands")
+resolveCommand = sessionFunction("resolveCommand")
+runCommand = sessionFunction("runCommand")
+runBatch = sessionFunction("runBatch")
+getMtimes = sessionFunction("getMtimes")
+runCaptured = sessionFunction("runCaptured")
+handleRequest = sessionFunction("handleRequest")
+runInstances = sessionFunction("runInstances")
+forwardCommand = sessionFunction("forwardCommand")
+
+
+#########################################################################
+# Main									#
+#########################################################################
+
+def runArguments(session, arg):
+	"""Run the command given on command line, printing profile
+	and writing metrics when requested"""
+
+	import time
+
+	start = time.time()
+	success = False
+	try:
+		# Check if there's at least one command was passed.
+		if len(arg) < 1:
+			sys.stderr.write("Command not specified, terminating\n")
+			print __doc__
+			sys.exit(1)
+
+		if arg[0] == "complete":
+			# Completion must be fast so configuration is not read.
+			if not len(arg) in (2, 3):
+				raise NagctlError("Completion requires kind of names and optional prefix")
+			for name in session.completeName(*arg[1:]):
+				print name
+			success = True
+			return None
+
+		if arg[0] == "export-sqlite":
+			if len(arg) != 2:
+				raise NagctlError("Export requires exactly one database file name")
+			session.loadConfig()
+			session.exportSqlite(arg[1])
+			success = True
+			return None
+
+		if arg[0] == "serve":
+			session.loadConfig()
+			session.serve()
+			success = True
+			return None
+
+		if arg[0] == "submit":
+			# Results are read as a stream so the daemon can't take them.
+			if len(arg) > 2:
+				raise NagctlError("Submit accepts at most one file name")
+			if len(session.conf["instances"]) > 1:
+				# Every result belongs to one Nagios instance.
+				raise NagctlError("Submit can't be run against many instances")
+			session.loadConfig()
+			if session.submitResults((arg + ["-"])[1]):
+				sys.exit(1)
+			success = True
+			return None
+
+		if len(session.conf["instances"]) > 1:
+			# Run the command against every instance at once.
+			if session.runInstances(arg):
+				sys.exit(1)
+			success = True
+			return None
+
+		# Let a running daemon handle the command if there is one.
+		code = session.forwardCommand(sys.argv[1:])
+		if not code is None:
+			sys.exit(code)
+
+		if arg[0] == "batch":
+			if len(arg) != 2:
+				raise NagctlError("Batch mode requires exactly one file name")
+			session.loadConfig()
+			# All operations share one writer session.
+			(commands, failed) = session.runBatch(arg[1])
+			session.doCommands(commands)
+			if failed:
+				sys.exit(1)
+			success = True
+			return None
+
+		(function, arg, scope) = session.resolveCommand(arg)
+
+		# Nothing else runs in this session so a database is read
+		# only for objects the command selects.
+		session.loadConfig(True)
+
+		# Finally run the function that will handle the command.
+		session.doCommands(session.runCommand(function, arg, scope))
+		success = True
+	except SystemExit, error:
+		success = not error.code
+		raise
+	finally:
+		if session.conf["profile"]:
+			session.printProfile()
+		if session.conf["metrics_file"] != "":
+			session.writeMetrics(success and (session.getCounters()["failures"] == 0), time.time() - start)
+
+
+def main():
+	# The command line tool runs in the default session.
+	session = defaultSession()
+
+	try:
+		# Parse command line arguments.
+		(conf, arg) = session.parseArguments()
+
+		if conf["help"]:
+			# Display help and exit.
+			print __doc__
+			sys.exit(0)
+
+		if conf["profile_out"] != "":
+			import cProfile
+
+			profiler = cProfile.Profile()
+			profiler.enable()
+			try:
+				runArguments(session, arg)
+			finally:
+				profiler.disable()
+				profiler.dump_stats(conf["profile_out"])
+		else:
+			runArguments(session, arg)
+
+	except NagctlError, error:
+		sys.stderr.write("%s\n" % (error))
+		sys.exit(1)
 
 
 if __name__ == "__main__":
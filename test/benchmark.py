@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+"""Time nagctl processing phases on generated configurations of growing size
+
+Usage: benchmark.py [OPTION...]
+
+Options:
+-n SIZES	comma separated numbers of hosts (default 250,500,1000,2000)
+-r RUNS		runs of every size, the fastest one is kept (default 3)
+-o FILE		append results to FILE, one JSON document per run
+-t EXPONENT	flag phases growing faster than size to this power
+		(default 1.3)
+
+Configurations are generated with generate.py using one hostgroup per
+20 hosts. Commands are written to a FIFO drained by a reader thread so
+that writing doesn't depend on disk speed.
+"""
+
+import getopt
+import sys
+import os
+import threading
+
+# Benchmarks use the nagctl module from the parent directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nagctl
+import generate
+
+# Default benchmark parameters.
+defaults = {
+	"sizes" : [250, 500, 1000, 2000],
+	"runs" : 3,
+	"output" : "",
+	"threshold" : 1.3
+}
+
+# Benchmark phases and nagctl phases they consist of.
+phases = (
+	("parse", ("parseConfig", "discovery", "parseFile")),
+	("inherit", ("templates",)),
+	("match", ("hostgroups", "matching")),
+	("render", ("commands",)),
+	("write", ("doCommands",))
+)
+
+# Phases shorter than this many seconds are too noisy to judge scaling.
+min_time = 0.01
+
+
+def drainFifo(path, counter):
+	"""Read a FIFO until writers close it counting lines read"""
+
+	fh = open(path, "r")
+	try:
+		for line in fh:
+			counter[0] += 1
+	finally:
+		fh.close()
+
+
+def runOnce(config, fifo):
+	"""Load configuration, write commands to a FIFO and return a tuple
+	of phase times and session counters"""
+
+	session = nagctl.Session({"config":config, "profile":True, "verbose":0})
+	session.loadConfig()
+	session.conf["command_file"] = fifo
+
+	counter = [0]
+	reader = threading.Thread(target = drainFifo, args = (fifo, counter))
+	reader.start()
+	try:
+		(function, arg, scope) = session.resolveCommand(["disable", "all", "notifications"])
+		session.doCommands(session.runCommand(function, arg, scope))
+	finally:
+		if session.profile["counters"].get("commands written", 0) == 0:
+			# Nothing opened the FIFO so let the reader go.
+			open(fifo, "w").close()
+		reader.join()
+
+	times = {}
+	for (name, parts) in phases:
+		times[name] = sum([session.profile["phases"].get(p, [0, 0.0, 0.0])[1] for p in parts])
+	counters = dict(session.getCounters())
+	counters["lines received"] = counter[0]
+	return (times, counters)
+
+
+def runSize(size, runs):
+	"""Benchmark a configuration with given number of hosts and return
+	a dictionary of results"""
+
+	import tempfile
+	import shutil
+
+	dir = tempfile.mkdtemp(prefix = "nagctl-bench")
+	try:
+		param = dict(generate.defaults, hosts = size, groups = max(size / 20, 1))
+		config = generate.generateConfig(dir, param)
+		fifo = os.path.join(dir, "nagios.cmd")
+		os.mkfifo(fifo)
+
+		best = None
+		for i in range(0, runs):
+			(times, counters) = runOnce(config, fifo)
+			if best is None:
+				best = (times, counters)
+			else:
+				for (k, v) in times.items():
+					best[0][k] = min(best[0][k], v)
+	finally:
+		shutil.rmtree(dir)
+
+	return {"size" : size, "param" : param, "times" : best[0], "counters" : best[1]}
+
+
+def getExponents(results):
+	"""Return a list of (phase, smaller size, larger size, exponent)
+	tuples of how phase time grows between consecutive sizes"""
+
+	import math
+
+	result = []
+	for (a, b) in zip(results, results[1:]):
+		for (name, _) in phases:
+			(t1, t2) = (a["times"][name], b["times"][name])
+			if (t2 < min_time) or (t1 <= 0):
+				continue
+			exponent = math.log(t2 / t1) / math.log(float(b["size"]) / a["size"])
+			result.append((name, a["size"], b["size"], exponent))
+	return result
+
+
+def main():
+	import json
+	import time
+
+	try:
+		(opt, arg) = getopt.getopt(sys.argv[1:], "n:r:o:t:")
+	except getopt.GetoptError, error:
+		sys.stderr.write("Fatal error parsing arguments: %s\n" % (error))
+		sys.exit(1)
+
+	param = dict(defaults)
+	for (k, v) in opt:
+		if k == "-n":
+			param["sizes"] = [int(s) for s in v.split(",")]
+		if k == "-r":
+			param["runs"] = int(v)
+		if k == "-o":
+			param["output"] = v
+		if k == "-t":
+			param["threshold"] = float(v)
+
+	results = []
+	print "%8s %8s %8s" % ("hosts", "services", "pairs") + "".join([" %9s" % (name) for (name, _) in phases])
+	for size in sorted(param["sizes"]):
+		result = runSize(size, param["runs"])
+		result["timestamp"] = time.time()
+		results.append(result)
+		counters = result["counters"]
+		print "%8u %8u %8u" % (counters["hosts"], counters["services"], counters["pairs matched"]) + "".join([" %8.3fs" % (result["times"][name]) for (name, _) in phases])
+		if param["output"] != "":
+			fh = open(param["output"], "a")
+			try:
+				fh.write(json.dumps(result, sort_keys = True) + "\n")
+			finally:
+				fh.close()
+
+	flagged = [e for e in getExponents(results) if e[3] > param["threshold"]]
+	for (name, small, large, exponent) in flagged:
+		print "Super-linear scaling: %s grows as size^%.2f between %u and %u hosts" % (name, exponent, small, large)
+	if len(flagged) > 0:
+		sys.exit(2)
+
+
+if __name__ == "__main__":
+	main()
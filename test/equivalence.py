@@ -0,0 +1,456 @@
+#!/usr/bin/python
+
+"""Check that every nagctl engine gives the same results as the reference one
+
+Usage: equivalence.py [OPTION...]
+
+Options:
+-n RUNS		number of random configurations to check (default 200)
+-S SEED		seed of the first configuration (default 0)
+-e ENGINES	comma separated engines to compare with the reference one
+		(default all of them)
+
+Every configuration is loaded by the reference engine (parseFile() and
+matchObjects() without any caches) and by every other engine. Host lists,
+per-host service lists and rendered commands are compared. A mismatching
+configuration is shrunk to a minimal one before it's printed.
+"""
+
+import getopt
+import sys
+import os
+
+# The harness uses the nagctl module from the parent directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nagctl
+
+# Names objects are picked from. They are few so that objects refer
+# to each other often.
+host_names = ("alpha", "beta", "gamma", "delta", "epsilon")
+group_names = ("web", "db", "mail")
+host_tmpl_names = ("generic-host", "linux-host")
+service_tmpl_names = ("generic-service", "local-service")
+service_names = ("CPU", "load", "SSH", "disk space")
+
+
+def randomList(rng, names, negate = True, wildcard = True):
+	"""Return a comma separated list of random names, some of them negated"""
+
+	result = []
+	for i in range(0, rng.randint(1, 3)):
+		name = rng.choice(names)
+		if wildcard and (rng.random() < 0.1):
+			name = "*"
+		elif negate and (rng.random() < 0.25):
+			name = "!" + name
+		result.append(name)
+	separator = rng.choice([",", ", ", " , "])
+	value = separator.join(result)
+	if rng.random() < 0.1:
+		# Values appended to inherited ones.
+		value = "+" + value
+	return value
+
+
+def randomObject(rng):
+	"""Return a list of lines defining a random object, including
+	malformed ones the parser has to cope with"""
+
+	kind = rng.choice(["host", "host", "service", "service", "service", "hostgroup", "host template", "service template"])
+	param = []
+	if kind == "host":
+		header = "host"
+		param.append(("host_name", rng.choice(host_names)))
+		if rng.random() < 0.7:
+			param.append(("hostgroups", randomList(rng, group_names, negate = False, wildcard = False)))
+		if rng.random() < 0.5:
+			param.append(("use", randomList(rng, host_tmpl_names, negate = False, wildcard = False).lstrip("+")))
+	elif kind == "host template":
+		header = "host"
+		param.append(("name", rng.choice(host_tmpl_names)))
+		param.append(("register", "0"))
+		if rng.random() < 0.6:
+			param.append(("hostgroups", randomList(rng, group_names, negate = False, wildcard = False)))
+		if rng.random() < 0.4:
+			param.append(("use", rng.choice(host_tmpl_names)))
+	elif kind == "hostgroup":
+		header = "hostgroup"
+		param.append(("hostgroup_name", rng.choice(group_names)))
+		if rng.random() < 0.8:
+			param.append(("members", randomList(rng, host_names, negate = False)))
+	elif kind == "service template":
+		header = "service"
+		param.append(("name", rng.choice(service_tmpl_names)))
+		param.append(("register", "0"))
+		if rng.random() < 0.5:
+			param.append(("hostgroup_name", randomList(rng, group_names)))
+		if rng.random() < 0.3:
+			param.append(("host_name", randomList(rng, host_names)))
+		if rng.random() < 0.3:
+			param.append(("use", rng.choice(service_tmpl_names)))
+	else:
+		header = "service"
+		if rng.random() < 0.9:
+			param.append(("service_description", rng.choice(service_names)))
+		if rng.random() < 0.6:
+			param.append(("hostgroup_name", randomList(rng, group_names)))
+		if rng.random() < 0.5:
+			param.append(("host_name", randomList(rng, host_names)))
+		if rng.random() < 0.4:
+			param.append(("use", rng.choice(service_tmpl_names)))
+
+	if rng.random() < 0.1:
+		# Keys nagctl doesn't know about.
+		param.append((rng.choice(["gibberish", "host_names", "hostgroup", "notes"]), "stray value"))
+	if rng.random() < 0.05:
+		# A key without value.
+		param.append(("gibberish", ""))
+	rng.shuffle(param)
+
+	indent = rng.choice(["", "\t", "    "])
+	lines = [indent + rng.choice(["define %s {", "define %s{", "define %s  {"]) % (header)]
+	for (k, v) in param:
+		lines.append("%s\t%s\t%s" % (indent, k, v))
+	if rng.random() < 0.05:
+		# A definition that is never closed.
+		return lines
+	lines.append(indent + "}")
+	return lines
+
+
+def randomConfig(seed):
+	"""Return a dictionary of object file names and their lines"""
+
+	import random
+
+	rng = random.Random(seed)
+	files = {}
+	for i in range(0, rng.randint(1, 4)):
+		lines = []
+		for j in range(0, rng.randint(1, 8)):
+			if rng.random() < 0.1:
+				# Lines outside any definition.
+				lines.append(rng.choice(["# a comment", "host_name\tinvalid", ""]))
+			lines.extend(randomObject(rng))
+			lines.append("")
+		files["objects%u.cfg" % (i)] = lines
+	return files
+
+
+def writeConfig(dir, files):
+	"""Write object files to a directory and return the path to
+	main configuration file"""
+
+	import shutil
+
+	objdir = os.path.join(dir, "objects")
+	if os.path.isdir(objdir):
+		shutil.rmtree(objdir)
+	os.makedirs(objdir)
+	for (name, lines) in files.items():
+		path = os.path.join(objdir, name)
+		fh = open(path, "w")
+		try:
+			fh.write("\n".join(lines) + "\n")
+		finally:
+			fh.close()
+
+	config = os.path.join(dir, "nagios.cfg")
+	fh = open(config, "w")
+	try:
+		fh.write("cfg_dir=%s\ncommand_file=%s\n" % (objdir, os.path.join(dir, "nagios.cmd")))
+	finally:
+		fh.close()
+	return config
+
+
+def touchConfig(dir):
+	"""Make every object file look modified"""
+
+	objdir = os.path.join(dir, "objects")
+	for name in os.listdir(objdir):
+		path = os.path.join(objdir, name)
+		st = os.stat(path)
+		os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+
+def getResult(session):
+	"""Return hosts with their services and rendered commands
+	a session selects"""
+
+	objects = session.matchObjects()
+	hosts = []
+	for i in range(0, objects.getCount()):
+		h = objects.getHost(i)
+		services = [(s.getName(), os.path.basename(s._origin[0]), s._origin[1]) for s in objects.getServiceList(i)]
+		hosts.append((h.getName(), sorted(h._hostgroup), services))
+	commands = session.toggleNotifications(["disable", "notifications"], "all")
+	return {"hosts" : hosts, "commands" : commands}
+
+
+def newSession(config, **options):
+	"""Return a quiet session for main configuration file"""
+
+	return nagctl.Session(dict(options, config = config, verbose = 0))
+
+
+def engineReference(dir, files, base):
+	"""Parse every file and match every host with every service"""
+
+	session = newSession(writeConfig(dir, files))
+	session.loadConfig()
+	return [getResult(session)]
+
+
+def engineCache(dir, files, base):
+	"""Resolve assignments into an empty cache and read them back"""
+
+	config = writeConfig(dir, files)
+	cache = os.path.join(dir, "cache")
+	results = []
+	for i in range(0, 2):
+		session = newSession(config, cache_dir = cache)
+		session.loadConfig()
+		results.append(getResult(session))
+	return results
+
+
+def engineCacheUpdate(dir, files, base):
+	"""Resolve assignments of a changed configuration from assignments
+	cached for the base one"""
+
+	cache = os.path.join(dir, "cache")
+	session = newSession(writeConfig(dir, base), cache_dir = cache)
+	session.loadConfig()
+	session.matchObjects()
+
+	session = newSession(writeConfig(dir, files), cache_dir = cache)
+	session.loadConfig()
+	return [getResult(session)]
+
+
+def engineIncremental(dir, files, base):
+	"""Load the base configuration and read only changed files"""
+
+	session = newSession(writeConfig(dir, base))
+	session.loadConfig()
+	session.matchObjects()
+
+	writeConfig(dir, files)
+	touchConfig(dir)
+	# Main configuration didn't change.
+	session.config_stat = nagctl.getStat(session.conf["config"])
+	session.updateConfig()
+	return [getResult(session)]
+
+
+def engineDatabase(dir, files, base):
+	"""Export resolved objects to SQLite and match the ones read back"""
+
+	session = newSession(writeConfig(dir, files))
+	session.loadConfig()
+	path = os.path.join(dir, "nagctl.db")
+	session.exportSqlite(path)
+
+	session = newSession(os.path.join(dir, "nonexisting.cfg"), db = path)
+	session.loadConfig()
+	return [getResult(session)]
+
+
+def engineArchive(dir, files, base):
+	"""Read configuration from a tar archive of its files"""
+
+	import tarfile
+
+	config = writeConfig(dir, files)
+	path = os.path.join(dir, "nagios.tar")
+	archive = tarfile.open(path, "w")
+	try:
+		archive.add(config)
+		archive.add(os.path.join(dir, "objects"))
+	finally:
+		archive.close()
+
+	session = newSession(config, archive = path)
+	session.loadConfig()
+	return [getResult(session)]
+
+
+def engineSelection(dir, files, base):
+	"""Save every object as a selection and act on the saved one"""
+
+	config = writeConfig(dir, files)
+	selections = os.path.join(dir, "selections")
+	session = newSession(config, save_selection = "all", selection_dir = selections)
+	session.loadConfig()
+	session.selectObjects(session.matchObjects(), "all")
+
+	session = newSession(config, selection = "all", selection_dir = selections)
+	session.loadConfig()
+	return [getResult(session)]
+
+
+# Engines compared with the reference one.
+engines = (
+	("cache", engineCache),
+	("cache-update", engineCacheUpdate),
+	("incremental", engineIncremental),
+	("database", engineDatabase),
+	("archive", engineArchive),
+	("selection", engineSelection)
+)
+
+
+def getBase(files, seed):
+	"""Return a configuration that differs from given one in a few
+	lines of one file"""
+
+	import random
+
+	rng = random.Random(seed)
+	base = dict(files)
+	name = rng.choice(sorted(files.keys()))
+	lines = list(files[name])
+	for i in range(0, rng.randint(1, 3)):
+		if len(lines) > 0:
+			del lines[rng.randrange(0, len(lines))]
+	base[name] = lines
+	return base
+
+
+def runEngine(function, files, base):
+	"""Run an engine in a new directory and return its results
+	or the exception it raised"""
+
+	import tempfile
+	import shutil
+
+	dir = tempfile.mkdtemp(prefix = "nagctl-equiv")
+	try:
+		try:
+			return function(dir, files, base)
+		except Exception, error:
+			return ["%s: %s" % (error.__class__.__name__, error)]
+	finally:
+		shutil.rmtree(dir)
+
+
+def isFailure(result):
+	"""Check if an engine result is an exception it raised"""
+
+	return type(result).__name__ == "str"
+
+
+def findMismatch(files, base, selected):
+	"""Return a description of the first difference between reference
+	and other engines or None when they all agree"""
+
+	saved = sys.stderr
+	# The parser complains about unreadable files on stderr.
+	sys.stderr = open(os.devnull, "w")
+	try:
+		expected = runEngine(engineReference, files, base)[0]
+		if isFailure(expected) or isFailure(runEngine(engineReference, base, base)[0]):
+			# Configurations the reference engine can't load (like
+			# templates using themselves) are not compared.
+			return None
+		for (name, function) in engines:
+			if not name in selected:
+				continue
+			for (i, result) in enumerate(runEngine(function, files, base)):
+				if result != expected:
+					return "%s engine (run %u) differs:\n  expected: %r\n  got:      %r" % (name, i + 1, expected, result)
+	finally:
+		sys.stderr.close()
+		sys.stderr = saved
+	return None
+
+
+def shrinkConfig(files, base, selected):
+	"""Remove files and lines from a mismatching configuration and its
+	base as long as they still mismatch and return the smallest ones found"""
+
+	def mismatch(config):
+		return not findMismatch(config[0], config[1], selected) is None
+
+	config = (files, base)
+	changed = True
+	while changed:
+		changed = False
+		# Try dropping whole files first.
+		for name in sorted(config[0].keys()):
+			if len(config[0]) == 1:
+				break
+			smaller = tuple([dict([(k, v) for (k, v) in c.items() if k != name]) for c in config])
+			if mismatch(smaller):
+				config = smaller
+				changed = True
+		# Then chunks of lines of the configuration and its base,
+		# halving chunk size.
+		for side in (0, 1):
+			for name in sorted(config[side].keys()):
+				size = max(len(config[side][name]) / 2, 1)
+				while size > 0:
+					start = 0
+					while start < len(config[side][name]):
+						lines = config[side][name]
+						smaller = list(config)
+						smaller[side] = dict(config[side])
+						smaller[side][name] = lines[:start] + lines[start + size:]
+						smaller = tuple(smaller)
+						if mismatch(smaller):
+							config = smaller
+							changed = True
+						else:
+							start += size
+					size /= 2
+	return config
+
+
+def printConfig(files):
+	"""Print object files of a configuration"""
+
+	for name in sorted(files.keys()):
+		print "==> %s <==" % (name)
+		print "\n".join(files[name])
+
+
+def main():
+	try:
+		(opt, arg) = getopt.getopt(sys.argv[1:], "n:S:e:")
+	except getopt.GetoptError, error:
+		sys.stderr.write("Fatal error parsing arguments: %s\n" % (error))
+		sys.exit(1)
+
+	runs = 200
+	seed = 0
+	selected = [name for (name, _) in engines]
+	for (k, v) in opt:
+		if k == "-n":
+			runs = int(v)
+		if k == "-S":
+			seed = int(v)
+		if k == "-e":
+			selected = v.split(",")
+
+	for s in range(seed, seed + runs):
+		files = randomConfig(s)
+		base = getBase(files, s)
+		if findMismatch(files, base, selected) is None:
+			continue
+
+		print "Configuration %u mismatches, shrinking" % (s)
+		(files, base) = shrinkConfig(files, base, selected)
+		print findMismatch(files, base, selected)
+		print "Configuration:"
+		printConfig(files)
+		if files != base:
+			print "Base configuration:"
+			printConfig(base)
+		sys.exit(1)
+
+	print "%u configurations checked, all engines agree" % (runs)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+"""Generate a synthetic Nagios configuration for nagctl benchmarks
+
+Usage: generate.py [OPTION...] DIRECTORY
+
+Options:
+-n HOSTS	number of hosts (default 1000)
+-g GROUPS	number of hostgroups (default 50)
+-d DEPTH	depth of host and service template chains (default 3)
+-f FILES	number of object files in cfg_dir (default 20)
+-S SEED		seed of random generator (default 0)
+
+The same options always generate the same configuration. Main config
+file is written to DIRECTORY/nagios.cfg and object files to
+DIRECTORY/objects.
+"""
+
+import getopt
+import sys
+import os
+
+# Default generator parameters.
+defaults = {
+	"hosts" : 1000,
+	"groups" : 50,
+	"depth" : 3,
+	"files" : 20,
+	"seed" : 0
+}
+
+# Names of services assigned to hostgroups.
+group_services = ("CPU", "load", "disk space", "memory", "swap", "NTP")
+# Names of services assigned to hosts directly.
+host_services = ("SSH", "HTTP", "SMTP", "transaction")
+
+
+def templateChain(kind, depth):
+	"""Return definitions of a chain of templates where every template
+	uses the previous one"""
+
+	result = []
+	for level in range(0, depth):
+		lines = ["define %s {" % (kind), "\tname\tgeneric-%s-%u" % (kind, level)]
+		if level > 0:
+			lines.append("\tuse\tgeneric-%s-%u" % (kind, level - 1))
+		lines.append("\tregister\t0")
+		lines.append("\tnotes\tlevel %u" % (level))
+		lines.append("}")
+		result.append("\n".join(lines))
+	return result
+
+
+def generateObjects(param):
+	"""Return a list of object definitions for given parameters"""
+
+	import random
+
+	rng = random.Random(param["seed"])
+	hosts = ["host%05u" % (i) for i in range(0, param["hosts"])]
+	groups = ["group%03u" % (i) for i in range(0, param["groups"])]
+	tmpl = "generic-%%s-%u" % (max(param["depth"], 1) - 1)
+
+	objects = templateChain("host", max(param["depth"], 1))
+	objects.extend(templateChain("service", max(param["depth"], 1)))
+
+	for g in groups:
+		objects.append("define hostgroup {\n\thostgroup_name\t%s\n}" % (g))
+
+	for h in hosts:
+		# Every host belongs to one to three hostgroups.
+		member = rng.sample(groups, min(len(groups), rng.randint(1, 3)))
+		objects.append("define host {\n\thost_name\t%s\n\tuse\t%s\n\thostgroups\t%s\n\taddress\t10.%u.%u.%u\n}" % (
+			h, tmpl % ("host"), ", ".join(member), rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254)))
+
+	# Services assigned by hostgroup, some with excluded hostgroups
+	# and hosts. Their number grows with the number of hostgroups.
+	for g in range(0, len(groups)):
+		for name in rng.sample(group_services, 2):
+			lines = ["define service {", "\tservice_description\t%s %u" % (name, g), "\tuse\t%s" % (tmpl % ("service"))]
+			included = [groups[g], groups[(g + 1) % len(groups)]]
+			if rng.random() < 0.3:
+				included.append("!" + groups[(g + 2) % len(groups)])
+			lines.append("\thostgroup_name\t%s" % (", ".join(included)))
+			if rng.random() < 0.3:
+				lines.append("\thost_name\t!%s" % (rng.choice(hosts)))
+			lines.append("}")
+			objects.append("\n".join(lines))
+
+	# Services assigned to a few hosts directly. Their number grows
+	# with the number of hosts.
+	for i in range(0, max(len(hosts) / 10, 1)):
+		assigned = rng.sample(hosts, min(len(hosts), rng.randint(1, 5)))
+		objects.append("define service {\n\tservice_description\t%s %u\n\tuse\t%s\n\thost_name\t%s\n}" % (
+			rng.choice(host_services), i, tmpl % ("service"), ", ".join(assigned)))
+
+	return objects
+
+
+def generateConfig(dir, param):
+	"""Write main configuration and object files to a directory and
+	return the path to main configuration file"""
+
+	objects = generateObjects(param)
+	objdir = os.path.join(dir, "objects")
+	files = max(param["files"], 1)
+
+	for i in range(0, files):
+		# Spread files across a few subdirectories.
+		subdir = os.path.join(objdir, "part%u" % (i % 4))
+		if not os.path.isdir(subdir):
+			os.makedirs(subdir)
+
+	# Split objects into files of similar size.
+	chunks = [[] for i in range(0, files)]
+	for (i, o) in enumerate(objects):
+		chunks[i * files / len(objects)].append(o)
+	for (i, chunk) in enumerate(chunks):
+		fh = open(os.path.join(objdir, "part%u" % (i % 4), "objects%04u.cfg" % (i)), "w")
+		try:
+			fh.write("\n\n".join(chunk) + "\n")
+		finally:
+			fh.close()
+
+	config = os.path.join(dir, "nagios.cfg")
+	fh = open(config, "w")
+	try:
+		fh.write("cfg_dir=%s\n" % (objdir))
+		fh.write("command_file=%s\n" % (os.path.join(dir, "nagios.cmd")))
+	finally:
+		fh.close()
+
+	return config
+
+
+def main():
+	try:
+		(opt, arg) = getopt.getopt(sys.argv[1:], "n:g:d:f:S:")
+	except getopt.GetoptError, error:
+		sys.stderr.write("Fatal error parsing arguments: %s\n" % (error))
+		sys.exit(1)
+
+	if len(arg) != 1:
+		print __doc__
+		sys.exit(1)
+
+	# A mapping of arguments to generator parameters.
+	argmap = {
+		"-n" : "hosts",
+		"-g" : "groups",
+		"-d" : "depth",
+		"-f" : "files",
+		"-S" : "seed"
+	}
+	param = dict(defaults)
+	for (k, v) in opt:
+		param[argmap[k]] = int(v)
+
+	print generateConfig(arg[0], param)
+
+
+if __name__ == "__main__":
+	main()
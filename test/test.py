@@ -1082,5 +1082,1614 @@ class Main_acknowledgeProblem(unittest.TestCase):
 		self.assertRaises(SystemExit, nagctl.acknowledgeProblem, ["schedule", "check"], "all")
 
 
+class Main_status(unittest.TestCase):
+	def setUp(self):
+		nagctl.conf["host"] = None
+		nagctl.conf["service"] = None
+		nagctl.conf["status_file"] = "status.dat"
+		nagctl.status = None
+		nagctl.hosts = []
+		nagctl.services = []
+		nagctl.hosts.append(nagctl.Host({"host_name":"worker0", "hostgroups":"group0"}))
+		nagctl.hosts.append(nagctl.Host({"host_name":"worker1", "hostgroups":"group1"}))
+		nagctl.hosts.append(nagctl.Host({"host_name":"database", "hostgroups":"group0, group1"}))
+		nagctl.services.append(nagctl.Service({"service_description":"queue0", "hostgroup_name":"group0"}))
+		nagctl.services.append(nagctl.Service({"service_description":"queue1", "hostgroup_name":"group1"}))
+		nagctl.services.append(nagctl.Service({"service_description":"load", "hostgroup_name":"group0, group1"}))
+
+	def tearDown(self):
+		nagctl.conf["state"] = None
+		nagctl.conf["unacked"] = False
+		nagctl.conf["status_file"] = ""
+		nagctl.status = None
+
+	def test_parseStatus(self):
+		"""parseStatus: keep only state fields of hosts and services"""
+
+		index = nagctl.parseStatus("status.dat")
+		self.assertEqual(len(index), 10)
+		self.assertEqual(index["worker1"], {"current_state":1, "problem_has_been_acknowledged":0, "notifications_enabled":0, "active_checks_enabled":1, "scheduled_downtime_depth":0})
+		self.assertEqual(index[("database", "queue1")]["current_state"], 3)
+
+	def test_parseStatus_missing(self):
+		"""parseStatus: exit when file does not exists"""
+
+		self.assertRaises(SystemExit, nagctl.parseStatus, "nonexisting.dat")
+
+	def test_getStatus_unset(self):
+		"""getStatus: return None when status file is not set"""
+
+		nagctl.conf["status_file"] = ""
+		self.assertEqual(nagctl.getStatus(), None)
+
+	def test_state_service(self):
+		"""selectObjects: filter services by state"""
+
+		nagctl.conf["state"] = "critical,warning"
+		commands = nagctl.toggleNotifications(["disable", "notifications"], "service")
+
+		expected = ["DISABLE_SVC_NOTIFICATIONS;worker0;queue0", "DISABLE_SVC_NOTIFICATIONS;worker1;queue1", "DISABLE_SVC_NOTIFICATIONS;worker1;load", "DISABLE_SVC_NOTIFICATIONS;database;load"]
+		self.assertEqual(commands, expected)
+
+	def test_state_host(self):
+		"""selectObjects: filter hosts by state"""
+
+		nagctl.conf["state"] = "down"
+		commands = nagctl.toggleChecks(["enable", "checks"], "host")
+
+		expected = ["ENABLE_HOST_CHECK;worker1", "ENABLE_HOST_CHECK;database"]
+		self.assertEqual(commands, expected)
+
+	def test_unacked(self):
+		"""selectObjects: match unacknowledged problems only"""
+
+		nagctl.conf["unacked"] = True
+		nagctl.conf["state"] = "warning"
+		commands = nagctl.toggleChecks(["disable", "checks"], "all")
+
+		expected = ["DISABLE_SVC_CHECK;worker1;load"]
+		self.assertEqual(commands, expected)
+
+	def test_state_invalid(self):
+		"""getStateFilter: exit on unrecognized state name"""
+
+		nagctl.conf["state"] = "sleepy"
+		self.assertRaises(SystemExit, nagctl.toggleChecks, ["disable", "checks"], "all")
+
+	def test_state_no_status_file(self):
+		"""getStateFilter: exit when filtering by state without status file"""
+
+		nagctl.conf["status_file"] = ""
+		nagctl.conf["unacked"] = True
+		self.assertRaises(SystemExit, nagctl.toggleChecks, ["disable", "checks"], "all")
+
+	def test_acknowledgeProblem_problems_only(self):
+		"""acknowledgeProblem: target unacknowledged problems only"""
+
+		commands = nagctl.acknowledgeProblem(["acknowledge", "problem", "comment"], "all")
+
+		expected = ["ACKNOWLEDGE_HOST_PROBLEM;worker1;1;0;0;nagctl;comment", "ACKNOWLEDGE_SVC_PROBLEM;worker0;queue0;1;0;0;nagctl;comment", "ACKNOWLEDGE_SVC_PROBLEM;worker1;load;1;0;0;nagctl;comment", "ACKNOWLEDGE_SVC_PROBLEM;database;queue1;1;0;0;nagctl;comment", "ACKNOWLEDGE_SVC_PROBLEM;database;load;1;0;0;nagctl;comment"]
+		self.assertEqual(commands, expected)
+
+
+class Main_pruneCommands(unittest.TestCase):
+	def setUp(self):
+		nagctl.conf["status_file"] = "status.dat"
+		nagctl.status = None
+
+	def tearDown(self):
+		nagctl.conf["status_file"] = ""
+		nagctl.status = None
+
+	def test_parseStatus_downtime(self):
+		"""parseStatus: attach downtimes to objects"""
+
+		index = nagctl.parseStatus("status.dat")
+		self.assertEqual(index["worker0"]["downtime"], [{"downtime_id":11, "start_time":1000000000, "end_time":4000000000, "author":"nagctl", "comment":"long maintenance"}])
+		self.assertEqual(index[("worker1", "load")]["downtime"][0]["author"], "admin")
+
+	def test_parseStatus_order(self):
+		"""parseStatus: keep downtimes read before object state and braces in output"""
+
+		import tempfile
+
+		(fd, path) = tempfile.mkstemp()
+		os.write(fd, "hostdowntime {\n\thost_name=worker0\n\tdowntime_id=1\n\t}\n"
+			"hoststatus {\n\thost_name=worker0\n\tplugin_output=CRITICAL - got {\n\tcurrent_state=2\n\t}\n"
+			"servicestatus {\n\thost_name=worker0\n\tservice_description=load\n\tcurrent_state=1\n\t}\n")
+		os.close(fd)
+		try:
+			index = nagctl.parseStatus(path)
+		finally:
+			os.unlink(path)
+
+		self.assertEqual(index["worker0"], {"current_state":2, "downtime":[{"downtime_id":1}]})
+		self.assertEqual(index[("worker0", "load")], {"current_state":1})
+
+	def test_pruneCommands_toggle(self):
+		"""pruneCommands: drop commands for objects already in desired state"""
+
+		commands = ["DISABLE_HOST_NOTIFICATIONS;worker0", "DISABLE_HOST_NOTIFICATIONS;worker1", "ENABLE_SVC_CHECK;worker0;queue0", "ENABLE_SVC_CHECK;database;queue1", "DISABLE_SVC_CHECK;unknown;queue1"]
+		expected = ["DISABLE_HOST_NOTIFICATIONS;worker0", "ENABLE_SVC_CHECK;database;queue1", "DISABLE_SVC_CHECK;unknown;queue1"]
+		self.assertEqual(nagctl.pruneCommands(commands), expected)
+
+	def test_pruneCommands_acknowledge(self):
+		"""pruneCommands: drop acknowledgements of acknowledged or OK objects"""
+
+		commands = ["ACKNOWLEDGE_HOST_PROBLEM;database;1;0;0;nagctl;c", "ACKNOWLEDGE_HOST_PROBLEM;worker0;1;0;0;nagctl;c", "ACKNOWLEDGE_SVC_PROBLEM;worker0;queue0;1;0;0;nagctl;c"]
+		expected = ["ACKNOWLEDGE_SVC_PROBLEM;worker0;queue0;1;0;0;nagctl;c"]
+		self.assertEqual(nagctl.pruneCommands(commands), expected)
+
+	def test_pruneCommands_downtime(self):
+		"""pruneCommands: drop downtimes covered by one scheduled by nagctl"""
+
+		commands = ["SCHEDULE_HOST_DOWNTIME;worker0;2000000000;2000003600;1;0;3600;nagctl;c", "SCHEDULE_HOST_DOWNTIME;worker0;3999999000;4000003600;1;0;4600;nagctl;c", "SCHEDULE_SVC_DOWNTIME;worker1;load;2000000000;2000003600;1;0;3600;nagctl;c"]
+		expected = commands[1:]
+		self.assertEqual(nagctl.pruneCommands(commands), expected)
+
+	def test_pruneCommands_no_status_file(self):
+		"""pruneCommands: exit when status file is not set"""
+
+		nagctl.conf["status_file"] = ""
+		self.assertRaises(SystemExit, nagctl.pruneCommands, [])
+
+
+class Main_runBatch(unittest.TestCase):
+	def setUp(self):
+		nagctl.conf["host"] = None
+		nagctl.conf["service"] = None
+		nagctl.hosts = []
+		nagctl.services = []
+		nagctl.hosts.append(nagctl.Host({"host_name":"worker0", "hostgroups":"group0"}))
+		nagctl.hosts.append(nagctl.Host({"host_name":"worker1", "hostgroups":"group1"}))
+		nagctl.hosts.append(nagctl.Host({"host_name":"database", "hostgroups":"group0, group1"}))
+		nagctl.services.append(nagctl.Service({"service_description":"queue0", "hostgroup_name":"group0"}))
+		nagctl.services.append(nagctl.Service({"service_description":"queue1", "hostgroup_name":"group1"}))
+		nagctl.services.append(nagctl.Service({"service_description":"load", "hostgroup_name":"group0, group1"}))
+
+	def test_runBatch(self):
+		"""runBatch: run every line against shared objects"""
+
+		(commands, failed) = nagctl.runBatch("batch.txt")
+
+		self.assertEqual(failed, 1)
+		self.assertEqual(commands[:3], ["DISABLE_HOST_NOTIFICATIONS;database", "ENABLE_SVC_CHECK;worker0;load", "ENABLE_SVC_CHECK;worker1;load"])
+		self.assertEqual(len(commands), 4)
+		self.assertTrue(commands[3].startswith("SCHEDULE_HOST_DOWNTIME;database;"))
+		self.assertTrue(commands[3].endswith(";nagctl;planned maintenance"))
+
+	def runLines(self, text):
+		import StringIO
+		import tempfile
+
+		(fd, path) = tempfile.mkstemp()
+		os.write(fd, text)
+		os.close(fd)
+		saved = (sys.stdout, sys.stderr)
+		(sys.stdout, sys.stderr) = (StringIO.StringIO(), StringIO.StringIO())
+		try:
+			(commands, failed) = nagctl.runBatch(path)
+			return (commands, failed, sys.stdout.getvalue(), sys.stderr.getvalue())
+		finally:
+			(sys.stdout, sys.stderr) = saved
+			os.unlink(path)
+
+	def test_runBatch_invalid_pattern(self):
+		"""runBatch: count lines with invalid patterns as failed"""
+
+		(commands, failed, output, errors) = self.runLines("-h worker[ disable host notifications\n-h database disable host notifications\n")
+
+		self.assertEqual(failed, 1)
+		self.assertEqual(commands, ["DISABLE_HOST_NOTIFICATIONS;database"])
+		self.assertTrue("Line 1: failed: -h worker[ disable host notifications" in errors)
+		self.assertTrue("Line 2: 1 commands" in output)
+
+	def test_runBatch_dry_run(self):
+		"""runBatch: write nothing for lines in dry-run mode"""
+
+		import tempfile
+
+		(fd, path) = tempfile.mkstemp()
+		os.close(fd)
+		nagctl.conf["command_file"] = path
+		try:
+			(commands, failed, output, _) = self.runLines("-D -h database disable host notifications\n-h worker0 disable host notifications\n")
+			fh = open(path, "r")
+			written = fh.read()
+			fh.close()
+		finally:
+			nagctl.conf["command_file"] = ""
+			os.unlink(path)
+
+		self.assertEqual(failed, 0)
+		self.assertEqual(commands, ["DISABLE_HOST_NOTIFICATIONS;worker0"])
+		self.assertEqual(written, "")
+		self.assertTrue("Running command: DISABLE_HOST_NOTIFICATIONS;database" in output)
+
+	def test_runBatch_refused_options(self):
+		"""runBatch: fail lines setting options that can't apply to them"""
+
+		(commands, failed, _, errors) = self.runLines("-c other.cfg -h database disable host notifications\n--db nagios.db -h database disable host notifications\n--metrics-file metrics.prom -h database disable host notifications\n")
+
+		self.assertEqual(failed, 3)
+		self.assertEqual(commands, [])
+		self.assertTrue("Option not allowed in batch file: config, instances" in errors)
+		self.assertTrue("Option not allowed in batch file: metrics-file" in errors)
+
+	def test_runBatch_prune_queued(self):
+		"""runBatch: prune commands queued by earlier lines"""
+
+		nagctl.conf["status_file"] = "status.dat"
+		nagctl.status = None
+		try:
+			(commands, failed, _, _) = self.runLines("-h worker0 disable host notifications\n--prune -h worker. disable host notifications\n")
+		finally:
+			nagctl.conf["status_file"] = ""
+			nagctl.status = None
+
+		self.assertEqual(failed, 0)
+		self.assertEqual(commands, ["DISABLE_HOST_NOTIFICATIONS;worker0"])
+
+	def test_runBatch_options_restored(self):
+		"""runBatch: options set on a line do not leak"""
+
+		nagctl.runBatch("batch.txt")
+
+		self.assertEqual(nagctl.conf["host"], None)
+		self.assertEqual(nagctl.conf["service"], None)
+
+	def test_runBatch_missing(self):
+		"""runBatch: exit when batch file does not exists"""
+
+		self.assertRaises(SystemExit, nagctl.runBatch, "nonexisting.txt")
+
+
+class Main_daemon(unittest.TestCase):
+	def setUp(self):
+		nagctl.conf["config"] = "main.cfg"
+		nagctl.conf["cfg_file"] = ["hosts.cfg"]
+		nagctl.conf["cfg_dir"] = ["conf.d"]
+		nagctl.conf["host"] = None
+		nagctl.conf["service"] = None
+		nagctl.hosts = []
+		nagctl.services = []
+		nagctl.hosts.append(nagctl.Host({"host_name":"worker0", "hostgroups":"group0"}))
+		nagctl.services.append(nagctl.Service({"service_description":"queue0", "hostgroup_name":"group0"}))
+
+	def tearDown(self):
+		nagctl.conf["cfg_file"] = []
+		nagctl.conf["cfg_dir"] = []
+
+	def test_getMtimes(self):
+		"""getMtimes: track main config and object files"""
+
+		mtimes = nagctl.getMtimes()
+		for path in ["main.cfg", "hosts.cfg", "conf.d/host-main.cfg", "conf.d/alpha.d/service.cfg"]:
+			self.assertTrue(path in mtimes)
+		self.assertFalse("conf.d/dont-read.txt" in mtimes)
+
+	def test_getMtimes_added(self):
+		"""getMtimes: notice files added to listed directories"""
+
+		import tempfile
+		import shutil
+
+		dir = tempfile.mkdtemp()
+		try:
+			session = nagctl.Session({"cfg_dir":[dir]})
+			session.conf["config"] = "main.cfg"
+			before = session.getMtimes()
+			open(os.path.join(dir, "new.cfg"), "w").close()
+			# Make sure directory time changes on coarse filesystems.
+			os.utime(dir, (0, 0))
+			after = session.getMtimes()
+		finally:
+			shutil.rmtree(dir)
+
+		self.assertFalse(os.path.join(dir, "new.cfg") in before)
+		self.assertTrue(os.path.join(dir, "new.cfg") in after)
+
+	def test_handleRequest(self):
+		"""handleRequest: run command and return its output"""
+
+		response = nagctl.handleRequest({"argv":["-h", "worker0", "search", "all"], "config":"main.cfg"})
+		self.assertEqual(response["refused"], False)
+		self.assertEqual(response["status"], 0)
+		self.assertEqual(response["stdout"], "worker0: queue0\n")
+		self.assertEqual(nagctl.conf["host"], None)
+
+	def test_handleRequest_failed(self):
+		"""handleRequest: return exit status of failed command"""
+
+		response = nagctl.handleRequest({"argv":["bogus", "all"], "config":"main.cfg"})
+		self.assertEqual(response["status"], 1)
+		self.assertTrue("No 'bogus' command found" in response["stderr"])
+
+	def test_handleRequest_refused(self):
+		"""handleRequest: refuse requests for other configuration"""
+
+		response = nagctl.handleRequest({"argv":["search", "all"], "config":"other.cfg"})
+		self.assertEqual(response["refused"], True)
+
+	def test_handleRequest_realpath(self):
+		"""handleRequest: accept configuration given by its real path"""
+
+		response = nagctl.handleRequest({"argv":["-h", "worker0", "search", "all"], "config":os.path.realpath("main.cfg")})
+		self.assertEqual(response["refused"], False)
+		self.assertEqual(response["status"], 0)
+
+	def test_handleRequest_paths(self):
+		"""handleRequest: refuse options naming files or asking for profiles"""
+
+		for argv in (["-c", "other.cfg"], ["--cache-dir", "/tmp"], ["--instances", "instances.txt"], ["--save-selection", "mine"], ["--db", "nagios.db"], ["--metrics-file", "nagctl.prom"], ["--profile"]):
+			response = nagctl.handleRequest({"argv":argv + ["search", "all"], "config":"main.cfg"})
+			self.assertEqual(response["refused"], True)
+			self.assertEqual(nagctl.conf["cache_dir"], "")
+
+
+class Session(unittest.TestCase):
+	def setUp(self):
+		self.session = nagctl.Session({"config":"main.cfg"})
+		self.session.loadConfig()
+
+	def test_init_defaults(self):
+		"""init: do not share options with other sessions"""
+
+		other = nagctl.Session()
+		self.assertEqual(other.conf["config"], nagctl.defaults["config"])
+		self.assertEqual(other.conf["cfg_file"], [])
+		self.assertEqual(other.hosts, [])
+
+	def test_loadConfig(self):
+		"""loadConfig: keep objects in session instead of globals"""
+
+		names = sorted([h.getName() for h in self.session.hosts])
+		self.assertEqual(names, ["database0", "database1", "firewall external", "multiverse", "universe", "worker0"])
+		self.assertFalse(self.session.hosts is nagctl.hosts)
+
+	def test_select(self):
+		"""select: return pairs matching name patterns"""
+
+		pairs = self.session.select("service", "database0", "CPU|SMTP")
+		self.assertEqual([(h.getName(), s.getName()) for (h, s) in pairs], [("database0", "CPU"), ("database0", "SMTP")])
+		self.assertEqual(self.session.conf["host"], None)
+
+	def test_templates(self):
+		"""select: inherit from templates of own session only"""
+
+		session = nagctl.Session()
+		session.parseFile("templates.cfg")
+		nagctl.host_tmpl = {}
+		session.select("host")
+		self.assertEqual(session.hosts[0]._templates, session.host_tmpl)
+		self.assertEqual(session.hosts[1].inheritTemplates()["register"], "0")
+
+	def test_errors(self):
+		"""toggleChecks: raise NagctlError instead of exiting"""
+
+		self.assertRaises(nagctl.NagctlError, self.session.toggleChecks, ["disable", "checks", "invalid"], "all")
+		self.assertRaises(nagctl.NagctlError, self.session.resolveCommand, ["bogus", "all"])
+
+
+class Main_instances(unittest.TestCase):
+	def setUp(self):
+		nagctl.conf["instances"] = []
+		nagctl.conf["dry-run"] = 0
+		nagctl.conf["verbose"] = 1
+
+	def tearDown(self):
+		nagctl.conf["instances"] = []
+
+	def test_parseArguments_repeated_config(self):
+		"""parseArguments: collect every main config as an instance"""
+
+		sys.argv = ["test.py", "-c", "a.cfg", "-c", "b.cfg"]
+		options = nagctl.parseArguments()[0]
+		self.assertEqual(options["instances"], ["a.cfg", "b.cfg"])
+		self.assertEqual(options["config"], "b.cfg")
+
+	def test_parseArguments_single_instance(self):
+		"""parseArguments: use the only instance listed as main config"""
+
+		import tempfile
+
+		(fd, path) = tempfile.mkstemp()
+		os.write(fd, "# one instance\nsingle.cfg\n")
+		os.close(fd)
+		config = nagctl.conf["config"]
+		try:
+			sys.argv = ["test.py", "--instances", path]
+			options = nagctl.parseArguments()[0]
+			self.assertEqual(options["instances"], ["single.cfg"])
+			self.assertEqual(options["config"], "single.cfg")
+		finally:
+			os.unlink(path)
+			nagctl.conf["config"] = config
+
+	def test_readInstances(self):
+		"""readInstances: skip comments and empty lines"""
+
+		self.assertEqual(nagctl.readInstances("instances.txt"), ["main.cfg", "nonexisting.cfg"])
+
+	def test_runInstance(self):
+		"""runInstance: load instance and capture command output"""
+
+		response = nagctl.runInstance(("main.cfg", dict(nagctl.defaults, instances = []), ["search", "host"]))
+		self.assertEqual(response["status"], 0)
+		self.assertEqual(response["stdout"].split(), ["multiverse", "universe", "database0", "database1"])
+
+	def test_runInstance_failed(self):
+		"""runInstance: report instances that can't be loaded"""
+
+		response = nagctl.runInstance(("nonexisting.cfg", dict(nagctl.defaults, instances = []), ["search", "host"]))
+		self.assertEqual(response["status"], 1)
+		self.assertTrue("Cannot open main config file" in response["stderr"])
+
+
+class SessionTestCase(unittest.TestCase):
+	def selected(self, session, scope = "all"):
+		return [(h.getName(), s and s.getName()) for (h, s) in session.selectObjects(session.matchObjects(), scope)]
+
+
+class TempDirTestCase(SessionTestCase):
+	def setUp(self):
+		import tempfile
+
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		import shutil
+
+		shutil.rmtree(self.dir)
+
+	def writeFile(self, name, content):
+		path = os.path.join(self.dir, name)
+		fh = open(path, "w")
+		fh.write(content)
+		fh.close()
+		# Make sure the change is noticed within the same second.
+		st = os.stat(path)
+		os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+
+class Session_cache(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		self.cache = os.path.join(self.dir, "cache")
+		self.writeFile("main.cfg", "cfg_dir=%s\n" % (os.path.join(self.dir, "objects")))
+		os.mkdir(os.path.join(self.dir, "objects"))
+		self.writeFile("objects/hosts.cfg", "define host {\n host_name alpha\n hostgroups web\n}\ndefine host {\n host_name beta\n}\n")
+		self.writeFile("objects/groups.cfg", "define hostgroup {\n hostgroup_name db\n members beta\n}\n")
+		self.writeFile("objects/services.cfg", "define service {\n service_description http\n hostgroup_name web\n}\ndefine service {\n service_description sql\n hostgroup_name db\n host_name alpha\n}\n")
+
+	def pairs(self, cache_dir = "", host = None, service = None):
+		session = nagctl.Session({"config":os.path.join(self.dir, "main.cfg"), "cache_dir":cache_dir})
+		session.loadConfig()
+		return (session, [(h.getName(), s.getName()) for (h, s) in session.select("service", host, service)])
+
+	def test_matchObjects_cache(self):
+		"""matchObjects: return the same objects with cached assignments"""
+
+		expected = self.pairs()[1]
+		self.assertEqual(expected, [("alpha", "http"), ("alpha", "sql"), ("beta", "sql")])
+		self.assertEqual(self.pairs(self.cache)[1], expected)
+		(session, pairs) = self.pairs(self.cache)
+		self.assertEqual(pairs, expected)
+		self.assertEqual(session.readCache("assign")["key"], session.getCacheKey())
+
+	def test_matchObjects_cache_filtered(self):
+		"""matchObjects: filter cached assignments by name"""
+
+		self.pairs(self.cache)
+		self.assertEqual(self.pairs(self.cache, "beta")[1], [("beta", "sql")])
+		self.assertEqual(self.pairs(self.cache, None, "http")[1], [("alpha", "http")])
+
+	def test_updateAssignment(self):
+		"""updateAssignment: resolve only objects from changed files"""
+
+		self.pairs(self.cache)
+		self.writeFile("objects/services.cfg", "define service {\n service_description sql\n hostgroup_name db\n}\ndefine service {\n service_description ssh\n host_name *\n}\n")
+
+		session = nagctl.Session({"config":os.path.join(self.dir, "main.cfg"), "cache_dir":self.cache})
+		session.loadConfig()
+		session.expandHostgroups(session.hosts)
+		self.assertNotEqual(session.updateAssignment(session.readCache("assign")), None)
+
+		self.assertEqual(self.pairs(self.cache)[1], self.pairs()[1])
+		self.assertEqual(self.pairs()[1], [("alpha", "ssh"), ("beta", "sql"), ("beta", "ssh")])
+
+	def test_updateAssignment_static(self):
+		"""updateAssignment: resolve everything when hostgroups change"""
+
+		self.pairs(self.cache)
+		self.writeFile("objects/groups.cfg", "define hostgroup {\n hostgroup_name db\n members alpha\n}\n")
+
+		session = nagctl.Session({"config":os.path.join(self.dir, "main.cfg"), "cache_dir":self.cache})
+		session.loadConfig()
+		session.expandHostgroups(session.hosts)
+		self.assertEqual(session.updateAssignment(session.readCache("assign")), None)
+
+		self.assertEqual(self.pairs(self.cache)[1], [("alpha", "http"), ("alpha", "sql")])
+
+
+class Session_updateConfig(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		self.writeFile("main.cfg", "cfg_dir=%s\n" % (os.path.join(self.dir, "objects")))
+		os.mkdir(os.path.join(self.dir, "objects"))
+		self.writeFile("objects/templates.cfg", "define host {\n name generic\n hostgroups web\n register 0\n}\n")
+		self.writeFile("objects/hosts.cfg", "define host {\n host_name alpha\n use generic\n}\n")
+		self.writeFile("objects/other.cfg", "define host {\n host_name beta\n hostgroups db\n}\n")
+		self.writeFile("objects/services.cfg", "define service {\n service_description http\n hostgroup_name web\n}\ndefine service {\n service_description sql\n hostgroup_name db\n}\n")
+		self.session = nagctl.Session({"config":os.path.join(self.dir, "main.cfg")})
+		self.session.loadConfig()
+
+	def pairs(self, session):
+		return sorted([(h.getName(), s.getName()) for (h, s) in session.select("service")])
+
+	def fresh(self):
+		session = nagctl.Session({"config":os.path.join(self.dir, "main.cfg")})
+		session.loadConfig()
+		return session
+
+	def test_updateConfig_unchanged(self):
+		"""updateConfig: read nothing when files did not change"""
+
+		self.assertEqual(self.session.updateConfig(), 0)
+
+	def test_updateConfig_changed(self):
+		"""updateConfig: read only changed files"""
+
+		self.pairs(self.session)
+		self.writeFile("objects/other.cfg", "define host {\n host_name beta\n hostgroups db, web\n}\ndefine host {\n host_name gamma\n hostgroups db\n}\n")
+
+		self.assertEqual(self.session.updateConfig(), 1)
+		self.assertEqual(self.pairs(self.session), self.pairs(self.fresh()))
+		self.assertEqual([h.getName() for h in self.session.hosts], [h.getName() for h in self.fresh().hosts])
+
+	def test_updateConfig_template(self):
+		"""updateConfig: read again files using changed templates"""
+
+		self.assertEqual(self.pairs(self.session), [("alpha", "http"), ("beta", "sql")])
+		self.writeFile("objects/templates.cfg", "define host {\n name generic\n hostgroups db\n register 0\n}\n")
+
+		self.assertEqual(self.session.updateConfig(), 2)
+		self.assertEqual(self.pairs(self.session), [("alpha", "sql"), ("beta", "sql")])
+
+	def test_updateConfig_removed(self):
+		"""updateConfig: forget objects from removed files"""
+
+		os.unlink(os.path.join(self.dir, "objects/other.cfg"))
+
+		self.assertEqual(self.session.updateConfig(), 1)
+		self.assertEqual(self.pairs(self.session), [("alpha", "http")])
+
+	def test_updateConfig_removed_index(self):
+		"""updateConfig: rebuild indexes after removing files"""
+
+		self.writeFile("objects/other.cfg", "define host {\n host_name beta\n parents alpha\n hostgroups db\n}\n")
+		self.session.updateConfig()
+		self.assertEqual([h.getName() for h in self.session.getChildren()["alpha"]], ["beta"])
+		os.unlink(os.path.join(self.dir, "objects/other.cfg"))
+
+		self.assertEqual(self.session.updateConfig(), 1)
+		self.assertFalse("alpha" in self.session.getChildren())
+
+
+class Session_walkDir(TempDirTestCase):
+	def setUp(self):
+		import tempfile
+
+		TempDirTestCase.setUp(self)
+		self.cache = tempfile.mkdtemp()
+		for name in ("a", "a/b", "c"):
+			os.mkdir(os.path.join(self.dir, name))
+		for name in ("one.cfg", "a/two.cfg", "a/b/three.cfg", "c/four.cfg", "c/.hidden.cfg", "c/readme.txt"):
+			open(os.path.join(self.dir, name), "w").close()
+		self.session = nagctl.Session({"cache_dir":self.cache, "config":os.path.join(self.dir, "nagios.cfg")})
+
+	def tearDown(self):
+		import shutil
+
+		shutil.rmtree(self.cache)
+		TempDirTestCase.tearDown(self)
+
+	def walk(self, session, dir):
+		return sorted([os.path.relpath(p, self.dir) for p in session.findFiles(dir)])
+
+	def test_walkDir_files(self):
+		"""walkDir: find non-hidden object files in all subdirectories"""
+
+		self.assertEqual(self.walk(self.session, self.dir), ["a/b/three.cfg", "a/two.cfg", "c/four.cfg", "one.cfg"])
+
+	def test_walkDir_missing(self):
+		"""walkDir: find no files in a missing directory"""
+
+		self.assertEqual(self.session.walkDir(os.path.join(self.dir, "missing")), [])
+
+	def test_walkDir_manifest(self):
+		"""walkDir: list again only directories that changed"""
+
+		self.session.conf["cfg_dir"] = [self.dir]
+		self.session.findObjectFiles()
+		open(os.path.join(self.dir, "a/five.cfg"), "w").close()
+		st = os.stat(os.path.join(self.dir, "a"))
+		os.utime(os.path.join(self.dir, "a"), (st.st_atime, st.st_mtime + 10))
+
+		listed = []
+		listDir = nagctl.listDir
+		def function(dir):
+			listed.append(dir)
+			return listDir(dir)
+		nagctl.listDir = function
+		try:
+			# A new session reads the manifest from cache directory.
+			session = nagctl.Session(self.session.conf)
+			self.assertEqual(self.walk(session, self.dir), ["a/b/three.cfg", "a/five.cfg", "a/two.cfg", "c/four.cfg", "one.cfg"])
+		finally:
+			nagctl.listDir = listDir
+		self.assertEqual(listed, [os.path.join(self.dir, "a")])
+
+	def test_findObjectFiles_duplicates(self):
+		"""findObjectFiles: read files reachable through many paths once"""
+
+		os.symlink(os.path.join(self.dir, "one.cfg"), os.path.join(self.dir, "link.cfg"))
+		self.session.conf["cfg_dir"] = [self.dir]
+		self.session.conf["cfg_file"] = [os.path.join(self.dir, "a/two.cfg"), os.path.join(self.dir, "missing.cfg")]
+
+		files = [os.path.relpath(p, self.dir) for p in self.session.findObjectFiles()]
+		# Only one of the paths to the linked file is kept.
+		self.assertEqual(len(set(files) & set(["one.cfg", "link.cfg"])), 1)
+		self.assertEqual(sorted(set(files) - set(["one.cfg", "link.cfg"])), ["a/b/three.cfg", "a/two.cfg", "c/four.cfg", "missing.cfg"])
+		self.assertEqual(len(files), 5)
+
+
+class Session_profile(unittest.TestCase):
+	def setUp(self):
+		self.session = nagctl.Session({"config":"main.cfg", "profile":True})
+
+	def test_startPhase_disabled(self):
+		"""startPhase: measure nothing when not profiling"""
+
+		session = nagctl.Session({"config":"main.cfg"})
+		session.loadConfig()
+		session.select("all")
+		self.assertEqual(session.startPhase("test"), None)
+		self.assertEqual(session.profile["phases"].keys(), [])
+
+	def test_endPhase_nested(self):
+		"""endPhase: do not count time of nested phases twice"""
+
+		import time
+
+		outer = self.session.startPhase("outer")
+		inner = self.session.startPhase("inner")
+		time.sleep(0.05)
+		self.session.endPhase(inner)
+		self.session.endPhase(outer)
+
+		phases = self.session.profile["phases"]
+		self.assertTrue(phases["inner"][1] >= 0.05)
+		self.assertTrue(phases["outer"][1] < 0.05)
+		self.assertEqual(self.session.profile["stack"], [])
+
+	def test_profile_phases(self):
+		"""printProfile: report every phase and object counters"""
+
+		import StringIO
+
+		self.session.loadConfig()
+		self.session.select("all")
+
+		saved = sys.stderr
+		sys.stderr = StringIO.StringIO()
+		try:
+			self.session.printProfile()
+			output = sys.stderr.getvalue()
+		finally:
+			sys.stderr = saved
+
+		self.assertEqual(self.session.profile["phases"].keys(), ["parseConfig", "discovery", "parseFile", "templates", "hostgroups", "matching"])
+		self.assertEqual(self.session.profile["phases"]["parseFile"][0], 6)
+		self.assertEqual(self.session.profile["counters"]["pairs tested"], 30)
+		self.assertEqual(self.session.profile["counters"]["pairs matched"], 14)
+		self.assertTrue("peak RSS" in output)
+		self.assertTrue("lines" in output)
+
+	def test_parseArguments(self):
+		"""parseArguments: accept profiling options"""
+
+		(options, _) = self.session.parseArguments(["--profile-out", "run.prof", "search", "all"])
+		self.assertEqual(options["profile_out"], "run.prof")
+		self.assertTrue(options["profile"])
+
+
+class Session_metrics(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		self.path = os.path.join(self.dir, "nagctl.prom")
+		self.session = nagctl.Session({"config":"main.cfg", "metrics_file":self.path, "dry-run":True, "verbose":0})
+
+	def tearDown(self):
+		TempDirTestCase.tearDown(self)
+		if os.path.exists("nagios.cmd"):
+			os.unlink("nagios.cmd")
+
+	def readMetrics(self):
+		fh = open(self.path, "r")
+		try:
+			return [l for l in fh.read().splitlines() if l[0] != "#"]
+		finally:
+			fh.close()
+
+	def test_writeMetrics(self):
+		"""writeMetrics: write phases, objects and commands by name"""
+
+		nagctl.runArguments(self.session, ["disable", "all", "notifications"])
+
+		metrics = self.readMetrics()
+		self.assertTrue("nagctl_success 1" in metrics)
+		self.assertTrue('nagctl_objects{kind="hosts"} 6' in metrics)
+		self.assertTrue('nagctl_commands_generated{command="DISABLE_HOST_NOTIFICATIONS"} 4' in metrics)
+		self.assertTrue('nagctl_commands_generated{command="DISABLE_SVC_NOTIFICATIONS"} 14' in metrics)
+		self.assertTrue(len([l for l in metrics if l.startswith('nagctl_phase_seconds{phase="parseFile"}')]) == 1)
+		# No temporary files are left behind.
+		self.assertEqual(os.listdir(self.dir), ["nagctl.prom"])
+
+	def test_writeMetrics_failed(self):
+		"""writeMetrics: report failed runs"""
+
+		self.assertRaises(nagctl.NagctlError, nagctl.runArguments, self.session, ["bogus", "all"])
+		self.assertTrue("nagctl_success 0" in self.readMetrics())
+
+	def test_writeMetrics_batch(self):
+		"""writeMetrics: count failed batch lines"""
+
+		self.assertRaises(SystemExit, nagctl.runArguments, self.session, ["batch", "batch.txt"])
+		metrics = self.readMetrics()
+		self.assertTrue("nagctl_success 0" in metrics)
+		self.assertTrue("nagctl_failures 1" in metrics)
+
+	def test_startPhase_metrics(self):
+		"""startPhase: measure phases when metrics are requested"""
+
+		self.assertFalse(self.session.startPhase("test") is None)
+
+
+class Generate(TempDirTestCase):
+	def load(self, dir, param):
+		import generate
+
+		session = nagctl.Session({"config":generate.generateConfig(dir, param)})
+		session.loadConfig()
+		return session
+
+	def test_generateConfig(self):
+		"""generateConfig: write a configuration nagctl can load"""
+
+		import generate
+
+		session = self.load(self.dir, dict(generate.defaults, hosts = 100, groups = 5, files = 7))
+		self.assertEqual(len(session.hosts), 100)
+		self.assertEqual(len(session.hostgroups), 5)
+		self.assertEqual(len(session.files), 7)
+		self.assertEqual(len(session.host_tmpl), 3)
+		# Hosts inherit parameters through the whole template chain.
+		self.assertEqual(session.hosts[0].inheritTemplates()["notes"], "level 2")
+		self.assertTrue(len(session.select("service")) > 100)
+
+	def test_generateConfig_deterministic(self):
+		"""generateConfig: generate the same configuration every time"""
+
+		import generate
+
+		param = dict(generate.defaults, hosts = 50, groups = 5)
+		first = self.load(os.path.join(self.dir, "first"), param)
+		second = self.load(os.path.join(self.dir, "second"), param)
+		self.assertEqual([(h.getName(), s.getName()) for (h, s) in first.select("service")], [(h.getName(), s.getName()) for (h, s) in second.select("service")])
+
+
+class Equivalence(unittest.TestCase):
+	def test_engines(self):
+		"""findMismatch: give the same results with every engine"""
+
+		import equivalence
+
+		names = [name for (name, _) in equivalence.engines]
+		for seed in range(0, 30):
+			files = equivalence.randomConfig(seed)
+			self.assertEqual(equivalence.findMismatch(files, equivalence.getBase(files, seed), names), None)
+
+	def test_shrinkConfig(self):
+		"""shrinkConfig: reduce mismatching configuration to a minimal one"""
+
+		import equivalence
+
+		def broken(dir, files, base):
+			# An engine that loses one of the hosts.
+			result = equivalence.engineReference(dir, files, base)[0]
+			result["hosts"] = [h for h in result["hosts"] if h[0] != "gamma"]
+			return [result]
+
+		files = {
+			"hosts.cfg" : ["define host {", "host_name\tgamma", "hostgroups\tdb", "}", "define host {", "host_name\talpha", "}"],
+			"services.cfg" : ["define service {", "service_description\tCPU", "hostgroup_name\tdb", "}", "# comment"]
+		}
+		saved = equivalence.engines
+		equivalence.engines = (("broken", broken),)
+		try:
+			self.assertFalse(equivalence.findMismatch(files, files, ["broken"]) is None)
+			(files, base) = equivalence.shrinkConfig(files, files, ["broken"])
+		finally:
+			equivalence.engines = saved
+
+		self.assertEqual(files["hosts.cfg"], ["define host {", "host_name\tgamma", "hostgroups\tdb", "}"])
+		self.assertEqual(files["services.cfg"], ["define service {", "service_description\tCPU", "hostgroup_name\tdb", "}"])
+
+
+class Session_spreadChecks(unittest.TestCase):
+	def setUp(self):
+		self.session = nagctl.Session()
+		self.host = nagctl.Host({"host_name":"worker0", "check_interval":"2"})
+		self.objects = [(self.host, None)]
+		for i in range(0, 5):
+			self.objects.append((self.host, nagctl.Service({"service_description":"queue%u" % (i), "check_interval":"0.5"})))
+
+	def test_spreadChecks_none(self):
+		"""spreadChecks: schedule every check at the same time by default"""
+
+		self.assertEqual(self.session.spreadChecks(self.objects, 1000), [1000] * 6)
+
+	def test_spreadChecks_even(self):
+		"""spreadChecks: distribute checks evenly over spread time"""
+
+		self.session.conf["spread"] = "60"
+		self.assertEqual(self.session.spreadChecks(self.objects, 1000), [1000, 1010, 1020, 1030, 1040, 1050])
+
+	def test_spreadChecks_hash(self):
+		"""spreadChecks: place checks by hash of their names"""
+
+		self.session.conf["spread"] = "60"
+		self.session.conf["spread_hash"] = True
+		times = self.session.spreadChecks(self.objects, 1000)
+		# The same object gets the same time regardless of other objects.
+		self.assertEqual(self.session.spreadChecks(self.objects[3:], 1000), times[3:])
+		self.assertTrue(min(times) >= 1000 and max(times) < 1060)
+		self.assertTrue(len(set(times)) > 1)
+
+	def test_spreadChecks_interval(self):
+		"""spreadChecks: spread every check over its check interval"""
+
+		self.session.conf["spread_interval"] = True
+		self.session.conf["interval_length"] = "10"
+		self.assertEqual(self.session.spreadChecks(self.objects, 1000), [1000, 1000, 1001, 1002, 1003, 1004])
+
+	def test_spreadChecks_rate(self):
+		"""spreadChecks: schedule no more checks in a second than rate"""
+
+		self.session.conf["rate"] = "2"
+		self.assertEqual(self.session.spreadChecks(self.objects, 1000), [1000, 1000, 1001, 1001, 1002, 1002])
+		self.session.conf["rate"] = "none"
+		self.assertRaises(nagctl.NagctlError, self.session.spreadChecks, self.objects, 1000)
+
+
+class Session_stats(unittest.TestCase):
+	def setUp(self):
+		self.session = nagctl.Session({"interval_length":"60"})
+		tmpl = self.session.service_tmpl
+		tmpl["generic"] = nagctl.Service({"name":"generic", "check_interval":"1", "retry_interval":"0.5"}, tmpl)
+		tmpl["frequent"] = nagctl.Service({"name":"frequent", "use":"generic", "check_interval":"0.5"}, tmpl)
+		self.session.hosts.append(nagctl.Host({"host_name":"web0", "hostgroups":"web", "check_command":"check-host-alive"}, self.session.host_tmpl))
+		self.session.hosts.append(nagctl.Host({"host_name":"web1", "hostgroups":"web", "active_checks_enabled":"0"}, self.session.host_tmpl))
+		self.session.services.append(nagctl.Service({"service_description":"HTTP", "hostgroup_name":"web", "use":"frequent", "check_command":"check_http!80"}, tmpl))
+		self.session.services.append(nagctl.Service({"service_description":"load", "hostgroup_name":"web", "use":"generic", "check_command":"check_load!5!10"}, tmpl))
+
+	def test_getCheckRate(self):
+		"""getCheckRate: compute checks per second from inherited intervals"""
+
+		self.assertEqual(self.session.getCheckRate(self.session.services[0]), (1 / 30.0, 1 / 30.0))
+		self.assertEqual(self.session.getCheckRate(self.session.hosts[0]), (1 / 300.0, 1 / 60.0))
+		self.assertEqual(self.session.getCheckRate(self.session.hosts[1]), (0.0, 0.0))
+
+	def test_getTemplates(self):
+		"""getTemplates: return every template an object inherits from"""
+
+		self.assertEqual(self.session.getTemplates(self.session.services[0], self.session.service_tmpl), ["frequent", "generic"])
+
+	def test_reportStats(self):
+		"""reportStats: print checks per second by group"""
+
+		import StringIO
+
+		saved = sys.stdout
+		sys.stdout = StringIO.StringIO()
+		try:
+			self.assertEqual(self.session.reportStats(["stats"], "all"), [])
+			output = sys.stdout.getvalue().splitlines()
+		finally:
+			sys.stdout = saved
+
+		self.assertEqual(output[0], "Objects: 6 (4 service instances)")
+		# Two HTTP and two load services and one host check.
+		self.assertEqual(output[1], "Checks per second: %.3f (%.3f when all are retrying)" % (2 / 30.0 + 2 / 60.0 + 1 / 300.0, 4 / 30.0 + 1 / 60.0))
+		self.assertTrue("     0.067      0.067          2          2  check_http" in output)
+		self.assertTrue("     0.100      0.133          4          4  generic" in output)
+
+
+class Session_propagate(unittest.TestCase):
+	def setUp(self):
+		self.session = nagctl.Session({"propagate":True})
+		tmpl = self.session.host_tmpl
+		tmpl["behind-core"] = nagctl.Host({"name":"behind-core", "parents":"core"}, tmpl)
+		for (name, param) in (("core", {}), ("switch0", {"use":"behind-core"}), ("switch1", {"use":"behind-core"}),
+			("server0", {"parents":"switch0"}), ("server1", {"parents":"switch0, switch1", "hostgroups":"web"}), ("other", {})):
+			self.session.hosts.append(nagctl.Host(dict(param, host_name = name), tmpl))
+		self.session.services.append(nagctl.Service({"service_description":"HTTP", "hostgroup_name":"web"}, self.session.service_tmpl))
+		self.session.services.append(nagctl.Service({"service_description":"ping", "host_name":"other, core"}, self.session.service_tmpl))
+
+	def names(self, hosts):
+		return [h.getName() for h in hosts]
+
+	def test_getParents(self):
+		"""getParents: return parent host names including inherited ones"""
+
+		self.assertEqual(self.session.hosts[1].getParents(), ["core"])
+		self.assertEqual(self.session.hosts[4].getParents(), ["switch0", "switch1"])
+		self.assertEqual(self.session.hosts[0].getParents(), [])
+
+	def test_getSubtree(self):
+		"""getSubtree: return every host behind given ones once"""
+
+		(subtree, tops) = self.session.getSubtree([self.session.hosts[0]])
+		self.assertEqual(self.names(subtree), ["core", "switch0", "switch1", "server0", "server1"])
+		self.assertEqual(self.names(tops), ["core"])
+
+		# Hosts behind other given hosts are not subtree roots.
+		(subtree, tops) = self.session.getSubtree([self.session.hosts[3], self.session.hosts[1]])
+		self.assertEqual(self.names(subtree), ["server0", "switch0", "server1"])
+		self.assertEqual(self.names(tops), ["switch0"])
+
+	def test_scheduleDowntime_propagate(self):
+		"""scheduleDowntime: schedule propagated downtime for subtree roots"""
+
+		self.session.conf["host"] = "core|switch1"
+		commands = [c.split(";") for c in self.session.scheduleDowntime(["schedule", "downtime", "3600", "core"], "all")]
+		self.assertEqual([c[0:2] for c in commands], [["SCHEDULE_AND_PROPAGATE_HOST_DOWNTIME", "core"], ["SCHEDULE_SVC_DOWNTIME", "core"], ["SCHEDULE_SVC_DOWNTIME", "server1"]])
+		self.assertEqual(commands[0][4:], ["1", "0", "3600", "nagctl", "core"])
+
+	def test_scheduleDowntime_propagate_service(self):
+		"""scheduleDowntime: schedule downtime for services behind matching hosts"""
+
+		self.session.conf["host"] = "switch1"
+		commands = [c.split(";")[0:3] for c in self.session.scheduleDowntime(["schedule", "downtime", "3600", "switch"], "service")]
+		self.assertEqual(commands, [["SCHEDULE_SVC_DOWNTIME", "server1", "HTTP"]])
+
+
+class Session_impact(SessionTestCase):
+	def setUp(self):
+		self.session = nagctl.Session({"impact":True})
+		self.session.parseFile("dependencies.cfg")
+
+	def test_parseFile_dependencies(self):
+		"""parseFile: read dependencies and their templates"""
+
+		self.assertEqual([d.getKind() for d in self.session.dependencies], ["servicedependency"] * 3 + ["hostdependency"])
+		self.assertEqual(self.session.dependency_tmpl["servicedependency"].keys(), ["mysql-dependency"])
+		self.assertEqual(self.session.dependencies[0].getSelector("service_description"), (["mysql"], []))
+
+	def test_getDependents(self):
+		"""getDependents: link masters through dependencies to dependents"""
+
+		graph = self.session.getDependents()
+		self.assertEqual(graph[("db-master", "mysql")], [0, 1])
+		self.assertEqual(graph[1], [("app0", "checkout"), ("app1", "checkout")])
+		self.assertEqual(graph[("app0", "checkout")], [("app0", "HTTP")])
+		self.assertEqual(graph["app1"], [3])
+
+	def test_expandImpact_service(self):
+		"""expandImpact: select services that depend on matching ones"""
+
+		self.session.conf["host"] = "db-master"
+		self.session.conf["service"] = "mysql"
+		self.assertEqual(self.selected(self.session, "service"), [("db-master", "mysql"), ("db-replica", "replication"), ("app0", "checkout"), ("app0", "HTTP"), ("app1", "checkout"), ("app1", "HTTP")])
+
+	def test_expandImpact_host(self):
+		"""expandImpact: select hosts that depend on matching ones and their services"""
+
+		self.session.conf["host"] = "app1"
+		self.assertEqual(self.selected(self.session, "all"), [("app1", None), ("cache0", None), ("app1", "checkout"), ("app1", "HTTP"), ("cache0", "HTTP")])
+
+	def test_expandImpact_disabled(self):
+		"""selectObjects: do not follow dependencies unless asked to"""
+
+		self.session.conf["impact"] = False
+		self.session.conf["host"] = "app1"
+		self.assertEqual(self.selected(self.session, "host"), [("app1", None)])
+
+
+class Session_servicegroups(SessionTestCase):
+	def setUp(self):
+		self.session = nagctl.Session()
+		self.session.parseFile("servicegroups.cfg")
+
+	def test_parseFile_servicegroups(self):
+		"""parseFile: read servicegroups with members and nested groups"""
+
+		groups = self.session.servicegroups
+		self.assertEqual([g.getName() for g in groups], ["frontend", "backend", "everything"])
+		self.assertEqual(groups[0].getMembers(), [("web0", "load"), ("web1", "load"), ("nonexisting", "load")])
+		self.assertEqual(groups[2].getGroups(), ["frontend", "backend"])
+
+	def test_getServicegroupIndex(self):
+		"""getServicegroupIndex: index service instances by servicegroup"""
+
+		index = self.session.getServicegroupIndex()
+		# Services listing the group come before members the group lists.
+		self.assertEqual(index["frontend"], [("web0", "HTTP"), ("web1", "HTTP"), ("web0", "load"), ("web1", "load")])
+		self.assertEqual(index["backend"], [("db0", "mysql")])
+		self.assertEqual(len(index["everything"]), 5)
+
+	def test_selectObjects_servicegroup(self):
+		"""selectObjects: match only members of selected servicegroups"""
+
+		self.session.conf["servicegroup"] = "back.*"
+		self.assertEqual(self.selected(self.session, "all"), [("db0", None), ("db0", "mysql")])
+
+	def test_compressCommands_whole(self):
+		"""runCommand: use servicegroup commands for whole groups"""
+
+		self.session.conf["servicegroup"] = "frontend"
+		commands = self.session.runCommand(self.session.toggleNotifications, ["disable", "notifications"], "all")
+		self.assertEqual(commands, ["DISABLE_SERVICEGROUP_HOST_NOTIFICATIONS;frontend", "DISABLE_SERVICEGROUP_SVC_NOTIFICATIONS;frontend"])
+
+		commands = self.session.runCommand(self.session.scheduleDowntime, ["schedule", "downtime", "60", "maintenance"], "service")
+		self.assertEqual(len(commands), 1)
+		self.assertTrue(commands[0].startswith("SCHEDULE_SERVICEGROUP_SVC_DOWNTIME;frontend;"))
+		self.assertTrue(commands[0].endswith(";1;0;60;nagctl;maintenance"))
+
+	def test_compressCommands_partial(self):
+		"""runCommand: keep commands for every object of partly selected groups"""
+
+		self.session.conf["servicegroup"] = "frontend"
+		self.session.conf["host"] = "web0"
+		commands = self.session.runCommand(self.session.toggleChecks, ["disable", "checks"], "service")
+		self.assertEqual(commands, ["DISABLE_SVC_CHECK;web0;HTTP", "DISABLE_SVC_CHECK;web0;load"])
+
+
+class Session_contacts(SessionTestCase):
+	def setUp(self):
+		self.session = nagctl.Session()
+		self.session.parseFile("contacts.cfg")
+
+	def test_parseFile_contacts(self):
+		"""parseFile: read contacts, contact templates and contactgroups"""
+
+		self.assertEqual([c.getName() for c in self.session.contacts], ["alice", "bob", "carol"])
+		self.assertEqual(self.session.contact_tmpl.keys(), ["generic-contact"])
+		self.assertEqual([g.getName() for g in self.session.contactgroups], ["oncall", "dba", "ops"])
+
+	def test_getContactgroupMembers(self):
+		"""getContactgroupMembers: expand nested groups and contact memberships"""
+
+		members = self.session.getContactgroupMembers()
+		self.assertEqual(members["oncall"], ["alice"])
+		self.assertEqual(members["dba"], ["bob", "carol"])
+		self.assertEqual(members["ops"], ["alice", "bob", "carol"])
+
+	def test_getContactIndex(self):
+		"""getContactIndex: index hosts and services by notified contact"""
+
+		index = self.session.getContactIndex()
+		self.assertEqual(index["alice"], (set(["web0"]), set([("web0", "HTTP"), ("db0", "mysql")])))
+		# Services without contacts inherit them from their host.
+		self.assertEqual(index["carol"], (set(["db0"]), set([("web0", "disk"), ("db0", "disk")])))
+
+	def test_selectObjects_contact(self):
+		"""selectObjects: match only objects notifying selected contact"""
+
+		self.session.conf["contact"] = "alice"
+		self.assertEqual(self.selected(self.session, "all"), [("web0", None), ("web0", "HTTP"), ("db0", "mysql")])
+
+	def test_scheduleDowntime_propagate(self):
+		"""scheduleDowntime: propagate downtime only from selected hosts"""
+
+		self.session.conf["contact"] = "alice"
+		self.session.conf["propagate"] = True
+		commands = [c.split(";") for c in self.session.scheduleDowntime(["schedule", "downtime", "60", "maintenance"], "all")]
+		self.assertEqual([c[0:2] for c in commands], [["SCHEDULE_AND_PROPAGATE_HOST_DOWNTIME", "web0"], ["SCHEDULE_SVC_DOWNTIME", "web0"]])
+		self.assertEqual(commands[1][2], "HTTP")
+
+		self.session.selection = (nagctl.ObjectLink(), set())
+		self.assertRaises(nagctl.NagctlError, self.session.scheduleDowntime, ["schedule", "downtime", "60", "maintenance"], "host")
+
+	def test_selectObjects_contactgroup(self):
+		"""selectObjects: match only objects notifying contactgroup members"""
+
+		self.session.conf["contactgroup"] = "dba"
+		self.session.conf["host"] = "web0"
+		self.assertEqual(self.selected(self.session, "all"), [("web0", "disk")])
+
+		self.session.conf["contactgroup"] = "nonexisting"
+		self.assertRaises(nagctl.NagctlError, self.selected, self.session, "all")
+
+
+class Session_complete(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		self.session = nagctl.Session({"config":"main.cfg", "cache_dir":self.dir, "verbose":0})
+		self.session.loadConfig()
+
+	def test_writeNames(self):
+		"""writeNames: write sorted name index on load"""
+
+		fh = open(self.session.getCachePath("names"), "r")
+		try:
+			lines = fh.read().splitlines()
+		finally:
+			fh.close()
+		self.assertEqual(lines[0], "# %s" % (self.session.getCacheKey()))
+		self.assertEqual(lines[1:], sorted(lines[1:]))
+		self.assertTrue("host\tworker0" in lines)
+
+	def test_writeNames_unchanged(self):
+		"""writeNames: keep name index while configuration doesn't change"""
+
+		path = self.session.getCachePath("names")
+		os.utime(path, (0, 0))
+		self.session.writeNames()
+		self.assertEqual(os.stat(path).st_mtime, 0)
+
+	def test_completeName(self):
+		"""completeName: return names of a kind starting with prefix"""
+
+		session = nagctl.Session({"config":"main.cfg", "cache_dir":self.dir})
+		hosts = session.completeName("host")
+		self.assertEqual(hosts, sorted(set([h.getName() for h in self.session.hosts])))
+		self.assertEqual(session.completeName("host", "work"), [h for h in hosts if h.startswith("work")])
+		self.assertEqual(session.completeName("host", "nonexisting"), [])
+		# Nothing but the index was read.
+		self.assertEqual(session.hosts, [])
+		self.assertRaises(nagctl.NagctlError, session.completeName, "bogus", "")
+
+	def test_runArguments_complete(self):
+		"""runArguments: print completed names"""
+
+		import StringIO
+
+		session = nagctl.Session({"config":"main.cfg", "cache_dir":self.dir})
+		saved = sys.stdout
+		sys.stdout = StringIO.StringIO()
+		try:
+			nagctl.runArguments(session, ["complete", "host", "data"])
+			output = sys.stdout.getvalue()
+		finally:
+			sys.stdout = saved
+		self.assertEqual(output, "database0\ndatabase1\n")
+
+
+class Session_sqlite(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		self.path = os.path.join(self.dir, "nagctl.db")
+		self.session = nagctl.Session({"config":"main.cfg", "verbose":0})
+		self.session.loadConfig()
+		self.session.exportSqlite(self.path)
+
+	def test_exportSqlite(self):
+		"""exportSqlite: write resolved objects into indexed tables"""
+
+		import sqlite3
+
+		db = sqlite3.connect(self.path)
+		try:
+			self.assertEqual(db.execute("SELECT COUNT(*) FROM hosts").fetchone()[0], len(self.session.hosts))
+			self.assertEqual(db.execute("SELECT COUNT(*) FROM services").fetchone()[0], len(self.session.services))
+			self.assertEqual(db.execute("SELECT COUNT(*) FROM assignment").fetchone()[0], 14)
+			# Hosts with a resolved parameter value.
+			names = db.execute("SELECT h.name FROM hosts h JOIN host_hostgroups g ON g.host_id = h.id WHERE g.hostgroup = 'databases' ORDER BY h.name").fetchall()
+			self.assertEqual(names, [("database0",), ("database1",), ("universe",)])
+			indexes = [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+			self.assertTrue("params_key" in indexes)
+		finally:
+			db.close()
+		# No temporary files are left behind.
+		self.assertEqual(os.listdir(self.dir), ["nagctl.db"])
+
+	def test_loadDatabase(self):
+		"""loadDatabase: select the same objects as configuration files"""
+
+		session = nagctl.Session({"config":"nonexisting.cfg", "db":self.path, "verbose":0})
+		session.loadConfig()
+		self.assertEqual(self.selected(session), self.selected(self.session))
+		self.assertEqual(session.conf["command_file"], "nagios.cmd")
+
+		session.conf["host"] = "worker.*"
+		session.conf["service"] = "CPU"
+		self.session.conf["host"] = "worker.*"
+		self.session.conf["service"] = "CPU"
+		self.assertEqual(self.selected(session), self.selected(self.session))
+
+	def test_loadDatabase_select(self):
+		"""loadDatabase: read only hosts and services matching names"""
+
+		for (host, service) in (("worker.*", "CPU"), ("worker.*", None), (None, "CPU"), ("nonexisting", None)):
+			session = nagctl.Session({"config":"nonexisting.cfg", "db":self.path, "host":host, "service":service, "verbose":0})
+			session.loadConfig(True)
+			self.session.conf["host"] = host
+			self.session.conf["service"] = service
+			self.assertEqual(self.selected(session), self.selected(self.session))
+			self.assertEqual(len(session.hosts), len([h for h in self.session.hosts if h.matchName(host)]))
+			self.assertEqual(len(session.services), len([s for s in self.session.services if s.matchName(service)]))
+			self.assertTrue(session.partial)
+
+		# Selectors needing every object still read all of them.
+		session = nagctl.Session({"config":"nonexisting.cfg", "db":self.path, "host":"worker.*", "impact":True, "verbose":0})
+		session.loadConfig(True)
+		self.assertEqual(len(session.hosts), len(self.session.hosts))
+		self.assertFalse(session.partial)
+
+	def test_loadDatabase_selectors(self):
+		"""loadDatabase: select by servicegroup, contact and impact like configuration files"""
+
+		for (file, options) in (("servicegroups.cfg", {"servicegroup":"everything"}), ("contacts.cfg", {"contact":"alice"}), ("contacts.cfg", {"contactgroup":"ops"}), ("dependencies.cfg", {"host":"db-master", "impact":True})):
+			source = nagctl.Session({"verbose":0})
+			source.parseFile(file)
+			source.exportSqlite(self.path)
+			session = nagctl.Session({"config":"nonexisting.cfg", "db":self.path, "verbose":0})
+			session.loadConfig()
+			source.conf.update(options)
+			session.conf.update(options)
+			self.assertEqual(self.selected(session), self.selected(source))
+			self.assertTrue(len(self.selected(session)) > 1)
+
+	def test_loadDatabase_missing(self):
+		"""loadDatabase: fail when database doesn't exist"""
+
+		session = nagctl.Session({"db":os.path.join(self.dir, "nonexisting.db")})
+		self.assertRaises(nagctl.NagctlError, session.loadConfig)
+
+
+class Session_selection(TempDirTestCase):
+	def newSession(self, **options):
+		return nagctl.Session(dict(options, config = "main.cfg", selection_dir = self.dir, verbose = 0))
+
+	def test_saveSelection(self):
+		"""saveSelection: reuse selected objects without reading configuration"""
+
+		session = self.newSession(host = "database0", save_selection = "maintenance")
+		session.loadConfig()
+		expected = self.selected(session, "all")
+		groups = [h for h in session.hosts if h.getName() == "database0"][0]._hostgroup
+		self.assertEqual(os.listdir(self.dir), ["maintenance"])
+
+		session = self.newSession(selection = "maintenance")
+		session.conf["config"] = "nonexisting.cfg"
+		session.loadConfig()
+		self.assertEqual(self.selected(session, "all"), expected)
+		self.assertEqual(self.selected(session, "host"), [("database0", None)])
+		self.assertEqual(session.conf["command_file"], "nagios.cmd")
+		self.assertEqual(session.hosts[0]._hostgroup, groups)
+
+	def test_saveSelection_services(self):
+		"""saveSelection: keep hosts saved only for their services out of host scope"""
+
+		session = self.newSession(service = "CPU", save_selection = "cpu")
+		session.loadConfig()
+		expected = self.selected(session, "service")
+
+		session = self.newSession(selection = "cpu")
+		session.loadConfig()
+		self.assertEqual(self.selected(session, "all"), expected)
+		self.assertEqual(self.selected(session, "host"), [])
+
+		session.conf["host"] = "database.*"
+		self.assertEqual(self.selected(session, "service"), [p for p in expected if p[0].startswith("database")])
+
+	def test_saveSelection_origins(self):
+		"""saveSelection: keep files and places objects are defined in"""
+
+		session = self.newSession(save_selection = "origins")
+		session.loadConfig()
+		objects = session.matchObjects()
+		expected = [(h._origin, [s._origin for s in objects.getServiceList(i)]) for (i, h) in enumerate(objects.getHostList())]
+		session.selectObjects(objects, "all")
+
+		session = self.newSession(selection = "origins")
+		session.loadConfig()
+		objects = session.matchObjects()
+		self.assertEqual([(h._origin, [s._origin for s in objects.getServiceList(i)]) for (i, h) in enumerate(objects.getHostList())], expected)
+
+	def test_loadSelection_invalid(self):
+		"""loadSelection: fail on missing selections and invalid names"""
+
+		session = self.newSession(selection = "nonexisting")
+		self.assertRaises(nagctl.NagctlError, session.loadConfig)
+		session = self.newSession(selection = "../main.cfg")
+		self.assertRaises(nagctl.NagctlError, session.loadConfig)
+
+
+class Session_archive(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		# Every file main configuration mentions, found on disk.
+		session = nagctl.Session({"config":"main.cfg", "verbose":0})
+		session.parseConfig()
+		self.files = ["main.cfg"] + session.conf["cfg_file"]
+		for dir in session.conf["cfg_dir"]:
+			for (path, dirs, names) in os.walk(dir):
+				self.files.extend([os.path.join(path, n) for n in names])
+
+	def pairs(self, session):
+		objects = session.matchObjects()
+		return sorted([(h.getName(), sorted([s.getName() for s in objects.getServiceList(i)])) for (i, h) in enumerate(objects.getHostList())])
+
+	def expected(self):
+		session = nagctl.Session({"config":"main.cfg", "verbose":0})
+		session.loadConfig()
+		return self.pairs(session)
+
+	def test_loadConfig_tar(self):
+		"""loadConfig: read configuration from a compressed tar archive"""
+
+		import tarfile
+
+		path = os.path.join(self.dir, "config.tar.gz")
+		archive = tarfile.open(path, "w:gz")
+		for f in self.files:
+			archive.add(f, arcname = "./" + f)
+		archive.close()
+
+		session = nagctl.Session({"config":"/main.cfg", "archive":path, "verbose":0})
+		session.loadConfig()
+		self.assertEqual(self.pairs(session), self.expected())
+		# Hidden files are skipped as on disk.
+		self.assertEqual([f for f in session.files.keys() if os.path.basename(f)[0] == "."], [])
+
+	def test_loadConfig_zip(self):
+		"""loadConfig: read configuration from a zip archive"""
+
+		import zipfile
+
+		path = os.path.join(self.dir, "config.zip")
+		archive = zipfile.ZipFile(path, "w")
+		for f in self.files:
+			archive.write(f)
+		archive.close()
+
+		session = nagctl.Session({"config":"main.cfg", "archive":path, "verbose":0})
+		session.loadConfig()
+		self.assertEqual(self.pairs(session), self.expected())
+
+	def test_loadConfig_archive_order(self):
+		"""loadConfig: read object files in the order they are archived"""
+
+		import zipfile
+
+		path = os.path.join(self.dir, "config.zip")
+		archive = zipfile.ZipFile(path, "w")
+		archive.writestr("main.cfg", "cfg_dir=objects\n")
+		archive.writestr("objects/b.cfg", "define host {\n host_name beta\n}\n")
+		archive.writestr("objects/a.cfg", "define host {\n host_name alpha\n}\n")
+		archive.close()
+
+		session = nagctl.Session({"config":"main.cfg", "archive":path, "verbose":0})
+		session.loadConfig()
+		self.assertEqual(session.files.keys(), ["objects/b.cfg", "objects/a.cfg"])
+		self.assertEqual([h.getName() for h in session.hosts], ["beta", "alpha"])
+
+	def test_readArchive_members(self):
+		"""readArchive: keep only files configuration may read"""
+
+		import zipfile
+
+		path = os.path.join(self.dir, "config.zip")
+		archive = zipfile.ZipFile(path, "w")
+		archive.writestr("early.conf", "define host {\n host_name early\n}\n")
+		archive.writestr("notes.txt", "")
+		archive.writestr("main.cfg", "cfg_dir=objects\ncfg_file=early.conf\ncfg_file=objects/late.conf\n")
+		archive.writestr("objects/a.cfg", "define host {\n host_name alpha\n}\n")
+		archive.writestr("objects/.hidden.cfg", "")
+		archive.writestr("objects/late.conf", "define host {\n host_name late\n}\n")
+		archive.writestr("objects/image.png", "")
+		archive.close()
+
+		session = nagctl.Session({"config":"main.cfg", "verbose":0})
+		self.assertEqual(session.readArchive(path).keys(), ["early.conf", "main.cfg", "objects/a.cfg", "objects/late.conf"])
+		session.conf["archive"] = path
+		session.loadConfig()
+		self.assertEqual(sorted([h.getName() for h in session.hosts]), ["alpha", "early", "late"])
+
+	def test_loadConfig_bogus(self):
+		"""loadConfig: fail on archives that can't be read"""
+
+		session = nagctl.Session({"config":"main.cfg", "archive":"hosts.cfg", "verbose":0})
+		self.assertRaises(nagctl.NagctlError, session.loadConfig)
+
+	def test_loadTree(self):
+		"""loadTree: read configuration from a dictionary of files"""
+
+		session = nagctl.Session({"config":"nagios.cfg", "verbose":0})
+		session.loadTree({
+			"nagios.cfg" : "cfg_dir=/objects\ncfg_file=extra.cfg\n",
+			"objects/b.cfg" : "define host {\n\thost_name\tbeta\n}\n",
+			"objects/a/a.cfg" : "define host {\n\thost_name\talpha\n}\n",
+			"objects/.hidden.cfg" : "define host {\n\thost_name\thidden\n}\n",
+			"objects/notes.txt" : "define host {\n\thost_name\tnotes\n}\n",
+			"./extra.cfg" : "define service {\n\tservice_description\tSSH\n\thost_name\t*\n}\n"
+		})
+		self.assertEqual(session.files.keys(), ["objects/a/a.cfg", "objects/b.cfg", "extra.cfg"])
+		self.assertEqual(self.pairs(session), [("alpha", ["SSH"]), ("beta", ["SSH"])])
+
+
+class Session_submit(TempDirTestCase):
+	def setUp(self):
+		TempDirTestCase.setUp(self)
+		self.session = nagctl.Session({"config":"main.cfg", "verbose":0})
+		self.session.loadConfig()
+		self.session.conf["command_file"] = os.path.join(self.dir, "nagios.cmd")
+
+	def submit(self, records):
+		path = os.path.join(self.dir, "results")
+		fh = open(path, "w")
+		try:
+			fh.write("\n".join(records) + "\n")
+		finally:
+			fh.close()
+		return self.session.submitResults(path)
+
+	def readCommands(self, path = None):
+		fh = open(path or self.session.conf["command_file"], "r")
+		try:
+			return [l.split(" ", 1)[1] for l in fh.read().splitlines()]
+		finally:
+			fh.close()
+
+	def test_submitResults(self):
+		"""submitResults: write results of known objects to command file"""
+
+		rejected = self.submit([
+			"database0;CPU;2;CRITICAL - load 12; 10; 8",
+			"database0;;0;PING OK",
+			"",
+			"nonexisting;;0;PING OK",
+			"database0;nonexisting;0;OK",
+			"database0;CPU;4;what",
+			"database0;;3;UNKNOWN",
+			"database0"
+		])
+		self.assertEqual(rejected, 5)
+		self.assertEqual(self.readCommands(), [
+			"PROCESS_SERVICE_CHECK_RESULT;database0;CPU;2;CRITICAL - load 12; 10; 8",
+			"PROCESS_HOST_CHECK_RESULT;database0;0;PING OK"
+		])
+
+	def test_submitResults_selected(self):
+		"""submitResults: reject results of objects not matching selectors"""
+
+		self.session.conf["host"] = "database1"
+		self.assertEqual(self.submit(["database0;CPU;0;OK", "database1;CPU;0;OK"]), 1)
+		self.assertEqual(self.readCommands(), ["PROCESS_SERVICE_CHECK_RESULT;database1;CPU;0;OK"])
+
+	def test_submitResults_file(self):
+		"""submitResults: pass large batches with PROCESS_FILE"""
+
+		self.session.conf["profile"] = True
+		saved = (nagctl.submit_threshold, nagctl.submit_file_size)
+		(nagctl.submit_threshold, nagctl.submit_file_size) = (2, 3)
+		try:
+			self.assertEqual(self.submit(["database%u;CPU;0;OK %u" % (i % 2, i) for i in range(0, 5)]), 0)
+		finally:
+			(nagctl.submit_threshold, nagctl.submit_file_size) = saved
+
+		commands = self.readCommands()
+		self.assertEqual(len(commands), 2)
+		(command, path, delete) = commands[0].split(";")
+		self.assertEqual((command, delete), ("PROCESS_FILE", "1"))
+		self.assertEqual(self.readCommands(path), ["PROCESS_SERVICE_CHECK_RESULT;database%u;CPU;0;OK %u" % (i % 2, i) for i in range(0, 4)])
+		self.assertEqual(commands[1], "PROCESS_SERVICE_CHECK_RESULT;database0;CPU;0;OK 4")
+		# Spooled results count as written as well as PROCESS_FILE.
+		self.assertEqual(self.session.getCounters()["commands written"], 6)
+
+	def test_runArguments_instances(self):
+		"""runArguments: refuse to submit results to many instances"""
+
+		session = nagctl.Session({"instances":["main.cfg", "other.cfg"], "verbose":0})
+		try:
+			nagctl.runArguments(session, ["submit", "results"])
+		except nagctl.NagctlError, error:
+			self.assertEqual(str(error), "Submit can't be run against many instances")
+		else:
+			self.fail("NagctlError not raised")
+
+
+class Session_deleteDowntime(unittest.TestCase):
+	def setUp(self):
+		import tempfile
+
+		(fd, self.status) = tempfile.mkstemp()
+		fh = os.fdopen(fd, "w")
+		try:
+			for (kind, host, service, id, author, comment) in (
+				("host", "database0", None, 1, "nagctl", "upgrade"),
+				("service", "database0", "CPU", 2, "nagctl", "upgrade"),
+				("host", "database1", None, 3, "nagctl", "upgrade"),
+				("service", "universe", "SMTP", 4, "admin", "manual")
+			):
+				fh.write("%sdowntime {\n\thost_name=%s\n" % (kind, host))
+				if not service is None:
+					fh.write("\tservice_description=%s\n" % (service))
+				fh.write("\tdowntime_id=%u\n\tauthor=%s\n\tcomment=%s\n\t}\n\n" % (id, author, comment))
+		finally:
+			fh.close()
+		self.session = nagctl.Session({"config":"main.cfg", "verbose":0})
+		self.session.loadConfig()
+		self.session.conf["status_file"] = self.status
+
+	def tearDown(self):
+		os.unlink(self.status)
+
+	def test_deleteDowntime_hosts(self):
+		"""deleteDowntime: delete every downtime of covered hosts by host name"""
+
+		self.session.conf["host"] = "database.*"
+		commands = self.session.deleteDowntime(["delete", "downtime"], "all")
+		self.assertEqual(commands, ["DEL_DOWNTIME_BY_HOST_NAME;database0", "DEL_DOWNTIME_BY_HOST_NAME;database1"])
+
+	def test_deleteDowntime_hostgroup(self):
+		"""deleteDowntime: delete downtimes of covered hostgroups by hostgroup name"""
+
+		self.session.conf["author"] = ""
+		commands = self.session.deleteDowntime(["delete", "downtime"], "all")
+		self.assertEqual(commands, ["DEL_DOWNTIME_BY_HOSTGROUP_NAME;databases"])
+
+	def test_deleteDowntime_ids(self):
+		"""deleteDowntime: delete downtimes by id when other ones would go too"""
+
+		self.session.conf["host"] = "database0"
+		self.session.conf["prune"] = True
+		commands = self.session.runCommand(self.session.deleteDowntime, ["delete", "downtime", "upgrade"], "service")
+		self.assertEqual(commands, ["DEL_SVC_DOWNTIME;2"])
+
+		self.session.conf["host"] = None
+		self.assertEqual(self.session.deleteDowntime(["delete", "downtime", "manual"], "all"), [])
+		self.session.conf["author"] = "admin"
+		self.assertEqual(self.session.deleteDowntime(["delete", "downtime", "manual"], "all"), ["DEL_DOWNTIME_BY_HOST_NAME;universe"])
+
+	def test_deleteDowntime_nested(self):
+		"""deleteDowntime: keep hostgroups with unselected nested members"""
+
+		session = nagctl.Session({"config":"nagios.cfg", "verbose":0})
+		session.loadTree({
+			"nagios.cfg" : "cfg_file=objects.cfg\n",
+			"objects.cfg" : "".join(["define host {\n\thost_name\th%u\n}\n" % (i) for i in range(1, 4)]) +
+				"define service {\n\tservice_description\tSSH\n\thost_name\t*\n}\n" +
+				"define hostgroup {\n\thostgroup_name\tinner\n\tmembers\th3\n}\n" +
+				"define hostgroup {\n\thostgroup_name\touter\n\tmembers\th1,h2\n\thostgroup_members\tinner\n}\n"
+		})
+		session.conf["status_file"] = self.status
+		fh = open(self.status, "w")
+		try:
+			for (host, id, author) in (("h1", 1, "nagctl"), ("h2", 2, "nagctl"), ("h3", 3, "admin")):
+				fh.write("hostdowntime {\n\thost_name=%s\n\tdowntime_id=%u\n\tauthor=%s\n\t}\n" % (host, id, author))
+		finally:
+			fh.close()
+
+		self.assertEqual(session.getHostgroupMembers()["outer"], set(["h1", "h2", "h3"]))
+		session.conf["host"] = "h[12]"
+		commands = session.deleteDowntime(["delete", "downtime"], "all")
+		self.assertEqual(commands, ["DEL_DOWNTIME_BY_HOST_NAME;h1", "DEL_DOWNTIME_BY_HOST_NAME;h2"])
+
+		session.conf["host"] = None
+		session.conf["author"] = ""
+		commands = session.deleteDowntime(["delete", "downtime"], "all")
+		self.assertEqual(commands, ["DEL_DOWNTIME_BY_HOSTGROUP_NAME;outer"])
+
+	def test_deleteDowntime_status(self):
+		"""deleteDowntime: fail without status file"""
+
+		self.session.conf["status_file"] = ""
+		self.assertRaises(nagctl.NagctlError, self.session.deleteDowntime, ["delete", "downtime"], "all")
+
+
 if __name__ == "__main__":
 	unittest.main()